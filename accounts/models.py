@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
+from django.contrib.postgres.indexes import GinIndex
 from django.utils.translation import gettext_lazy
 
 # Create your models here.
@@ -51,6 +52,8 @@ class User(AbstractUser):
     address = models.TextField(gettext_lazy('Địa chỉ'), blank=True)
     user_type = models.CharField(gettext_lazy('Loại người dùng'), max_length=10, choices=UserType.choices, default=UserType.CUSTOMER)
     is_active = models.BooleanField(gettext_lazy('Đang hoạt động'), default=True)
+    # Dùng cho ETag của các tài nguyên lồng thông tin người dùng (tên nha sĩ, bệnh nhân...)
+    updated_at = models.DateTimeField(gettext_lazy('Cập nhật lần cuối'), auto_now=True)
     
     USERNAME_FIELD = 'phone_number'
     REQUIRED_FIELDS = ['full_name']
@@ -60,6 +63,10 @@ class User(AbstractUser):
     class Meta:
         verbose_name = gettext_lazy('Người dùng')
         verbose_name_plural = gettext_lazy('Người dùng')
+        indexes = [
+            # Chỉ mục trigram (pg_trgm) cho tìm kiếm tên bệnh nhân
+            GinIndex(fields=['full_name'], name='user_full_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
 
     def __str__(self):
         return f"{self.full_name} ({self.phone_number})"
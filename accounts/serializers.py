@@ -1,8 +1,9 @@
 from rest_framework import serializers
+from core.serializers import DynamicFieldsMixin
 from .models import User, DentistProfile
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for User model."""
     
     password = serializers.CharField(write_only=True)
@@ -22,7 +23,7 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
-class UserPublicSerializer(serializers.ModelSerializer):
+class UserPublicSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for public User data."""
     
     class Meta:
@@ -58,7 +59,7 @@ class DentistProfileSerializer(serializers.ModelSerializer):
         fields = ('id', 'specialization')
 
 
-class DentistSerializer(serializers.ModelSerializer):
+class DentistSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for Dentist users with profile."""
     
     dentist_profile = DentistProfileSerializer(required=False)
@@ -69,6 +70,7 @@ class DentistSerializer(serializers.ModelSerializer):
         fields = ('id', 'phone_number', 'password', 'full_name', 'date_of_birth', 
                   'address', 'is_active', 'dentist_profile')
         read_only_fields = ('id', 'is_active')
+        expandable_fields = ('dentist_profile',)
     
     def create(self, validated_data):
         """Create and return a new dentist user instance with profile."""
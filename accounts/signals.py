@@ -1,4 +1,5 @@
-from django.db.models.signals import post_save
+from django.db import connections
+from django.db.models.signals import post_save, pre_migrate
 from django.dispatch import receiver
 from .models import User, DentistProfile
 
@@ -10,4 +11,17 @@ def create_dentist_profile(sender, instance, created, **kwargs):
     """
     if created and instance.user_type == User.UserType.DENTIST:
         if not hasattr(instance, 'dentist_profile'):
-            DentistProfile.objects.create(user=instance)
\ No newline at end of file
+            DentistProfile.objects.create(user=instance)
+
+
+@receiver(pre_migrate)
+def create_trigram_extension(sender, using, **kwargs):
+    """
+    Enable pg_trgm before migrating, the trigram GIN indexes depend on it.
+    """
+    if sender.name != 'accounts':
+        return
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
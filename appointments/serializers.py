@@ -3,9 +3,10 @@ from datetime import date, datetime, timedelta
 from django.utils import timezone
 from .models import Appointment, DentistSchedule, DentistTimeOff
 from accounts.serializers import UserPublicSerializer
+from core.serializers import DynamicFieldsMixin
 
 
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for Appointment model."""
     
     patient_detail = UserPublicSerializer(source='patient', read_only=True)
@@ -17,6 +18,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
                   'appointment_date', 'appointment_time', 'reason', 'status',
                   'created_at', 'updated_at')
         read_only_fields = ('id', 'created_at', 'updated_at')
+        expandable_fields = ('patient_detail', 'dentist_detail')
     
     def validate(self, data):
         """Custom validation for appointment creation."""
@@ -87,7 +89,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
         return data
 
 
-class DentistScheduleSerializer(serializers.ModelSerializer):
+class DentistScheduleSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for DentistSchedule model."""
     
     dentist_detail = UserPublicSerializer(source='dentist', read_only=True)
@@ -98,6 +100,7 @@ class DentistScheduleSerializer(serializers.ModelSerializer):
         fields = ('id', 'dentist', 'dentist_detail', 'weekday', 'weekday_display',
                   'start_time', 'end_time', 'is_available')
         read_only_fields = ('id', 'weekday_display')
+        expandable_fields = ('dentist_detail',)
     
     def validate(self, data):
         """Validate schedule time consistency."""
@@ -108,7 +111,7 @@ class DentistScheduleSerializer(serializers.ModelSerializer):
         return data
 
 
-class DentistTimeOffSerializer(serializers.ModelSerializer):
+class DentistTimeOffSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for DentistTimeOff model."""
     
     dentist_detail = UserPublicSerializer(source='dentist', read_only=True)
@@ -117,6 +120,7 @@ class DentistTimeOffSerializer(serializers.ModelSerializer):
         model = DentistTimeOff
         fields = ('id', 'dentist', 'dentist_detail', 'start_date', 'end_date', 'reason')
         read_only_fields = ('id',)
+        expandable_fields = ('dentist_detail',)
     
     def validate(self, data):
         """Validate date consistency."""
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Invoice, Payment
+from .models import Invoice, Payment, InvoicePdfBundle, AuditEvent, DailyClosing, DailyClosingLine
 
 # Register your models here.
 class PaymentInline(admin.TabularInline):
@@ -57,4 +57,44 @@ class PaymentAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         if not change:  # Nếu là tạo mới
             obj.staff = request.user
-        super().save_model(request, obj, form, change)
\ No newline at end of file
+        super().save_model(request, obj, form, change)
+
+@admin.register(InvoicePdfBundle)
+class InvoicePdfBundleAdmin(admin.ModelAdmin):
+    list_display = ('id', 'date_from', 'date_to', 'status', 'rendered_count', 'reused_count', 'created_at')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'file_path', 'manifest', 'rendered_count', 'reused_count',
+                       'error', 'requested_by', 'created_at', 'finished_at')
+
+@admin.register(AuditEvent)
+class AuditEventAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'user', 'method', 'path', 'status_code', 'duration_ms')
+    list_filter = ('method', 'status_code')
+    search_fields = ('path', 'user__phone_number', 'user__full_name')
+    readonly_fields = ('user', 'method', 'path', 'status_code', 'duration_ms', 'created_at')
+
+class DailyClosingLineInline(admin.TabularInline):
+    model = DailyClosingLine
+    extra = 0
+    can_delete = False
+    readonly_fields = ('staff', 'payment_method', 'payment_count', 'total_amount')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+@admin.register(DailyClosing)
+class DailyClosingAdmin(admin.ModelAdmin):
+    list_display = ('closing_date', 'payment_count', 'total_amount', 'closed_by', 'created_at')
+    date_hierarchy = 'closing_date'
+    readonly_fields = ('closing_date', 'payment_count', 'total_amount', 'closed_by', 'notes', 'created_at')
+    inlines = [DailyClosingLineInline]
+
+    # Bản chốt sổ chỉ được tạo qua API/lệnh close_day và không được sửa/xoá
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import uuid
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from medical_records.models import ExaminationService
+from pharmacy.models import PrescriptionItem
+
+from .models import Invoice
+from .reports import MONEY_FIELD
+
+# Các chiều của ma trận pivot: nha sĩ x dịch vụ hoặc nha sĩ x thuốc
+PIVOT_COLUMNS = ('service', 'medicine')
+
+# Phiên bản cache dùng chung cho mọi worker: chỉ đúng khi settings.CACHES là cache
+# chung giữa các tiến trình (DatabaseCache/Redis), không phải LocMemCache
+CACHE_VERSION_KEY = 'billing:revenue:version'
+CACHE_TIMEOUT = 15 * 60
+
+# Mặc định doanh thu tính trên hoá đơn chưa bị huỷ
+DEFAULT_STATUSES = (Invoice.InvoiceStatus.PENDING, Invoice.InvoiceStatus.PAID)
+
+
+def _new_version():
+    # Giá trị ngẫu nhiên thay vì bộ đếm: nếu khoá phiên bản bị cache loại bỏ (cull/hết hạn)
+    # thì phiên bản mới không thể trùng với phiên bản cũ còn kết quả trong cache
+    return uuid.uuid4().hex
+
+
+def _cache_version():
+    return cache.get_or_set(CACHE_VERSION_KEY, _new_version, timeout=None)
+
+
+def _bump_version():
+    cache.set(CACHE_VERSION_KEY, _new_version(), timeout=None)
+
+
+def invalidate_revenue_cache():
+    """
+    Đổi phiên bản khoá cache: mọi kết quả cũ không còn được đọc tới nữa.
+
+    Đổi ngay (cho request hiện tại) và đổi lại khi giao dịch commit: trong lúc chờ commit,
+    worker khác có thể đã tính lại báo cáo từ dữ liệu cũ và cache nó dưới phiên bản vừa đổi.
+    """
+    _bump_version()
+    transaction.on_commit(_bump_version)
+
+
+def _cache_key(params):
+    digest = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    return f'billing:revenue:{_cache_version()}:{digest}'
+
+
+def _line_revenue():
+    return Sum(F('price') * F('quantity'), output_field=MONEY_FIELD)
+
+
+def service_revenue_rows(date_from, date_to, statuses):
+    """Doanh thu dịch vụ gộp theo (nha sĩ, dịch vụ) - một truy vấn GROUP BY."""
+    return list(
+        ExaminationService.objects.filter(
+            examination__invoice__status__in=statuses,
+            examination__invoice__invoice_date__range=(date_from, date_to),
+        ).values(
+            dentist_id=F('examination__dentist_id'),
+            dentist_name=F('examination__dentist__full_name'),
+            item_id=F('service_id'),
+            item_name=F('service__name'),
+        ).annotate(
+            total_quantity=Sum('quantity'),
+            line_count=Count('id'),
+            revenue=_line_revenue(),
+        ).order_by()
+    )
+
+
+def medicine_revenue_rows(date_from, date_to, statuses):
+    """Doanh thu thuốc gộp theo (nha sĩ, thuốc) - một truy vấn GROUP BY."""
+    return list(
+        PrescriptionItem.objects.filter(
+            prescription__examination__invoice__status__in=statuses,
+            prescription__examination__invoice__invoice_date__range=(date_from, date_to),
+        ).values(
+            dentist_id=F('prescription__examination__dentist_id'),
+            dentist_name=F('prescription__examination__dentist__full_name'),
+            item_id=F('medicine_id'),
+            item_name=F('medicine__name'),
+        ).annotate(
+            total_quantity=Sum('quantity'),
+            line_count=Count('id'),
+            revenue=_line_revenue(),
+        ).order_by()
+    )
+
+
+def _rollup(rows, id_key, name_key, extra=()):
+    """Cộng dồn các dòng đã gộp theo một chiều, sắp xếp theo doanh thu giảm dần."""
+    totals = {}
+    for row in rows:
+        entry = totals.setdefault(row[id_key], {'id': row[id_key], 'name': row[name_key], 'revenue': 0})
+        entry['revenue'] += row['revenue']
+        for key in extra:
+            entry[key] = entry.get(key, 0) + row[key]
+    return sorted(totals.values(), key=lambda entry: entry['revenue'], reverse=True)
+
+
+def build_pivot(rows):
+    """
+    Ma trận nha sĩ (hàng) x dịch vụ/thuốc (cột) từ các dòng đã gộp trong SQL.
+    Số ô bằng số dòng trả về nên dựng trực tiếp bằng dict, không cần thư viện ngoài.
+    """
+    dentists = _rollup(rows, 'dentist_id', 'dentist_name')
+    items = _rollup(rows, 'item_id', 'item_name')
+    row_index = {dentist['id']: index for index, dentist in enumerate(dentists)}
+    column_index = {item['id']: index for index, item in enumerate(items)}
+
+    values = [[0] * len(items) for _ in dentists]
+    for row in rows:
+        values[row_index[row['dentist_id']]][column_index[row['item_id']]] += row['revenue']
+
+    return {
+        'rows': [{'id': dentist['id'], 'name': dentist['name']} for dentist in dentists],
+        'columns': [{'id': item['id'], 'name': item['name']} for item in items],
+        'values': values,
+        'row_totals': [dentist['revenue'] for dentist in dentists],
+        'column_totals': [item['revenue'] for item in items],
+    }
+
+
+def revenue_report(date_from, date_to, statuses=DEFAULT_STATUSES, pivot=None):
+    """
+    Doanh thu theo nha sĩ, theo dịch vụ và theo thuốc trong khoảng ngày hoá đơn.
+
+    Dữ liệu lấy từ hai truy vấn GROUP BY (dịch vụ và thuốc); `pivot` ('service' hoặc
+    'medicine') thêm ma trận nha sĩ x dịch vụ/thuốc. Kết quả được cache theo bộ tham số
+    và bị vô hiệu khi hoá đơn thay đổi (invalidate_revenue_cache).
+    """
+    statuses = sorted(statuses)
+    params = {'date_from': date_from, 'date_to': date_to, 'statuses': statuses, 'pivot': pivot}
+    key = _cache_key(params)
+    report = cache.get(key)
+    if report is not None:
+        return report
+
+    services = service_revenue_rows(date_from, date_to, statuses)
+    medicines = medicine_revenue_rows(date_from, date_to, statuses)
+
+    by_dentist = {
+        entry['id']: dict(entry, service_revenue=entry['revenue'], medicine_revenue=0)
+        for entry in _rollup(services, 'dentist_id', 'dentist_name')
+    }
+    for entry in _rollup(medicines, 'dentist_id', 'dentist_name'):
+        dentist = by_dentist.setdefault(
+            entry['id'], dict(entry, revenue=0, service_revenue=0, medicine_revenue=0)
+        )
+        dentist['medicine_revenue'] = entry['revenue']
+        dentist['revenue'] += entry['revenue']
+
+    service_total = sum(row['revenue'] for row in services)
+    medicine_total = sum(row['revenue'] for row in medicines)
+    report = {
+        'date_from': date_from,
+        'date_to': date_to,
+        'statuses': statuses,
+        'totals': {
+            'service_revenue': service_total,
+            'medicine_revenue': medicine_total,
+            'revenue': service_total + medicine_total,
+        },
+        'by_dentist': sorted(by_dentist.values(), key=lambda entry: entry['revenue'], reverse=True),
+        'by_service': _rollup(services, 'item_id', 'item_name', extra=('total_quantity', 'line_count')),
+        'by_medicine': _rollup(medicines, 'item_id', 'item_name', extra=('total_quantity', 'line_count')),
+    }
+    if pivot:
+        report['pivot'] = dict(build_pivot(services if pivot == 'service' else medicines), columns_type=pivot)
+
+    cache.set(key, report, CACHE_TIMEOUT)
+    return report
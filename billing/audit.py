@@ -0,0 +1,150 @@
+import atexit
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger('billing')
+
+# Logger riêng cho nhật ký thao tác: chỉ đẩy bản ghi vào hàng đợi, không ghi I/O
+audit_logger = logging.getLogger('billing.audit')
+
+DEFAULTS = {
+    'SINKS': ('file', 'db'),
+    'WRITER_THREAD': True,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 2.0,
+    'QUEUE_SIZE': 10000,
+}
+
+
+def get_audit_setting(name):
+    return getattr(settings, 'BILLING_AUDIT', {}).get(name, DEFAULTS[name])
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler bỏ qua bản ghi khi hàng đợi đầy thay vì chặn request. Số bản ghi bị
+    bỏ được AuditWriter báo vào log billing.
+    """
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+class AuditWriter(threading.Thread):
+    """
+    Thread nền lấy bản ghi từ hàng đợi và ghi theo lô ra file log
+    và/hoặc bảng AuditEvent. Với WRITER_THREAD=False thread không được khởi
+    động, bản ghi chỉ được ghi khi gọi flush().
+    """
+
+    def __init__(self, audit_queue):
+        super().__init__(name='billing-audit-writer', daemon=True)
+        self.queue = audit_queue
+        self.lock = threading.Lock()
+        self.reported_dropped = 0
+
+    def run(self):
+        while True:
+            try:
+                record = self.queue.get(timeout=get_audit_setting('FLUSH_INTERVAL'))
+            except queue.Empty:
+                self.report_dropped()
+                continue
+            try:
+                self.flush(first=record)
+            finally:
+                # Chỉ thread ghi mới dọn kết nối của chính nó; flush() gọi từ thread khác
+                # (atexit, test) có thể đang nằm trong transaction của bên gọi
+                close_old_connections()
+
+    def report_dropped(self):
+        """Ghi cảnh báo số bản ghi bị bỏ (hàng đợi đầy) kể từ lần báo trước."""
+        dropped = DroppingQueueHandler.dropped
+        if dropped > self.reported_dropped:
+            logger.warning(
+                f"Hàng đợi nhật ký thanh toán đầy: đã bỏ {dropped - self.reported_dropped} bản ghi "
+                f"(tổng cộng {dropped})"
+            )
+            self.reported_dropped = dropped
+
+    def flush(self, first=None):
+        """Lấy tối đa BATCH_SIZE bản ghi đang chờ và ghi chúng trong một lần."""
+        with self.lock:
+            batch = [first] if first is not None else []
+            batch_size = get_audit_setting('BATCH_SIZE')
+            while len(batch) < batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    write_events([record.audit for record in batch])
+                except Exception:
+                    logger.exception(f"Không ghi được {len(batch)} bản ghi nhật ký thanh toán")
+            self.report_dropped()
+            return len(batch)
+
+
+def write_events(events):
+    """Ghi một lô sự kiện ra các đích đã cấu hình (file log, bảng AuditEvent)."""
+    from .models import AuditEvent
+
+    sinks = get_audit_setting('SINKS')
+    if 'file' in sinks:
+        for event in events:
+            logger.info(
+                f"[{event['created_at']}] User {event['user_id']} performed {event['method']} "
+                f"on {event['path']} -> {event['status_code']} ({event['duration_ms']:.1f} ms)"
+            )
+
+    if 'db' in sinks:
+        AuditEvent.objects.bulk_create(
+            [AuditEvent(**event) for event in events],
+            batch_size=get_audit_setting('BATCH_SIZE')
+        )
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def start_audit_writer():
+    """Gắn QueueHandler vào audit_logger và khởi động thread ghi (chỉ một lần)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            audit_queue = queue.Queue(maxsize=get_audit_setting('QUEUE_SIZE'))
+            audit_logger.addHandler(DroppingQueueHandler(audit_queue))
+            audit_logger.setLevel(logging.INFO)
+            audit_logger.propagate = False
+
+            _writer = AuditWriter(audit_queue)
+            if get_audit_setting('WRITER_THREAD'):
+                _writer.start()
+                atexit.register(flush)
+    return _writer
+
+
+def flush():
+    """Ghi ngay toàn bộ bản ghi đang chờ (dùng khi tắt tiến trình và trong test)."""
+    if _writer is not None:
+        while _writer.flush():
+            pass
+
+
+def enqueue(event):
+    """Đưa một sự kiện vào hàng đợi; không bao giờ chặn hoặc truy cập đĩa/DB."""
+    start_audit_writer()
+    audit_logger.info('billing audit event', extra={'audit': event})
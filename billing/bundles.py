@@ -0,0 +1,186 @@
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+
+from django.conf import settings
+from django.db import connection
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Invoice, InvoicePdfBundle
+from .pdf import html_to_pdf
+
+logger = logging.getLogger('billing')
+
+INVOICE_TEMPLATE = 'billing/invoice_print.html'
+
+# Số hoá đơn lấy từ DB mỗi lần để render HTML (giới hạn bộ nhớ)
+CHUNK_SIZE = 200
+
+
+def get_invoice_print_context(invoice):
+    """Tạo context cho template in hoá đơn (dùng cho cả trang in và file PDF)."""
+    examination = invoice.examination
+    medicines = []
+    if hasattr(examination, 'prescription'):
+        medicines = examination.prescription.items.all()
+
+    return {
+        'invoice': invoice,
+        'services': examination.services.all(),
+        'medicines': medicines,
+    }
+
+
+def get_print_queryset():
+    """Queryset hoá đơn đã nạp sẵn toàn bộ dữ liệu cần cho template in."""
+    return Invoice.objects.select_related(
+        'patient',
+        'examination__prescription',
+    ).prefetch_related(
+        'examination__services__service',
+        'examination__prescription__items__medicine',
+    )
+
+
+def _iter_invoice_html(invoice_ids):
+    """Render HTML từng hoá đơn theo lô, mỗi lô chỉ tốn một nhóm truy vấn cố định."""
+    for start in range(0, len(invoice_ids), CHUNK_SIZE):
+        chunk = invoice_ids[start:start + CHUNK_SIZE]
+        for invoice in get_print_queryset().filter(pk__in=chunk):
+            html = render_to_string(INVOICE_TEMPLATE, get_invoice_print_context(invoice))
+            yield invoice, html
+
+
+def _get_previous_bundle(bundle):
+    """Lấy gói hoàn thành gần nhất cùng khoảng ngày để dùng lại các PDF không đổi."""
+    previous = InvoicePdfBundle.objects.filter(
+        status=InvoicePdfBundle.BundleStatus.COMPLETED,
+        date_from=bundle.date_from,
+        date_to=bundle.date_to,
+    ).exclude(pk=bundle.pk).order_by('-created_at').first()
+
+    if previous and previous.file_path and os.path.exists(previous.file_path):
+        return previous
+    return None
+
+
+def build_invoice_bundle(bundle, max_workers=None):
+    """
+    Xuất toàn bộ hoá đơn trong khoảng ngày của gói ra một file zip các PDF.
+
+    Hoá đơn có updated_at không đổi so với gói trước (cùng khoảng ngày) được
+    chép nguyên từ file zip cũ; các hoá đơn còn lại được render song song
+    trong ProcessPoolExecutor và ghi dần vào file zip.
+    """
+    bundle.status = InvoicePdfBundle.BundleStatus.RUNNING
+    bundle.save(update_fields=['status'])
+
+    try:
+        versions = dict(
+            Invoice.objects.filter(
+                invoice_date__range=(bundle.date_from, bundle.date_to)
+            ).values_list('id', 'updated_at')
+        )
+
+        previous = _get_previous_bundle(bundle) if bundle.incremental else None
+        previous_manifest = previous.manifest if previous else {}
+
+        reused_ids = []
+        rendered_ids = []
+        for invoice_id, updated_at in versions.items():
+            entry = previous_manifest.get(str(invoice_id))
+            if entry and entry['updated_at'] == updated_at.isoformat():
+                reused_ids.append(invoice_id)
+            else:
+                rendered_ids.append(invoice_id)
+
+        output_dir = settings.INVOICE_BUNDLE_DIR
+        os.makedirs(output_dir, exist_ok=True)
+        file_path = os.path.join(
+            output_dir,
+            f"invoices_{bundle.date_from:%Y%m%d}_{bundle.date_to:%Y%m%d}_{bundle.pk}.zip"
+        )
+
+        manifest = {}
+        # PDF đã được nén sẵn nên lưu dạng STORED để chép lại từ gói cũ không tốn CPU
+        with zipfile.ZipFile(file_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+            if reused_ids:
+                with zipfile.ZipFile(previous.file_path) as previous_archive:
+                    for invoice_id in reused_ids:
+                        entry = previous_manifest[str(invoice_id)]
+                        archive.writestr(entry['file'], previous_archive.read(entry['file']))
+                        manifest[str(invoice_id)] = entry
+
+            if rendered_ids:
+                _render_into_archive(archive, sorted(rendered_ids), manifest, max_workers)
+
+        bundle.file_path = file_path
+        bundle.manifest = manifest
+        bundle.rendered_count = len(rendered_ids)
+        bundle.reused_count = len(reused_ids)
+        bundle.status = InvoicePdfBundle.BundleStatus.COMPLETED
+        bundle.finished_at = timezone.now()
+        bundle.save()
+    except Exception as e:
+        bundle.status = InvoicePdfBundle.BundleStatus.FAILED
+        bundle.error = str(e)
+        bundle.finished_at = timezone.now()
+        bundle.save(update_fields=['status', 'error', 'finished_at'])
+        raise
+
+    return bundle
+
+
+def _render_into_archive(archive, invoice_ids, manifest, max_workers):
+    """Render PDF song song và ghi từng file vào zip ngay khi xong."""
+    max_workers = max_workers or os.cpu_count() or 1
+    # Giới hạn số HTML đang chờ render để không giữ toàn bộ lô trong bộ nhớ
+    max_in_flight = max_workers * 4
+
+    def write_result(future, invoice):
+        file_name = f"{invoice.invoice_number}.pdf"
+        archive.writestr(file_name, future.result())
+        manifest[str(invoice.pk)] = {
+            'updated_at': invoice.updated_at.isoformat(),
+            'file': file_name,
+        }
+
+    # Dùng 'spawn' vì job có thể chạy từ thread của web server; tiến trình con
+    # chỉ import billing.pdf nên không cần khởi tạo Django.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        pending = {}
+        for invoice, html in _iter_invoice_html(invoice_ids):
+            pending[pool.submit(html_to_pdf, html)] = invoice
+            if len(pending) >= max_in_flight:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write_result(future, pending.pop(future))
+
+        for future in as_completed(pending):
+            write_result(future, pending[future])
+
+
+def _run_bundle_job(bundle_id, max_workers=None):
+    try:
+        build_invoice_bundle(InvoicePdfBundle.objects.get(pk=bundle_id), max_workers)
+    except Exception:
+        logger.exception(f"Xuất gói PDF hoá đơn {bundle_id} thất bại")
+    finally:
+        connection.close()
+
+
+def start_bundle_job(bundle, max_workers=None):
+    """Chạy việc xuất gói PDF ở thread nền để request trả về ngay."""
+    thread = threading.Thread(
+        target=_run_bundle_job,
+        args=(bundle.pk, max_workers),
+        name=f'invoice-pdf-bundle-{bundle.pk}',
+        daemon=True,
+    )
+    thread.start()
+    return thread
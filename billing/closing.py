@@ -0,0 +1,119 @@
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import DailyClosing, DailyClosingLine, Payment
+
+
+class DailyClosingError(Exception):
+    """Lỗi khi chốt sổ cuối ngày (ngày chưa kết thúc, đã chốt...)."""
+
+
+def day_bounds(day):
+    """Khoảng thời gian [00:00 ngày day, 00:00 ngày hôm sau) theo múi giờ hiện tại."""
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    return start, start + datetime.timedelta(days=1)
+
+
+def ensure_day_open(moment):
+    """Khoản thu thuộc ngày đã chốt sổ thì không được sửa/xoá (bản chốt phải khớp sổ thu)."""
+    day = timezone.localtime(moment).date()
+    if DailyClosing.objects.filter(closing_date=day).exists():
+        raise DailyClosingError(f"Ngày {day} đã được chốt sổ, không thể thay đổi khoản thu.")
+
+
+def payment_totals(day):
+    """
+    Tổng thu trong ngày theo (nhân viên, hình thức thanh toán) - một truy vấn GROUP BY.
+    Lọc theo khoảng payment_date thay vì __date để dùng được chỉ mục.
+    """
+    start, end = day_bounds(day)
+    return list(
+        Payment.objects.filter(
+            payment_date__gte=start, payment_date__lt=end
+        ).values('staff_id', 'payment_method').annotate(
+            payment_count=Count('id'),
+            total_amount=Sum('amount'),
+        ).order_by('staff_id', 'payment_method')
+    )
+
+
+def close_day(day, closed_by, notes=''):
+    """
+    Chốt sổ ngày `day`: lưu tổng thu theo nhân viên và hình thức thanh toán thành
+    một bản chốt không thể sửa/xoá. Mỗi ngày chỉ chốt được một lần.
+
+    Chỉ chốt được ngày đã kết thúc: chốt giữa ngày sẽ bỏ sót các khoản thu sau đó
+    mà bản chốt thì không chốt lại được.
+    """
+    if day >= timezone.localdate():
+        raise DailyClosingError(f"Chỉ chốt sổ được ngày đã kết thúc ({day}).")
+
+    rows = payment_totals(day)
+    try:
+        with transaction.atomic():
+            closing = DailyClosing.objects.create(
+                closing_date=day,
+                payment_count=sum(row['payment_count'] for row in rows),
+                total_amount=sum(row['total_amount'] for row in rows),
+                closed_by=closed_by,
+                notes=notes,
+            )
+            DailyClosingLine.objects.bulk_create([
+                DailyClosingLine(closing=closing, **row) for row in rows
+            ])
+    except IntegrityError:
+        raise DailyClosingError(f"Ngày {day} đã được chốt sổ.")
+    return closing
+
+
+def closing_summary(date_from, date_to):
+    """
+    Tổng thu trong khoảng ngày đọc từ các bản chốt sổ (không quét lại Payment),
+    kèm danh sách các ngày chưa chốt sổ.
+    """
+    lines = list(
+        DailyClosingLine.objects.filter(
+            closing__closing_date__range=(date_from, date_to)
+        ).values('staff_id', 'staff__full_name', 'payment_method').annotate(
+            payment_count=Sum('payment_count'),
+            total_amount=Sum('total_amount'),
+        ).order_by('staff_id', 'payment_method')
+    )
+    closed_dates = set(
+        DailyClosing.objects.filter(
+            closing_date__range=(date_from, date_to)
+        ).values_list('closing_date', flat=True)
+    )
+    days = (date_to - date_from).days + 1
+    missing_dates = [
+        day for day in (date_from + datetime.timedelta(days=offset) for offset in range(days))
+        if day not in closed_dates
+    ]
+
+    by_method = {}
+    for line in lines:
+        method = by_method.setdefault(line['payment_method'], {'payment_count': 0, 'total_amount': 0})
+        method['payment_count'] += line['payment_count']
+        method['total_amount'] += line['total_amount']
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'payment_count': sum(line['payment_count'] for line in lines),
+        'total_amount': sum(line['total_amount'] for line in lines),
+        'by_method': by_method,
+        'by_staff': [
+            {
+                'staff_id': line['staff_id'],
+                'staff_name': line['staff__full_name'],
+                'payment_method': line['payment_method'],
+                'payment_count': line['payment_count'],
+                'total_amount': line['total_amount'],
+            }
+            for line in lines
+        ],
+        'missing_dates': missing_dates,
+    }
@@ -0,0 +1,44 @@
+import csv
+import os
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from billing.reports import AGING_BUCKETS, aging_report
+
+class Command(BaseCommand):
+    help = 'Accounts-receivable aging report (0-30, 31-60, 61-90, 90+ days)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', type=str, help='Report date, format YYYY-MM-DD (default: today)')
+        parser.add_argument('--output', type=str, help='Write the per-patient report to this CSV file')
+
+    def handle(self, *args, **options):
+        as_of = None
+        if options['as_of']:
+            try:
+                as_of = datetime.strptime(options['as_of'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(f'Invalid date "{options["as_of"]}", expected YYYY-MM-DD')
+
+        report = aging_report(as_of=as_of)
+        bucket_keys = [key for key, _, _ in AGING_BUCKETS]
+        header = ['Bệnh nhân', 'Điện thoại', 'Số hóa đơn'] + bucket_keys + ['Tổng nợ']
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(header)
+                for patient in report['patients']:
+                    writer.writerow(
+                        [patient['patient_name'], patient['phone_number'], patient['invoice_count']] +
+                        [patient[key] for key in bucket_keys] +
+                        [patient['total_outstanding']]
+                    )
+            self.stdout.write(self.style.SUCCESS(
+                f'Exported {len(report["patients"])} patients to {os.path.abspath(options["output"])}'
+            ))
+
+        totals = report['totals']
+        self.stdout.write(f'Aging as of {report["as_of"]} ({totals["invoice_count"]} invoices)')
+        for key in bucket_keys:
+            self.stdout.write(f'  {key:<14} {totals[key]:>15,}')
+        self.stdout.write(self.style.SUCCESS(f'  {"total":<14} {totals["total_outstanding"]:>15,}'))
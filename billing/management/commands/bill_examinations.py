@@ -0,0 +1,44 @@
+from datetime import date, datetime
+from django.core.management.base import BaseCommand, CommandError
+from billing.services import BATCH_BILLING_CHUNK_SIZE, bill_examinations
+
+class Command(BaseCommand):
+    help = 'Create the missing invoices for examinations in a date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=str, help='Examination date, format YYYY-MM-DD (default: today)')
+        parser.add_argument('--date-from', type=str, help='Start date, format YYYY-MM-DD')
+        parser.add_argument('--date-to', type=str, help='End date, format YYYY-MM-DD')
+        parser.add_argument('--chunk-size', type=int, default=BATCH_BILLING_CHUNK_SIZE,
+                           help='Examinations billed per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the unbilled examinations')
+
+    def _parse_date(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Invalid date "{value}", expected YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        if options['date_from'] or options['date_to']:
+            if not (options['date_from'] and options['date_to']):
+                raise CommandError('--date-from and --date-to must be used together')
+            date_from, date_to = self._parse_date(options['date_from']), self._parse_date(options['date_to'])
+        else:
+            date_from = date_to = self._parse_date(options['date']) if options['date'] else date.today()
+        if date_from > date_to:
+            raise CommandError('--date-from must not be after --date-to')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        result = bill_examinations(
+            date_from, date_to, dry_run=options['dry_run'], chunk_size=options['chunk_size']
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f'[dry run] {result["unbilled_count"]} examinations without invoice '
+                              f'between {date_from} and {date_to}')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result["created_count"]} invoices for examinations between {date_from} and {date_to}'
+        ))
@@ -0,0 +1,64 @@
+import calendar
+from datetime import date, datetime
+from django.core.management.base import BaseCommand, CommandError
+from billing.bundles import build_invoice_bundle
+from billing.models import InvoicePdfBundle
+
+class Command(BaseCommand):
+    help = 'Render invoice PDFs for a month (or date range) into a zip archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', type=str, help='Month to export, format YYYY-MM (default: previous month)')
+        parser.add_argument('--date-from', type=str, help='Start date, format YYYY-MM-DD')
+        parser.add_argument('--date-to', type=str, help='End date, format YYYY-MM-DD')
+        parser.add_argument('--workers', type=int, default=None,
+                           help='Number of rendering processes (default: CPU count)')
+        parser.add_argument('--full', action='store_true',
+                           help='Re-render every invoice instead of reusing unchanged PDFs')
+
+    def _parse_date(self, value):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Invalid date "{value}", expected YYYY-MM-DD')
+
+    def _get_range(self, options):
+        if options['date_from'] or options['date_to']:
+            if not (options['date_from'] and options['date_to']):
+                raise CommandError('--date-from and --date-to must be used together')
+            return self._parse_date(options['date_from']), self._parse_date(options['date_to'])
+
+        if options['month']:
+            try:
+                month_start = datetime.strptime(options['month'], '%Y-%m').date()
+            except ValueError:
+                raise CommandError(f'Invalid month "{options["month"]}", expected YYYY-MM')
+        else:
+            # Mặc định xuất tháng trước
+            today = date.today()
+            month_start = date(today.year - 1, 12, 1) if today.month == 1 else date(today.year, today.month - 1, 1)
+
+        last_day = calendar.monthrange(month_start.year, month_start.month)[1]
+        return month_start, month_start.replace(day=last_day)
+
+    def handle(self, *args, **options):
+        date_from, date_to = self._get_range(options)
+        if date_from > date_to:
+            raise CommandError('--date-from must not be after --date-to')
+
+        bundle = InvoicePdfBundle.objects.create(
+            date_from=date_from,
+            date_to=date_to,
+            incremental=not options['full']
+        )
+        self.stdout.write(f'Building invoice bundle {date_from} -> {date_to}')
+
+        try:
+            build_invoice_bundle(bundle, max_workers=options['workers'])
+        except Exception as e:
+            raise CommandError(f'Failed to build invoice bundle: {str(e)}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {bundle.rendered_count} invoices, reused {bundle.reused_count} '
+            f'unchanged PDFs -> {bundle.file_path}'
+        ))
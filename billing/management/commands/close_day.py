@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from accounts.models import User
+from billing.closing import DailyClosingError, close_day
+
+class Command(BaseCommand):
+    help = 'Close the day: snapshot payment totals per staff and payment method'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=str, help='Day to close, format YYYY-MM-DD (default: yesterday)')
+        parser.add_argument('--staff', type=str, required=True,
+                           help='Phone number of the staff member closing the day')
+        parser.add_argument('--notes', type=str, default='', help='Notes stored with the closing')
+
+    def handle(self, *args, **options):
+        day = timezone.localdate() - timedelta(days=1)
+        if options['date']:
+            try:
+                day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(f'Invalid date "{options["date"]}", expected YYYY-MM-DD')
+
+        try:
+            staff = User.objects.get(
+                phone_number=options['staff'],
+                user_type__in=[User.UserType.STAFF, User.UserType.ADMIN]
+            )
+        except User.DoesNotExist:
+            raise CommandError(f'Staff user not found with phone: {options["staff"]}')
+
+        try:
+            closing = close_day(day, closed_by=staff, notes=options['notes'])
+        except DailyClosingError as e:
+            raise CommandError(str(e))
+
+        for line in closing.lines.select_related('staff'):
+            self.stdout.write(
+                f'  {line.staff.full_name:<30} {line.get_payment_method_display():<15} '
+                f'{line.payment_count:>5} {line.total_amount:>15,}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Closed {day}: {closing.payment_count} payments, total {closing.total_amount:,}'
+        ))
@@ -4,6 +4,7 @@ from django.db import transaction
 from accounts.models import User
 from medical_records.models import Examination, MedicalRecord
 from billing.models import Invoice
+from billing.services import allocate_invoice_numbers
 
 class Command(BaseCommand):
     help = 'Import invoices from CSV file'
@@ -48,8 +49,7 @@ class Command(BaseCommand):
                                 continue
                             
                             # Tạo invoice number
-                            last_invoice = Invoice.objects.order_by('-id').first()
-                            invoice_number = f"INV-{(last_invoice.id + 1 if last_invoice else 1):06d}"
+                            invoice_number = allocate_invoice_numbers(1)[0]
                             
                             # Tạo hóa đơn mới
                             invoice = Invoice.objects.create(
@@ -0,0 +1,55 @@
+import csv
+import os
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import User
+from billing.reconciliation import reconcile_file
+
+class Command(BaseCommand):
+    help = 'Match a bank statement CSV to pending invoices and post the transfers as payments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', type=str, help='Bank statement CSV (date, amount, reference, description)')
+        parser.add_argument('--staff', type=str, required=True,
+                           help='Phone number of the staff member recording the payments')
+        parser.add_argument('--dry-run', action='store_true', help='Match lines without posting payments')
+        parser.add_argument('--unmatched-output', type=str, default='unmatched_lines.csv',
+                           help='Where to write the unmatched-lines report')
+
+    def handle(self, *args, **options):
+        try:
+            staff = User.objects.get(
+                phone_number=options['staff'],
+                user_type__in=[User.UserType.STAFF, User.UserType.ADMIN]
+            )
+        except User.DoesNotExist:
+            raise CommandError(f'Staff user not found with phone: {options["staff"]}')
+
+        try:
+            with open(options['csv_file'], 'r', encoding='utf-8-sig', newline='') as file:
+                result = reconcile_file(file, staff=staff, dry_run=options['dry_run'])
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(f'Failed to read statement: {str(e)}')
+
+        for line in result['matched']:
+            self.stdout.write(f'Line {line["line"]}: {line["amount"]} -> {line["invoice_number"]}')
+
+        if result['unmatched']:
+            output_file = options['unmatched_output']
+            with open(output_file, 'w', encoding='utf-8', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(['line', 'reason', 'date', 'amount', 'reference', 'description'])
+                for line in result['unmatched']:
+                    row = line.get('row', line)
+                    writer.writerow([
+                        line['line'], line['reason'], row.get('date', ''), row.get('amount', ''),
+                        row.get('reference', ''), row.get('description', '')
+                    ])
+            self.stdout.write(self.style.WARNING(
+                f'{result["unmatched_count"]} unmatched lines written to {os.path.abspath(output_file)}'
+            ))
+
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Posted {result["matched_count"]} payments, '
+            f'{result["paid_invoice_count"]} invoices fully paid'
+        ))
@@ -1,21 +1,29 @@
-import logging
+import time
 from django.utils import timezone
 
-logger = logging.getLogger('billing')
+from . import audit
 
 class BillingLogMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
+        # Khởi động thread ghi nhật ký nền một lần khi server khởi tạo middleware
+        audit.start_audit_writer()
 
     def __call__(self, request):
         # Xử lý trước khi view được gọi
+        started = time.perf_counter()
         response = self.get_response(request)
-        
-        # Ghi log các hoạt động liên quan đến thanh toán
-        if request.path.startswith('/api/billing/') and request.method in ['POST', 'PUT', 'DELETE']:
-            if request.user.is_authenticated:
-                logger.info(
-                    f"[{timezone.now()}] User {request.user.username} performed {request.method} on {request.path}"
-                )
-        
-        return response
\ No newline at end of file
+
+        # Ghi log các hoạt động liên quan đến thanh toán (chỉ đưa vào hàng đợi, không ghi file/DB tại đây)
+        if request.path.startswith('/api/billing/') and request.method in ['POST', 'PUT', 'PATCH', 'DELETE']:
+            user = getattr(request, 'user', None)
+            audit.enqueue({
+                'user_id': user.pk if user is not None and user.is_authenticated else None,
+                'method': request.method,
+                'path': request.path,
+                'status_code': response.status_code,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+                'created_at': timezone.now(),
+            })
+
+        return response
@@ -1,5 +1,7 @@
 
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from accounts.models import User
 from medical_records.models import Examination
@@ -52,26 +54,26 @@ class Invoice(models.Model):
         verbose_name = _('Hóa đơn')
         verbose_name_plural = _('Hóa đơn')
         ordering = ['-invoice_date', '-created_at']
+        indexes = [
+            # Phục vụ báo cáo tuổi nợ và các danh sách lọc theo trạng thái
+            models.Index(fields=['status', 'invoice_date'], name='invoice_status_date_idx'),
+            # Chỉ mục trigram (pg_trgm) cho tìm kiếm theo số hoá đơn
+            GinIndex(fields=['invoice_number'], name='invoice_number_trgm_idx', opclasses=['gin_trgm_ops']),
+            # ... và theo ghi chú hoá đơn
+            GinIndex(fields=['notes'], name='invoice_notes_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
     
     def __str__(self):
         return f"Hóa đơn: {self.invoice_number} - {self.patient.full_name}"
     
     def calculate_totals(self):
         """Tính toán tổng tiền hóa đơn."""
-        from medical_records.models import ExaminationService
-        from pharmacy.models import PrescriptionItem
+        from .services import compute_examination_totals
         
-        # Calculate services total
-        services = ExaminationService.objects.filter(examination=self.examination)
-        self.subtotal = sum(service.price * service.quantity for service in services)
-        
-        # Calculate medicine total if prescription exists
-        try:
-            prescription = self.examination.prescription
-            prescription_items = PrescriptionItem.objects.filter(prescription=prescription)
-            self.medicine_total = sum(item.price * item.quantity for item in prescription_items)
-        except:
-            self.medicine_total = 0
+        # Tổng dịch vụ và tổng thuốc được tính bằng một truy vấn gộp
+        self.subtotal, self.medicine_total = compute_examination_totals(
+            [self.examination_id]
+        ).get(self.examination_id, (0, 0))
         
         # Calculate total
         self.total = self.subtotal + self.medicine_total - self.discount + self.tax
@@ -100,6 +102,24 @@ class Invoice(models.Model):
         super().save(*args, **kwargs)
 
 
+class InvoiceNumberSequence(models.Model):
+    """
+    Bộ đếm số hoá đơn (một dòng duy nhất). Dòng được khoá (SELECT ... FOR UPDATE)
+    khi cấp số nên hai giao dịch đồng thời không bao giờ nhận cùng một số.
+    """
+
+    SINGLETON_ID = 1
+
+    last_number = models.PositiveBigIntegerField(_('Số hoá đơn cuối cùng'), default=0)
+
+    class Meta:
+        verbose_name = _('Bộ đếm số hoá đơn')
+        verbose_name_plural = _('Bộ đếm số hoá đơn')
+
+    def __str__(self):
+        return f"INV-{self.last_number:06d}"
+
+
 class Payment(models.Model):
     """Model sử dụng để lưu trữ thông tin thanh toán."""
     
@@ -114,7 +134,8 @@ class Payment(models.Model):
         on_delete=models.CASCADE,
         related_name='payments'
     )
-    payment_date = models.DateTimeField(_('Ngày thanh toán'), auto_now_add=True)
+    # Mặc định là lúc ghi nhận; đối soát sao kê ghi theo ngày giao dịch trên sao kê
+    payment_date = models.DateTimeField(_('Ngày thanh toán'), default=timezone.now, editable=False)
     amount = models.DecimalField(_('Số tiền'), max_digits=12, decimal_places=0)
     payment_method = models.CharField(
         _('Phương thức thanh toán'),
@@ -130,15 +151,26 @@ class Payment(models.Model):
         limit_choices_to={'user_type__in': [User.UserType.STAFF, User.UserType.ADMIN]}
     )
     notes = models.TextField(_('Ghi chú'), blank=True)
+    created_at = models.DateTimeField(_('Ngày tạo'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('Cập nhật lần cuối'), auto_now=True)
     
     class Meta:
         verbose_name = _('Thanh toán')
         verbose_name_plural = _('Thanh toán')
         ordering = ['-payment_date']
+        indexes = [
+            # Chỉ mục trigram (pg_trgm) cho tìm kiếm theo số tham chiếu
+            GinIndex(fields=['reference_number'], name='payment_reference_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]
     
     def __str__(self):
         return f"Thanh toán: {self.invoice.invoice_number} - {self.amount}"
     
+    @property
+    def payment_number(self):
+        """Số phiếu thanh toán theo định dạng PAY-XXXXXX."""
+        return f"PAY-{self.id:06d}" if self.id else None
+    
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
         
@@ -146,4 +178,162 @@ class Payment(models.Model):
         total_payments = sum(payment.amount for payment in self.invoice.payments.all())
         if total_payments >= self.invoice.total:
             self.invoice.status = Invoice.InvoiceStatus.PAID
-            self.invoice.save()
\ No newline at end of file
+            self.invoice.save()
+
+class InvoicePdfBundle(models.Model):
+    """Model lưu thông tin các lần xuất gói PDF hoá đơn (file zip)."""
+
+    class BundleStatus(models.TextChoices):
+        PENDING = 'PENDING', _('Chờ xử lý')
+        RUNNING = 'RUNNING', _('Đang xử lý')
+        COMPLETED = 'COMPLETED', _('Hoàn thành')
+        FAILED = 'FAILED', _('Thất bại')
+
+    date_from = models.DateField(_('Từ ngày'))
+    date_to = models.DateField(_('Đến ngày'))
+    status = models.CharField(
+        _('Trạng thái'),
+        max_length=20,
+        choices=BundleStatus.choices,
+        default=BundleStatus.PENDING
+    )
+    incremental = models.BooleanField(_('Chỉ render hoá đơn thay đổi'), default=True)
+    file_path = models.CharField(_('Đường dẫn file'), max_length=500, blank=True)
+    # Ánh xạ invoice_id -> updated_at (isoformat) của các hoá đơn có trong file zip
+    manifest = models.JSONField(_('Danh mục hoá đơn'), default=dict, blank=True)
+    rendered_count = models.PositiveIntegerField(_('Số hoá đơn đã render'), default=0)
+    reused_count = models.PositiveIntegerField(_('Số hoá đơn dùng lại'), default=0)
+    error = models.TextField(_('Lỗi'), blank=True)
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='invoice_pdf_bundles'
+    )
+    created_at = models.DateTimeField(_('Ngày tạo'), auto_now_add=True)
+    finished_at = models.DateTimeField(_('Hoàn thành lúc'), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _('Gói PDF hoá đơn')
+        verbose_name_plural = _('Gói PDF hoá đơn')
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Gói PDF hoá đơn {self.date_from} - {self.date_to} ({self.get_status_display()})"
+
+
+class AuditEvent(models.Model):
+    """Model lưu nhật ký các thao tác ghi dữ liệu trên API thanh toán."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='billing_audit_events'
+    )
+    method = models.CharField(_('Phương thức'), max_length=10)
+    path = models.CharField(_('Đường dẫn'), max_length=500)
+    status_code = models.PositiveSmallIntegerField(_('Mã trạng thái'))
+    duration_ms = models.FloatField(_('Thời gian xử lý (ms)'))
+    created_at = models.DateTimeField(_('Thời điểm'), default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = _('Nhật ký thanh toán')
+        verbose_name_plural = _('Nhật ký thanh toán')
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.method} {self.path} - {self.status_code}"
+
+
+class ClosingQuerySet(models.QuerySet):
+    """QuerySet của bản chốt sổ: chặn update()/delete() hàng loạt (không đi qua save/delete của model)."""
+
+    def update(self, **kwargs):
+        raise ValueError("Bản chốt sổ cuối ngày không được phép chỉnh sửa.")
+
+    def delete(self):
+        raise ValueError("Bản chốt sổ cuối ngày không được phép xoá.")
+
+
+class DailyClosing(models.Model):
+    """
+    Model lưu bản chốt sổ cuối ngày (tổng thu theo nhân viên và hình thức thanh toán).
+    Bản chốt không được sửa hay xoá; các báo cáo sau đó đọc từ đây thay vì quét lại Payment.
+    """
+
+    closing_date = models.DateField(_('Ngày chốt sổ'), unique=True)
+    payment_count = models.PositiveIntegerField(_('Số giao dịch'), default=0)
+    total_amount = models.DecimalField(_('Tổng thu'), max_digits=14, decimal_places=0, default=0)
+    closed_by = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        related_name='daily_closings'
+    )
+    notes = models.TextField(_('Ghi chú'), blank=True)
+    created_at = models.DateTimeField(_('Ngày tạo'), auto_now_add=True)
+
+    objects = ClosingQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = _('Chốt sổ cuối ngày')
+        verbose_name_plural = _('Chốt sổ cuối ngày')
+        ordering = ['-closing_date']
+
+    def __str__(self):
+        return f"Chốt sổ ngày {self.closing_date}: {self.total_amount}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Bản chốt sổ cuối ngày không được phép chỉnh sửa.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Bản chốt sổ cuối ngày không được phép xoá.")
+
+
+class DailyClosingLine(models.Model):
+    """Tổng thu của một nhân viên theo một hình thức thanh toán trong bản chốt sổ."""
+
+    closing = models.ForeignKey(
+        DailyClosing,
+        on_delete=models.PROTECT,
+        related_name='lines'
+    )
+    staff = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        related_name='daily_closing_lines'
+    )
+    payment_method = models.CharField(
+        _('Phương thức thanh toán'),
+        max_length=20,
+        choices=Payment.PaymentMethod.choices
+    )
+    payment_count = models.PositiveIntegerField(_('Số giao dịch'))
+    total_amount = models.DecimalField(_('Tổng thu'), max_digits=14, decimal_places=0)
+
+    objects = ClosingQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = _('Chi tiết chốt sổ')
+        verbose_name_plural = _('Chi tiết chốt sổ')
+        ordering = ['staff_id', 'payment_method']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['closing', 'staff', 'payment_method'], name='daily_closing_line_unique'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.closing.closing_date} - {self.staff_id} - {self.payment_method}: {self.total_amount}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Bản chốt sổ cuối ngày không được phép chỉnh sửa.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Bản chốt sổ cuối ngày không được phép xoá.")
@@ -0,0 +1,26 @@
+import io
+
+
+class PdfRenderError(Exception):
+    """Lỗi khi chuyển HTML hoá đơn sang PDF."""
+
+
+def html_to_pdf(html):
+    """
+    Chuyển HTML của trang in hoá đơn sang PDF.
+
+    Hàm này chạy trong tiến trình con của ProcessPoolExecutor nên chỉ
+    nhận chuỗi HTML và không được truy cập ORM.
+    """
+    try:
+        from xhtml2pdf import pisa
+    except ImportError as exc:
+        raise PdfRenderError(
+            "Chưa cài đặt xhtml2pdf, không thể xuất PDF (pip install xhtml2pdf)."
+        ) from exc
+
+    buffer = io.BytesIO()
+    result = pisa.CreatePDF(html, dest=buffer, encoding='utf-8')
+    if result.err:
+        raise PdfRenderError(f"xhtml2pdf trả về {result.err} lỗi khi render hoá đơn.")
+    return buffer.getvalue()
@@ -0,0 +1,202 @@
+import csv
+import datetime
+import re
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .analytics import invalidate_revenue_cache
+from .closing import day_bounds
+from .models import DailyClosing, Invoice, Payment
+
+# Số hoá đơn trong nội dung chuyển khoản, chấp nhận dấu cách/gạch dưới thay cho gạch ngang.
+# Chỉ một nhóm chữ số: 'INV-000012 45000' là số hoá đơn 000012 và số tiền 45000
+INVOICE_NUMBER_PATTERN = re.compile(r'\bINV[\s\-_]*[0-9]+')
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+
+def normalize_key(value):
+    """Bỏ ký tự phân cách để so khớp 'INV-000123', 'INV 000123', 'inv000123'."""
+    return re.sub(r'[^A-Z0-9]', '', value.upper())
+
+
+def parse_amount(value):
+    """Số tiền VNĐ không có phần thập phân: bỏ dấu phân cách hàng nghìn (, hoặc .)."""
+    value = (value or '').strip()
+    digits = re.sub(r'[^0-9]', '', value)
+    if not digits:
+        raise ValueError(f"Số tiền không hợp lệ: {value!r}")
+    amount = Decimal(digits)
+    return -amount if value.startswith('-') else amount
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Ngày không hợp lệ: {value!r}")
+
+
+def parse_statement(file):
+    """
+    Đọc sao kê ngân hàng dạng CSV với các cột: date, amount, reference, description.
+    Trả về danh sách dòng (đã chuẩn hoá) và danh sách dòng lỗi.
+    """
+    lines, errors = [], []
+    reader = csv.DictReader(file)
+    for line_number, row in enumerate(reader, start=2):
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        try:
+            amount = parse_amount(row.get('amount'))
+        except ValueError as e:
+            errors.append({'line': line_number, 'reason': 'invalid_amount', 'detail': str(e), 'row': row})
+            continue
+        try:
+            date = parse_date(row.get('date', ''))
+        except ValueError as e:
+            errors.append({'line': line_number, 'reason': 'invalid_date', 'detail': str(e), 'row': row})
+            continue
+        lines.append({
+            'line': line_number,
+            'date': date,
+            'amount': amount,
+            'reference': row.get('reference', ''),
+            'description': row.get('description', ''),
+        })
+    return lines, errors
+
+
+def _candidate_keys(line):
+    """Các khoá có thể là số hoá đơn trong số tham chiếu/nội dung của một dòng sao kê."""
+    text = f"{line['reference']} {line['description']}".upper()
+    keys = {normalize_key(match) for match in INVOICE_NUMBER_PATTERN.findall(text)}
+    keys.update(normalize_key(token) for token in text.split())
+    keys.discard('')
+    return keys
+
+
+def reconcile_statement(lines, staff, dry_run=False):
+    """
+    Đối soát các dòng sao kê với hoá đơn chờ thanh toán và ghi nhận thanh toán hàng loạt.
+
+    - Số hoá đơn và số tham chiếu đã dùng được nạp sẵn vào map (mỗi loại một truy vấn).
+    - Các thanh toán khớp được tạo bằng một lệnh bulk_create.
+    - Hoá đơn đã trả đủ được chuyển sang PAID bằng một lệnh UPDATE.
+    Thanh toán được ghi theo ngày giao dịch trên sao kê; dòng của ngày tương lai hoặc
+    ngày đã chốt sổ không được ghi. Các dòng không khớp được trả về kèm lý do.
+    """
+    invoice_map = {
+        normalize_key(number): invoice_id
+        for invoice_id, number in Invoice.objects.filter(
+            status=Invoice.InvoiceStatus.PENDING
+        ).values_list('id', 'invoice_number')
+    }
+    closed_days = set(
+        DailyClosing.objects.filter(closing_date__in={line['date'] for line in lines}).values_list(
+            'closing_date', flat=True
+        )
+    )
+    today = timezone.localdate()
+    used_references = set(
+        Payment.objects.filter(
+            reference_number__in=[line['reference'] for line in lines if line['reference']]
+        ).values_list('reference_number', flat=True)
+    )
+
+    unmatched = []
+    candidates = []
+    seen_references = set()
+    for line in lines:
+        reference = line['reference']
+        if line['amount'] <= 0:
+            unmatched.append(dict(line, reason='invalid_amount'))
+        elif line['date'] > today:
+            unmatched.append(dict(line, reason='future_date'))
+        elif line['date'] in closed_days:
+            unmatched.append(dict(line, reason='day_closed'))
+        elif reference and (reference in used_references or reference in seen_references):
+            unmatched.append(dict(line, reason='duplicate_reference'))
+        else:
+            matches = {invoice_map[key] for key in _candidate_keys(line) if key in invoice_map}
+            if len(matches) == 1:
+                candidates.append((line, matches.pop()))
+            else:
+                unmatched.append(dict(line, reason='ambiguous_invoice' if matches else 'no_invoice'))
+        if reference:
+            seen_references.add(reference)
+
+    matched = []
+    paid_invoice_ids = []
+    with transaction.atomic():
+        invoice_ids = {invoice_id for _, invoice_id in candidates}
+        # Khoá các hoá đơn khớp để số dư không bị thanh toán song song làm sai
+        invoices = {
+            invoice.id: invoice
+            for invoice in Invoice.objects.select_for_update().filter(
+                pk__in=invoice_ids, status=Invoice.InvoiceStatus.PENDING
+            ).only('id', 'invoice_number', 'total')
+        }
+        paid = dict(
+            Payment.objects.filter(invoice_id__in=invoices).values('invoice').annotate(
+                total=Sum('amount')
+            ).values_list('invoice', 'total')
+        )
+        remaining = {
+            invoice_id: invoice.total - paid.get(invoice_id, 0)
+            for invoice_id, invoice in invoices.items()
+        }
+
+        payments = []
+        for line, invoice_id in candidates:
+            if invoice_id not in invoices:
+                unmatched.append(dict(line, reason='no_invoice'))
+            elif line['amount'] > remaining[invoice_id]:
+                unmatched.append(dict(line, reason='exceeds_balance', remaining=remaining[invoice_id]))
+            else:
+                remaining[invoice_id] -= line['amount']
+                invoice = invoices[invoice_id]
+                matched.append(dict(line, invoice_id=invoice_id, invoice_number=invoice.invoice_number))
+                payments.append(Payment(
+                    invoice=invoice,
+                    payment_date=day_bounds(line['date'])[0],
+                    amount=line['amount'],
+                    payment_method=Payment.PaymentMethod.TRANSFER,
+                    reference_number=line['reference'],
+                    staff=staff,
+                    notes=f"Đối soát sao kê ngày {line['date']}: {line['description']}".strip()
+                ))
+
+        paid_invoice_ids = [invoice_id for invoice_id, balance in remaining.items() if balance <= 0]
+
+        if not dry_run:
+            Payment.objects.bulk_create(payments)
+            # update() bỏ qua auto_now nên cập nhật updated_at thủ công
+            Invoice.objects.filter(pk__in=paid_invoice_ids).update(
+                status=Invoice.InvoiceStatus.PAID,
+                updated_at=timezone.now()
+            )
+            if paid_invoice_ids:
+                invalidate_revenue_cache()
+
+    return {
+        'dry_run': dry_run,
+        'matched_count': len(matched),
+        'unmatched_count': len(unmatched),
+        'paid_invoice_count': len(paid_invoice_ids),
+        'matched': matched,
+        'unmatched': sorted(unmatched, key=lambda line: line['line']),
+    }
+
+
+def reconcile_file(file, staff, dry_run=False):
+    """Đọc file sao kê CSV (text) và đối soát; các dòng lỗi định dạng được đưa vào báo cáo không khớp."""
+    lines, errors = parse_statement(file)
+    result = reconcile_statement(lines, staff, dry_run=dry_run)
+    if errors:
+        result['unmatched'] = sorted(errors + result['unmatched'], key=lambda line: line['line'])
+        result['unmatched_count'] = len(result['unmatched'])
+    return result
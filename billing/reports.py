@@ -0,0 +1,103 @@
+from datetime import timedelta
+
+from django.db.models import Count, DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .closing import day_bounds
+from .models import Invoice, Payment
+
+# (khóa, số ngày tối thiểu, số ngày tối đa) - None là không giới hạn
+AGING_BUCKETS = (
+    ('days_0_30', 0, 30),
+    ('days_31_60', 31, 60),
+    ('days_61_90', 61, 90),
+    ('days_90_plus', 91, None),
+)
+
+MONEY_FIELD = DecimalField(max_digits=12, decimal_places=0)
+
+
+def _bucket_filter(as_of, min_days, max_days):
+    """Điều kiện lọc hoá đơn theo tuổi nợ (tính theo ngày hoá đơn)."""
+    condition = Q(invoice_date__lte=as_of - timedelta(days=min_days))
+    if max_days is not None:
+        condition &= Q(invoice_date__gte=as_of - timedelta(days=max_days))
+    return condition
+
+
+def outstanding_invoices(as_of=None):
+    """
+    Hoá đơn còn nợ vào cuối ngày `as_of`, kèm alias `outstanding` = total - tổng đã trả
+    tới hết ngày đó. Tổng đã trả được tính bằng subquery gộp trên Payment, không nạp
+    Payment lên Python.
+
+    Hoá đơn đang chờ thanh toán, hoặc đã thanh toán nhưng được chuyển sang PAID sau ngày
+    `as_of` (updated_at), vẫn được tính là còn nợ ở ngày đó. Hoá đơn đã huỷ không được tính.
+    """
+    as_of = as_of or timezone.now().date()
+    _, end = day_bounds(as_of)
+    paid = Payment.objects.filter(
+        invoice=OuterRef('pk'), payment_date__lt=end
+    ).values('invoice').annotate(total=Sum('amount')).values('total')
+
+    return Invoice.objects.filter(
+        Q(status=Invoice.InvoiceStatus.PENDING) | Q(status=Invoice.InvoiceStatus.PAID, updated_at__gte=end),
+        invoice_date__lte=as_of,
+    ).alias(
+        paid=Coalesce(Subquery(paid, output_field=MONEY_FIELD), Value(0), output_field=MONEY_FIELD),
+    ).alias(
+        outstanding=F('total') - F('paid'),
+    ).filter(outstanding__gt=0)
+
+
+def aging_report(as_of=None, patient_id=None):
+    """
+    Báo cáo tuổi nợ: số tiền còn nợ theo nhóm 0-30, 31-60, 61-90 và trên 90 ngày,
+    theo từng bệnh nhân và tổng cộng. Toàn bộ được tính trong một truy vấn GROUP BY.
+    """
+    as_of = as_of or timezone.now().date()
+    invoices = outstanding_invoices(as_of)
+    if patient_id:
+        invoices = invoices.filter(patient_id=patient_id)
+
+    buckets = {
+        key: Coalesce(
+            Sum('outstanding', filter=_bucket_filter(as_of, min_days, max_days)),
+            Value(0),
+            output_field=MONEY_FIELD
+        )
+        for key, min_days, max_days in AGING_BUCKETS
+    }
+    rows = list(
+        invoices.values(
+            'patient_id', 'patient__full_name', 'patient__phone_number'
+        ).annotate(
+            invoice_count=Count('id'),
+            total_outstanding=Sum('outstanding'),
+            **buckets
+        ).order_by('-total_outstanding')
+    )
+
+    patients = []
+    totals = {key: 0 for key, _, _ in AGING_BUCKETS}
+    totals.update(invoice_count=0, total_outstanding=0)
+    for row in rows:
+        patient = {
+            'patient_id': row['patient_id'],
+            'patient_name': row['patient__full_name'],
+            'phone_number': row['patient__phone_number'],
+            'invoice_count': row['invoice_count'],
+            'total_outstanding': row['total_outstanding'],
+        }
+        for key, _, _ in AGING_BUCKETS:
+            patient[key] = row[key]
+        for key in totals:
+            totals[key] += patient[key]
+        patients.append(patient)
+
+    return {
+        'as_of': as_of,
+        'totals': totals,
+        'patients': patients,
+    }
@@ -0,0 +1,68 @@
+from functools import reduce
+from operator import and_, or_
+
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F, Lookup, Value
+from django.db.models.functions import Greatest
+from rest_framework import filters
+
+
+class ILikeContains(Lookup):
+    """
+    `field ILIKE '%term%'`. Lookup icontains của Django sinh UPPER(field) LIKE ...
+    nên không dùng được chỉ mục gin_trgm_ops trên cột.
+    """
+
+    lookup_name = 'ilike_contains'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', (*lhs_params, *rhs_params)
+
+
+class TrigramSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter dùng chỉ mục trigram (pg_trgm) trên PostgreSQL.
+
+    Chỉ tìm trên các trường khai báo trong `trigram_search_fields` của view
+    (các trường đã có GIN gin_trgm_ops). Một dòng khớp nếu mọi từ khoá đều có
+    trong một trong các trường (ILIKE '%...%' như SearchFilter gốc; chỉ mục
+    gin_trgm_ops dùng được cho ILIKE nên không quét toàn bảng) hoặc cả cụm từ
+    gần giống một từ trong trường (`%>`, word similarity, chấp nhận gõ sai),
+    rồi xếp hạng theo độ tương đồng. Nhờ ILIKE, từ khoá ngắn hoặc một phần số
+    hoá đơn vẫn khớp. Nếu view không khai báo hoặc CSDL không phải PostgreSQL
+    thì dùng SearchFilter gốc.
+
+    Nên đặt sau OrderingFilter trong filter_backends: khi client không truyền
+    tham số ordering, kết quả được sắp theo độ tương đồng.
+    """
+
+    def search_condition(self, fields, terms):
+        contains = reduce(and_, (
+            reduce(or_, (
+                ILikeContains(F(field), Value(f'%{connection.ops.prep_for_like_query(term)}%'))
+                for field in fields
+            ))
+            for term in terms
+        ))
+        similar = reduce(or_, (TrigramWordSimilar(F(field), Value(' '.join(terms))) for field in fields))
+        return contains | similar
+
+    def filter_queryset(self, request, queryset, view):
+        fields = getattr(view, 'trigram_search_fields', None)
+        terms = self.get_search_terms(request)
+        if not fields or not terms or connection.vendor != 'postgresql':
+            return super().filter_queryset(request, queryset, view)
+
+        term = ' '.join(terms)
+        similarities = [TrigramWordSimilarity(term, field) for field in fields]
+        rank = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+        queryset = queryset.filter(self.search_condition(fields, terms)).annotate(search_rank=rank)
+
+        # Giữ thứ tự client yêu cầu, nếu không thì xếp theo độ tương đồng
+        if request.query_params.get(filters.OrderingFilter.ordering_param):
+            return queryset
+        return queryset.order_by('-search_rank', *queryset.query.order_by)
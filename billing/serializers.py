@@ -1,10 +1,12 @@
 from rest_framework import serializers
-from .models import Invoice, Payment
+from .models import Invoice, Payment, InvoicePdfBundle, DailyClosing, DailyClosingLine
+from .services import allocate_invoice_numbers
 from accounts.serializers import UserPublicSerializer
+from core.serializers import DynamicFieldsMixin
 from medical_records.serializers import ExaminationSerializer
 
 
-class InvoiceSerializer(serializers.ModelSerializer):
+class InvoiceSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for Invoice model."""
     
     patient_detail = UserPublicSerializer(source='patient', read_only=True)
@@ -22,8 +24,9 @@ class InvoiceSerializer(serializers.ModelSerializer):
                   'status_display', 'subtotal', 'medicine_total', 'discount', 'tax', 
                   'total', 'total_paid', 'remaining_balance', 'payment_status_percent',
                   'notes', 'created_at', 'updated_at')
-        read_only_fields = ('id', 'invoice_date', 'subtotal', 'medicine_total', 
+        read_only_fields = ('id', 'staff', 'invoice_date', 'subtotal', 'medicine_total', 
                            'total', 'created_at', 'updated_at')
+        expandable_fields = ('examination_detail', 'patient_detail', 'staff_detail')
     
     def get_total_paid(self, obj):
         """Calculate total amount paid for this invoice."""
@@ -44,9 +47,7 @@ class InvoiceSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """Create new invoice with auto-generated invoice number."""
         # Generate a unique invoice number
-        last_invoice = Invoice.objects.order_by('-id').first()
-        invoice_number = f"INV-{(last_invoice.id + 1 if last_invoice else 1):06d}"
-        validated_data['invoice_number'] = invoice_number
+        validated_data['invoice_number'] = allocate_invoice_numbers(1)[0]
         
         instance = super().create(validated_data)
         # Calculate totals
@@ -63,7 +64,7 @@ class InvoiceListSerializer(InvoiceSerializer):
                   'remaining_balance', 'payment_status_percent')
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for Payment model."""
     
     invoice_detail = InvoiceSerializer(source='invoice', read_only=True)
@@ -76,16 +77,8 @@ class PaymentSerializer(serializers.ModelSerializer):
         fields = ('id', 'invoice', 'invoice_detail', 'staff', 'staff_detail', 
                   'payment_date', 'payment_number', 'payment_method', 'payment_method_display',
                   'amount', 'reference_number', 'notes', 'created_at', 'updated_at')
-        read_only_fields = ('id', 'payment_date', 'payment_number', 'created_at', 'updated_at')
-    
-    def create(self, validated_data):
-        """Create payment with auto-generated payment number."""
-        # Generate a unique payment number
-        last_payment = Payment.objects.order_by('-id').first()
-        payment_number = f"PAY-{(last_payment.id + 1 if last_payment else 1):06d}"
-        validated_data['payment_number'] = payment_number
-        
-        return super().create(validated_data)
+        read_only_fields = ('id', 'staff', 'payment_date', 'payment_number', 'created_at', 'updated_at')
+        expandable_fields = ('invoice_detail', 'staff_detail')
     
     def validate(self, data):
         """Validate payment data."""
@@ -108,7 +101,7 @@ class PaymentSerializer(serializers.ModelSerializer):
         return data
 
 
-class PaymentListSerializer(serializers.ModelSerializer):
+class PaymentListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Simplified serializer for listing payments."""
     
     invoice_number = serializers.CharField(source='invoice.invoice_number', read_only=True)
@@ -120,4 +113,50 @@ class PaymentListSerializer(serializers.ModelSerializer):
         model = Payment
         fields = ('id', 'payment_number', 'invoice_number', 'patient_name', 
                   'staff_name', 'payment_date', 'amount', 'payment_method', 
-                  'payment_method_display')
\ No newline at end of file
+                  'payment_method_display')
+
+class InvoicePdfBundleSerializer(serializers.ModelSerializer):
+    """Serializer for InvoicePdfBundle model."""
+    
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    
+    class Meta:
+        model = InvoicePdfBundle
+        fields = ('id', 'date_from', 'date_to', 'incremental', 'status', 'status_display',
+                  'rendered_count', 'reused_count', 'error', 'requested_by',
+                  'created_at', 'finished_at')
+        read_only_fields = ('id', 'status', 'status_display', 'rendered_count', 'reused_count',
+                            'error', 'requested_by', 'created_at', 'finished_at')
+    
+    def validate(self, data):
+        """Validate the bundle date range."""
+        if data['date_from'] > data['date_to']:
+            raise serializers.ValidationError({"date_to": "Ngày kết thúc phải sau ngày bắt đầu."})
+        return data
+
+
+class DailyClosingLineSerializer(serializers.ModelSerializer):
+    """Serializer for DailyClosingLine model."""
+    
+    staff_name = serializers.CharField(source='staff.full_name', read_only=True)
+    payment_method_display = serializers.CharField(source='get_payment_method_display', read_only=True)
+    
+    class Meta:
+        model = DailyClosingLine
+        fields = ('staff', 'staff_name', 'payment_method', 'payment_method_display',
+                  'payment_count', 'total_amount')
+        read_only_fields = fields
+
+
+class DailyClosingSerializer(serializers.ModelSerializer):
+    """Serializer for DailyClosing model (read-only snapshot with its lines)."""
+    
+    closed_by_name = serializers.CharField(source='closed_by.full_name', read_only=True)
+    lines = DailyClosingLineSerializer(many=True, read_only=True)
+    
+    class Meta:
+        model = DailyClosing
+        fields = ('id', 'closing_date', 'payment_count', 'total_amount', 'closed_by',
+                  'closed_by_name', 'notes', 'created_at', 'lines')
+        read_only_fields = ('id', 'payment_count', 'total_amount', 'closed_by',
+                            'closed_by_name', 'created_at', 'lines')
@@ -0,0 +1,222 @@
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from medical_records.models import Examination, ExaminationService
+from pharmacy.models import PrescriptionItem
+
+from .analytics import invalidate_revenue_cache
+from .models import Invoice, InvoiceNumberSequence
+from .reports import MONEY_FIELD
+
+# Các lần khám cần tạo/tính lại hoá đơn khi giao dịch hiện tại commit (theo từng luồng xử lý request)
+_pending = threading.local()
+
+# Số lần khám được lập hoá đơn trong mỗi giao dịch khi chạy lập hoá đơn hàng loạt
+BATCH_BILLING_CHUNK_SIZE = 1000
+
+
+def _line_total_subquery(queryset, group_by):
+    """Subquery tổng price * quantity của các dòng thuộc một lần khám."""
+    return Subquery(
+        queryset.values(group_by).annotate(
+            total=Sum(F('price') * F('quantity'), output_field=MONEY_FIELD)
+        ).values('total'),
+        output_field=MONEY_FIELD
+    )
+
+
+def examination_totals_queryset(examination_ids):
+    """
+    Lần khám kèm `services_total` và `medicine_total` tính bằng subquery gộp,
+    tức là một truy vấn duy nhất cho cả lô, không nạp từng dòng dịch vụ/thuốc lên Python.
+    """
+    services = _line_total_subquery(
+        ExaminationService.objects.filter(examination=OuterRef('pk')), 'examination'
+    )
+    medicines = _line_total_subquery(
+        PrescriptionItem.objects.filter(prescription__examination=OuterRef('pk')), 'prescription'
+    )
+    return Examination.objects.filter(pk__in=examination_ids).annotate(
+        services_total=Coalesce(services, Value(0), output_field=MONEY_FIELD),
+        medicine_total=Coalesce(medicines, Value(0), output_field=MONEY_FIELD),
+    ).order_by()
+
+
+def compute_examination_totals(examination_ids):
+    """Trả về {examination_id: (tổng dịch vụ, tổng thuốc)}."""
+    return {
+        examination_id: (services_total, medicine_total)
+        for examination_id, services_total, medicine_total in examination_totals_queryset(
+            examination_ids
+        ).values_list('id', 'services_total', 'medicine_total')
+    }
+
+
+def _locked_invoice_sequence():
+    """Dòng bộ đếm số hoá đơn đã khoá; lần đầu được khởi tạo từ id hoá đơn lớn nhất."""
+    sequences = InvoiceNumberSequence.objects.select_for_update()
+    sequence = sequences.filter(pk=InvoiceNumberSequence.SINGLETON_ID).first()
+    if sequence is not None:
+        return sequence
+    last_id = Invoice.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    try:
+        with transaction.atomic():
+            return InvoiceNumberSequence.objects.create(
+                pk=InvoiceNumberSequence.SINGLETON_ID, last_number=last_id
+            )
+    except IntegrityError:
+        # Giao dịch khác vừa khởi tạo bộ đếm
+        return sequences.get(pk=InvoiceNumberSequence.SINGLETON_ID)
+
+
+def allocate_invoice_numbers(count):
+    """
+    Cấp `count` số hoá đơn liên tiếp theo định dạng INV-XXXXXX từ bộ đếm
+    InvoiceNumberSequence. Dòng bộ đếm bị khoá đến khi giao dịch bao ngoài kết thúc,
+    nên các giao dịch cấp số đồng thời nhận các khối số khác nhau. Số đã cấp trong
+    giao dịch bị rollback sẽ bị bỏ trống.
+    """
+    with transaction.atomic():
+        sequence = _locked_invoice_sequence()
+        first = sequence.last_number + 1
+        sequence.last_number += count
+        sequence.save(update_fields=['last_number'])
+    return [f"INV-{number:06d}" for number in range(first, first + count)]
+
+
+def sync_invoices(examination_ids):
+    """
+    Tạo hoá đơn cho các lần khám chưa có và tính lại tổng tiền hoá đơn đang chờ thanh toán.
+
+    Tổng tiền được tính một lần cho cả lô (examination_totals_queryset); hoá đơn mới
+    được tạo bằng bulk_create, hoá đơn cũ được cập nhật bằng bulk_update. Hoá đơn đã
+    thanh toán hoặc đã huỷ giữ nguyên.
+    """
+    examination_ids = set(examination_ids)
+    if not examination_ids:
+        return {'created': 0, 'updated': 0}
+
+    rows = {
+        row[0]: row
+        for row in examination_totals_queryset(examination_ids).values_list(
+            'id', 'services_total', 'medicine_total', 'medical_record__patient_id', 'dentist_id'
+        )
+    }
+    invoices = list(Invoice.objects.filter(examination_id__in=rows))
+
+    now = timezone.now()
+    updated = []
+    for invoice in invoices:
+        if invoice.status != Invoice.InvoiceStatus.PENDING:
+            continue
+        _, invoice.subtotal, invoice.medicine_total, _, _ = rows[invoice.examination_id]
+        invoice.total = invoice.subtotal + invoice.medicine_total - invoice.discount + invoice.tax
+        # bulk_update bỏ qua auto_now nên cập nhật updated_at thủ công
+        invoice.updated_at = now
+        updated.append(invoice)
+    if updated:
+        Invoice.objects.bulk_update(updated, ['subtotal', 'medicine_total', 'total', 'updated_at'])
+
+    invoiced = {invoice.examination_id for invoice in invoices}
+    missing = [rows[examination_id] for examination_id in sorted(rows) if examination_id not in invoiced]
+    if missing:
+        numbers = allocate_invoice_numbers(len(missing))
+        Invoice.objects.bulk_create([
+            Invoice(
+                examination_id=examination_id,
+                patient_id=patient_id,
+                staff_id=dentist_id,  # Nha sĩ thực hiện khám sẽ là người tạo hóa đơn tạm thời
+                invoice_number=invoice_number,
+                status=Invoice.InvoiceStatus.PENDING,
+                subtotal=services_total,
+                medicine_total=medicine_total,
+                total=services_total + medicine_total,
+            )
+            for (examination_id, services_total, medicine_total, patient_id, dentist_id), invoice_number
+            in zip(missing, numbers)
+        ])
+
+    if updated or missing:
+        # bulk_create/bulk_update không gửi signal post_save
+        invalidate_revenue_cache()
+    return {'created': len(missing), 'updated': len(updated)}
+
+
+def unbilled_examinations(date_from, date_to):
+    """Lần khám trong khoảng ngày chưa có hoá đơn (LEFT JOIN invoice ... IS NULL)."""
+    return Examination.objects.filter(
+        examination_date__range=(date_from, date_to),
+        invoice__isnull=True,
+    )
+
+
+def bill_examinations(date_from, date_to, dry_run=False, chunk_size=BATCH_BILLING_CHUNK_SIZE):
+    """
+    Lập hoá đơn hàng loạt cho các lần khám chưa có hoá đơn (khi signal bị lỗi/bỏ sót).
+
+    Danh sách lần khám lấy bằng một truy vấn anti-join; mỗi lô `chunk_size` lần khám
+    được xử lý bằng sync_invoices trong một giao dịch: một truy vấn tính tổng tiền,
+    một khối số hoá đơn liên tiếp và một lệnh bulk_create.
+    """
+    examination_ids = list(
+        unbilled_examinations(date_from, date_to).order_by('id').values_list('id', flat=True)
+    )
+    created = 0
+    if not dry_run:
+        for start in range(0, len(examination_ids), chunk_size):
+            with transaction.atomic():
+                created += sync_invoices(examination_ids[start:start + chunk_size])['created']
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'dry_run': dry_run,
+        'unbilled_count': len(examination_ids),
+        'created_count': created,
+    }
+
+
+def _pending_examinations():
+    if not hasattr(_pending, 'examination_ids'):
+        _pending.examination_ids = set()
+    return _pending.examination_ids
+
+
+def _discard_rolled_back_examinations():
+    """
+    Không còn callback nào chờ commit nghĩa là giao dịch trước đã commit hoặc bị
+    rollback: bỏ các lần khám đánh dấu trong giao dịch bị rollback để chúng không
+    bị mang sang lần commit sau của luồng này.
+    """
+    callbacks = transaction.get_connection().run_on_commit
+    if not any(func is flush_pending_invoices for _, func, _ in callbacks):
+        _pending_examinations().clear()
+
+
+def flush_pending_invoices():
+    """Xử lý toàn bộ lần khám đã đánh dấu; các callback on_commit sau đó không còn việc gì."""
+    examination_ids = _pending_examinations()
+    if not examination_ids:
+        return
+    batch = set(examination_ids)
+    examination_ids.clear()
+    sync_invoices(batch)
+
+
+def schedule_invoice_sync(examination_id):
+    """
+    Đánh dấu lần khám cần tạo/tính lại hoá đơn khi giao dịch commit.
+
+    Dù một lần khám được đánh dấu nhiều lần (tạo lần khám, thêm từng dịch vụ...)
+    thì hoá đơn vẫn chỉ được tính một lần, sau khi mọi dòng dịch vụ/thuốc đã được lưu.
+    Mỗi lần đánh dấu đăng ký một callback để vẫn chạy đúng khi savepoint bên trong
+    bị rollback; callback đầu tiên xử lý cả lô, các callback còn lại bỏ qua. Lần khám
+    đánh dấu trong giao dịch bị rollback được bỏ ở lần đánh dấu kế tiếp.
+    """
+    _discard_rolled_back_examinations()
+    _pending_examinations().add(examination_id)
+    transaction.on_commit(flush_pending_invoices, robust=True)
@@ -1,28 +1,60 @@
-from django.db.models.signals import post_save, pre_delete
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from medical_records.models import Examination
+from medical_records.models import Examination, ExaminationService
+from pharmacy.models import Prescription, PrescriptionItem
+from .analytics import invalidate_revenue_cache
 from .models import Invoice
+from .services import schedule_invoice_sync
 
 @receiver(post_save, sender=Examination)
 def create_invoice_for_examination(sender, instance, created, **kwargs):
     """
     Tự động tạo hóa đơn sau khi tạo một lần khám mới.
+    
+    Hoá đơn được tạo khi giao dịch commit (transaction.on_commit), lúc các dịch vụ
+    và đơn thuốc của lần khám đã được lưu, nên tổng tiền chỉ cần tính một lần.
     """
     if created:
-        # Tạo một hóa đơn mới nếu chưa có
-        if not hasattr(instance, 'invoice'):
-            # Generate a unique invoice number
-            last_invoice = Invoice.objects.order_by('-id').first()
-            invoice_number = f"INV-{(last_invoice.id + 1 if last_invoice else 1):06d}"
-            
-            # Tạo hóa đơn mới
-            invoice = Invoice.objects.create(
-                examination=instance,
-                patient=instance.medical_record.patient,
-                staff=instance.dentist,  # Nha sĩ thực hiện khám sẽ là người tạo hóa đơn tạm thời
-                invoice_number=invoice_number,
-                status=Invoice.InvoiceStatus.PENDING
-            )
-            
-            # Tính tổng hóa đơn dựa trên dịch vụ đã sử dụng
-            invoice.calculate_totals()
\ No newline at end of file
+        schedule_invoice_sync(instance.pk)
+
+
+@receiver(post_save, sender=ExaminationService)
+@receiver(post_delete, sender=ExaminationService)
+def recalculate_invoice_for_service(sender, instance, **kwargs):
+    """Thêm/sửa/xoá dịch vụ của lần khám: tính lại hoá đơn khi giao dịch commit."""
+    schedule_invoice_sync(instance.examination_id)
+
+
+@receiver(post_save, sender=PrescriptionItem)
+@receiver(post_delete, sender=PrescriptionItem)
+def recalculate_invoice_for_prescription_item(sender, instance, **kwargs):
+    """
+    Thêm/sửa/xoá thuốc trong đơn: tính lại hoá đơn khi giao dịch commit.
+    Đơn thuốc có nhiều dòng vẫn chỉ tính lại hoá đơn một lần.
+    """
+    if PrescriptionItem.prescription.is_cached(instance):
+        examination_id = instance.prescription.examination_id
+    else:
+        examination_id = Prescription.objects.filter(
+            pk=instance.prescription_id
+        ).values_list('examination_id', flat=True).first()
+    # Đơn thuốc đã bị xoá cùng lúc thì recalculate_invoice_for_prescription xử lý
+    if examination_id:
+        schedule_invoice_sync(examination_id)
+
+
+@receiver(post_save, sender=Prescription)
+@receiver(post_delete, sender=Prescription)
+def recalculate_invoice_for_prescription(sender, instance, **kwargs):
+    """
+    Tạo/xoá đơn thuốc: tính lại tiền thuốc của hoá đơn khi giao dịch commit.
+    Các dòng thuốc tạo bằng bulk_create không gửi post_save nên dựa vào signal này.
+    """
+    schedule_invoice_sync(instance.examination_id)
+
+
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invalidate_revenue_analytics(sender, instance, **kwargs):
+    """Hoá đơn thay đổi: bỏ các kết quả phân tích doanh thu đã cache."""
+    invalidate_revenue_cache()
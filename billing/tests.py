@@ -1,15 +1,38 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
+import io
+import logging
+import queue
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+from django.utils import timezone
+from django.utils.http import http_date
 from datetime import date, timedelta
 from unittest.mock import patch
 
 from accounts.models import User
 from medical_records.models import MedicalRecord, Examination, DentalService, ExaminationService
-from .models import Invoice, Payment
+from .models import Invoice, InvoiceNumberSequence, InvoicePdfBundle, Payment, AuditEvent, DailyClosing
+from . import audit
+from .audit import AuditWriter, DroppingQueueHandler, write_events
+from .analytics import CACHE_VERSION_KEY, revenue_report
+from .bundles import build_invoice_bundle
+from .services import allocate_invoice_numbers, schedule_invoice_sync, sync_invoices
+from .closing import close_day, day_bounds
+from .reports import aging_report
+from medical_records.serializers import ExaminationCreateSerializer
+from pharmacy.models import Medicine, Prescription, PrescriptionItem
+from pharmacy.serializers import PrescriptionCreateSerializer
 
 # Create your tests here.
 class InvoiceAPITestCase(TestCase):
@@ -312,4 +335,1150 @@ class PaymentAPITestCase(TestCase):
         self.client.force_authenticate(user=self.staff)
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertGreater(len(response.data['results']), 0)
\ No newline at end of file
+        self.assertGreater(len(response.data['results']), 0)
+
+class BillingAuditTestCase(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            phone_number='0921234568',
+            full_name='Staff User Audit',
+            password='password123',
+            user_type=User.UserType.STAFF
+        )
+        self.client = APIClient()
+
+    def test_billing_mutation_enqueues_event(self):
+        """Test that billing mutations are queued with the user id instead of written inline."""
+        url = reverse('invoice-list')
+        self.client.force_authenticate(user=self.staff)
+        
+        with patch('billing.middleware.audit.enqueue') as mock_enqueue:
+            response = self.client.post(url, {}, format='json')
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        event = mock_enqueue.call_args.args[0]
+        self.assertEqual(event['user_id'], self.staff.id)
+        self.assertEqual(event['method'], 'POST')
+        self.assertEqual(event['path'], url)
+        self.assertEqual(event['status_code'], status.HTTP_400_BAD_REQUEST)
+    
+    def test_write_events_bulk_creates_audit_rows(self):
+        """Test that a batch of queued events is persisted to AuditEvent."""
+        events = [
+            {
+                'user_id': self.staff.id,
+                'method': 'POST',
+                'path': f'/api/billing/payments/{i}/',
+                'status_code': 201,
+                'duration_ms': 12.5,
+                'created_at': timezone.now(),
+            }
+            for i in range(3)
+        ]
+        
+        with override_settings(BILLING_AUDIT={'SINKS': ('db',)}), self.assertNumQueries(1):
+            write_events(events)
+        
+        self.assertEqual(AuditEvent.objects.filter(user=self.staff).count(), 3)
+
+
+    def test_flush_writes_queued_events_synchronously(self):
+        """Test that without the writer thread queued events are written by flush()."""
+        self.client.force_authenticate(user=self.staff)
+        # Bỏ các bản ghi còn lại trong hàng đợi từ các test trước (chỉ ghi file log)
+        audit.flush()
+        
+        with override_settings(BILLING_AUDIT={'SINKS': ('db',), 'WRITER_THREAD': False}):
+            self.client.post(reverse('invoice-list'), {}, format='json')
+            self.assertFalse(AuditEvent.objects.exists())
+            # flush() chạy trên thread của bên gọi (đang trong transaction của test):
+            # không được đóng kết nối của thread đó
+            with patch('billing.audit.close_old_connections') as close_connections:
+                audit.flush()
+            close_connections.assert_not_called()
+        
+        event = AuditEvent.objects.get()
+        self.assertEqual((event.user, event.method, event.status_code), (self.staff, 'POST', 400))
+    
+    def test_dropped_events_are_reported(self):
+        """Test that events dropped on a full queue are reported in the billing log."""
+        handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+        writer = AuditWriter(handler.queue)
+        writer.reported_dropped = DroppingQueueHandler.dropped
+        for _ in range(3):
+            handler.handle(logging.makeLogRecord({'msg': 'billing audit event', 'audit': {}}))
+        
+        with self.assertLogs('billing', level='WARNING') as logs:
+            writer.report_dropped()
+        self.assertIn('đã bỏ 2 bản ghi', logs.output[0])
+
+
+class BillingQueryCountTestCase(TestCase):
+    """Pin the number of queries for invoice/payment list and retrieve at page size 50."""
+
+    PAGE_SIZE = 50
+
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            phone_number='0931234568',
+            full_name='Staff User Query',
+            password='password123',
+            user_type=User.UserType.STAFF
+        )
+        self.dentist = User.objects.create_user(
+            phone_number='0931234569',
+            full_name='Dentist User Query',
+            password='password123',
+            user_type=User.UserType.DENTIST
+        )
+        self.patient = User.objects.create_user(
+            phone_number='0931234570',
+            full_name='Patient User Query',
+            password='password123',
+            user_type=User.UserType.CUSTOMER
+        )
+        self.medical_record = MedicalRecord.objects.create(patient=self.patient)
+        services = [
+            DentalService.objects.create(name=f'Dịch vụ {i}', price=100000 * (i + 1))
+            for i in range(2)
+        ]
+        
+        # Tạo nhiều hơn một trang lần khám, mỗi lần khám có 2 dịch vụ (hóa đơn được tạo qua signal)
+        for i in range(self.PAGE_SIZE + 5):
+            with self.captureOnCommitCallbacks(execute=True):
+                examination = Examination.objects.create(
+                    medical_record=self.medical_record,
+                    dentist=self.dentist,
+                    examination_date=date.today() - timedelta(days=i),
+                    diagnosis=f'Chẩn đoán {i}'
+                )
+                for service in services:
+                    ExaminationService.objects.create(
+                        examination=examination,
+                        service=service,
+                        price=service.price
+                    )
+        
+        Invoice.objects.update(total=1000000)
+        for invoice in Invoice.objects.all():
+            for amount in (100000, 200000):
+                Payment.objects.create(
+                    invoice=invoice,
+                    amount=amount,
+                    payment_method=Payment.PaymentMethod.CASH,
+                    staff=self.staff
+                )
+        
+        self.invoice = Invoice.objects.first()
+        self.payment = Payment.objects.first()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff)
+
+    def test_invoice_list_query_count(self):
+        """Count, page, payments prefetch."""
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('invoice-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), self.PAGE_SIZE)
+        self.assertEqual(Decimal(response.data['results'][0]['total_paid']), Decimal('300000'))
+
+    def test_invoice_retrieve_query_count(self):
+        """Version (ETag) query, invoice with joins, payments prefetch, services prefetch."""
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('invoice-detail', args=[self.invoice.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['examination_detail']['services']), 2)
+
+    def test_payment_list_query_count(self):
+        """Count and page (invoice, patient and staff are joined)."""
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('payment-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), self.PAGE_SIZE)
+
+    def test_payment_retrieve_query_count(self):
+        """Payment with joins, invoice payments prefetch, services prefetch."""
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('payment-detail', args=[self.payment.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['payment_number'], f'PAY-{self.payment.id:06d}')
+        self.assertEqual(len(response.data['invoice_detail']['examination_detail']['services']), 2)
+
+    def test_invoice_list_actions_use_list_serializer_and_sparse_fields(self):
+        """pending/paid/patient_invoices plan queries and prune fields like list."""
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('invoice-patient-invoices'), {'patient_id': self.patient.id})
+        self.assertEqual(len(response.data['results']), self.PAGE_SIZE)
+        self.assertEqual(Decimal(response.data['results'][0]['total_paid']), Decimal('300000'))
+        
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('invoice-pending'), {'fields': 'id,invoice_number'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'invoice_number'})
+
+    def test_invoice_retrieve_sparse_fields(self):
+        """?fields= skips the joins/prefetches of fields that were not requested."""
+        url = reverse('invoice-detail', args=[self.invoice.id])
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'fields': 'id,invoice_number,total'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {'id', 'invoice_number', 'total'})
+        
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {'fields': 'id,total', 'expand': 'examination_detail'})
+        self.assertEqual(set(response.data), {'id', 'total', 'examination_detail'})
+        self.assertEqual(len(response.data['examination_detail']['services']), 2)
+
+
+class InvoiceSyncTestCase(TestCase):
+    """Invoice creation for a new examination is deferred to commit and totalled once."""
+
+    def setUp(self):
+        self.dentist = User.objects.create_user(
+            phone_number='0941234567',
+            full_name='Dentist User Sync',
+            password='password123',
+            user_type=User.UserType.DENTIST
+        )
+        self.patient = User.objects.create_user(
+            phone_number='0941234568',
+            full_name='Patient User Sync',
+            password='password123',
+            user_type=User.UserType.CUSTOMER
+        )
+        self.medical_record = MedicalRecord.objects.create(patient=self.patient)
+        self.services = [
+            DentalService.objects.create(name=f'Dịch vụ {i}', price=100000 * (i + 1))
+            for i in range(3)
+        ]
+        # Bộ đếm không gắn với Invoice.id (sequence id của CSDL không quay lại khi rollback):
+        # khởi tạo lại để mỗi test bắt đầu từ cùng trạng thái
+        InvoiceNumberSequence.objects.all().delete()
+        self.last_number = Invoice.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    def create_examination(self):
+        serializer = ExaminationCreateSerializer(data={
+            'medical_record': self.medical_record.id,
+            'dentist': self.dentist.id,
+            'examination_date': date.today().isoformat(),
+            'diagnosis': 'Sâu răng',
+            'services': [{'service': service.id, 'quantity': 2} for service in self.services],
+        })
+        serializer.is_valid(raise_exception=True)
+        return serializer.save()
+
+    def test_invoice_created_at_commit_with_totals(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            examination = self.create_examination()
+            # Chưa commit thì chưa có hoá đơn
+            self.assertFalse(Invoice.objects.filter(examination=examination).exists())
+        
+        # Tổng tiền + hoá đơn hiện có + cấp số (lần đầu khởi tạo bộ đếm: 9 truy vấn)
+        # + bulk_create, chỉ một lần dù có nhiều callback
+        with self.assertNumQueries(11):
+            for callback in callbacks:
+                callback()
+        
+        invoice = Invoice.objects.get(examination=examination)
+        self.assertEqual(invoice.subtotal, Decimal('1200000'))
+        self.assertEqual(invoice.medicine_total, 0)
+        self.assertEqual(invoice.total, Decimal('1200000'))
+        self.assertEqual(invoice.patient, self.patient)
+        self.assertEqual(invoice.invoice_number, f'INV-{self.last_number + 1:06d}')
+
+    def test_batch_of_examinations_shares_one_sync(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            examinations = [self.create_examination() for _ in range(5)]
+        
+        with self.assertNumQueries(11):
+            for callback in callbacks:
+                callback()
+        
+        self.assertEqual(Invoice.objects.filter(examination__in=examinations).count(), 5)
+        self.assertEqual(
+            len(set(Invoice.objects.values_list('invoice_number', flat=True))), 5
+        )
+
+    def test_calculate_totals_uses_aggregates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            examination = self.create_examination()
+        invoice = Invoice.objects.get(examination=examination)
+        invoice.discount = 200000
+        
+        # Tổng gộp + UPDATE
+        with self.assertNumQueries(2):
+            invoice.calculate_totals()
+        self.assertEqual(invoice.total, Decimal('1000000'))
+
+    def test_prescription_items_recalculate_invoice_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            examination = self.create_examination()
+        medicines = [
+            Medicine.objects.create(
+                code=f'MED{i:03d}', name=f'Thuốc {i}', unit='viên', quantity_in_stock=100,
+                expiry_date=date.today() + timedelta(days=365), price=1000 * (i + 1)
+            )
+            for i in range(15)
+        ]
+        serializer = PrescriptionCreateSerializer(data={
+            'examination': examination.id,
+            'items': [
+                {'medicine': medicine.id, 'quantity': 2, 'dosage': '1 viên', 'instructions': 'Sau ăn'}
+                for medicine in medicines
+            ],
+        })
+        serializer.is_valid(raise_exception=True)
+        
+        with patch('billing.services.sync_invoices', wraps=sync_invoices) as sync:
+            with self.captureOnCommitCallbacks(execute=True):
+                serializer.save()
+        sync.assert_called_once_with({examination.id})
+        
+        invoice = Invoice.objects.get(examination=examination)
+        self.assertEqual(invoice.medicine_total, Decimal(sum(2000 * (i + 1) for i in range(15))))
+        self.assertEqual(invoice.total, invoice.subtotal + invoice.medicine_total)
+
+    def test_service_edit_and_delete_recalculate_invoice(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            examination = self.create_examination()
+        line = examination.services.first()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            line.quantity = 5
+            line.save()
+        invoice = Invoice.objects.get(examination=examination)
+        self.assertEqual(invoice.subtotal, Decimal('1500000'))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            line.delete()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.subtotal, Decimal('1000000'))
+        self.assertEqual(invoice.total, Decimal('1000000'))
+
+
+    def test_concurrent_allocations_get_distinct_numbers(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            examination = self.create_examination()
+        # Giao dịch khác đã cấp số nhưng chưa kịp tạo hoá đơn: max(id) + 1 sẽ trùng số
+        reserved = allocate_invoice_numbers(2)
+        first = Invoice.objects.get(examination=examination).invoice_number
+        self.assertEqual(reserved, [f'INV-{int(first[4:]) + offset:06d}' for offset in (1, 2)])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            other = self.create_examination()
+        invoice = Invoice.objects.get(examination=other)
+        self.assertNotIn(invoice.invoice_number, reserved)
+        self.assertEqual(allocate_invoice_numbers(1), [f'INV-{int(invoice.invoice_number[4:]) + 1:06d}'])
+
+    def test_sequence_is_locked_once_initialised(self):
+        allocate_invoice_numbers(1)
+        # Savepoint, SELECT ... FOR UPDATE, UPDATE, release
+        with self.assertNumQueries(4):
+            self.assertEqual(len(set(allocate_invoice_numbers(3))), 3)
+
+
+class InvoiceSyncRollbackTestCase(TransactionTestCase):
+    """Examinations marked in a rolled-back transaction are not synced by the next commit."""
+
+    def test_rolled_back_examinations_are_not_synced_later(self):
+        dentist = User.objects.create_user(
+            phone_number='0941234577', full_name='Dentist User Rollback', password='password123',
+            user_type=User.UserType.DENTIST
+        )
+        patient = User.objects.create_user(
+            phone_number='0941234578', full_name='Patient User Rollback', password='password123',
+            user_type=User.UserType.CUSTOMER
+        )
+        medical_record = MedicalRecord.objects.create(patient=patient)
+        examinations = [
+            Examination.objects.create(
+                medical_record=medical_record, dentist=dentist, examination_date=date.today(), diagnosis='Sâu răng'
+            )
+            for _ in range(2)
+        ]
+        Invoice.objects.all().delete()
+        
+        with patch('billing.services.sync_invoices', wraps=sync_invoices) as sync:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                schedule_invoice_sync(examinations[0].id)
+                raise RuntimeError
+            with transaction.atomic():
+                schedule_invoice_sync(examinations[1].id)
+        sync.assert_called_once_with({examinations[1].id})
+        self.assertEqual(list(Invoice.objects.values_list('examination', flat=True)), [examinations[1].id])
+
+
+class RevenueAnalyticsTestCase(TestCase):
+    """Revenue by dentist/service/medicine from grouped queries, cached until invoices change."""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            phone_number='0951234567',
+            full_name='Staff User Revenue',
+            password='password123',
+            user_type=User.UserType.STAFF
+        )
+        self.dentists = [
+            User.objects.create_user(
+                phone_number=f'095123457{i}',
+                full_name=f'Dentist Revenue {i}',
+                password='password123',
+                user_type=User.UserType.DENTIST
+            )
+            for i in range(2)
+        ]
+        patient = User.objects.create_user(
+            phone_number='0951234580',
+            full_name='Patient User Revenue',
+            password='password123',
+            user_type=User.UserType.CUSTOMER
+        )
+        medical_record = MedicalRecord.objects.create(patient=patient)
+        services = [
+            DentalService.objects.create(name=f'Dịch vụ {i}', price=100000 * (i + 1))
+            for i in range(2)
+        ]
+        medicine = Medicine.objects.create(
+            code='MEDREV', name='Thuốc doanh thu', unit='viên', quantity_in_stock=100,
+            expiry_date=date.today() + timedelta(days=365), price=5000
+        )
+        
+        # Nha sĩ 0: dịch vụ 0 + 1; nha sĩ 1: dịch vụ 1 x2 + 4 viên thuốc
+        with self.captureOnCommitCallbacks(execute=True):
+            for dentist, lines in ((self.dentists[0], [(services[0], 1), (services[1], 1)]),
+                                   (self.dentists[1], [(services[1], 2)])):
+                examination = Examination.objects.create(
+                    medical_record=medical_record,
+                    dentist=dentist,
+                    examination_date=date.today(),
+                    diagnosis='Khám định kỳ'
+                )
+                for service, quantity in lines:
+                    ExaminationService.objects.create(
+                        examination=examination, service=service, quantity=quantity, price=service.price
+                    )
+            prescription = Prescription.objects.create(examination=examination)
+            PrescriptionItem.objects.create(
+                prescription=prescription, medicine=medicine, quantity=4,
+                dosage='1 viên', instructions='Sau ăn', price=medicine.price
+            )
+        
+        self.url = reverse('invoice-revenue')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff)
+
+    def test_revenue_breakdown_and_pivot(self):
+        response = self.client.get(self.url, {'pivot': 'service'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['totals']['service_revenue'], Decimal('700000'))
+        self.assertEqual(response.data['totals']['medicine_revenue'], Decimal('20000'))
+        
+        by_dentist = {entry['id']: entry for entry in response.data['by_dentist']}
+        self.assertEqual(by_dentist[self.dentists[0].id]['revenue'], Decimal('300000'))
+        self.assertEqual(by_dentist[self.dentists[1].id]['revenue'], Decimal('420000'))
+        self.assertEqual(by_dentist[self.dentists[1].id]['medicine_revenue'], Decimal('20000'))
+        self.assertEqual(response.data['by_medicine'][0]['total_quantity'], 4)
+        
+        pivot = response.data['pivot']
+        self.assertEqual([row['id'] for row in pivot['rows']], [self.dentists[1].id, self.dentists[0].id])
+        self.assertEqual([column['name'] for column in pivot['columns']], ['Dịch vụ 1', 'Dịch vụ 0'])
+        self.assertEqual(pivot['values'], [[Decimal('400000'), 0], [Decimal('200000'), Decimal('100000')]])
+
+    def test_revenue_is_cached_until_invoice_changes(self):
+        self.client.get(self.url)
+        # Đọc từ cache, không truy vấn CSDL
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data['totals']['revenue'], Decimal('720000'))
+        
+        Invoice.objects.filter(examination__dentist=self.dentists[0]).get().delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['totals']['revenue'], Decimal('420000'))
+
+    def test_report_cached_before_commit_is_dropped_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Invoice.objects.filter(examination__dentist=self.dentists[0]).get().delete()
+            # Worker khác đọc dữ liệu cũ trước khi giao dịch commit
+            with patch('billing.analytics.service_revenue_rows', return_value=[]):
+                self.assertEqual(revenue_report(date.today(), date.today())['totals']['revenue'], Decimal('20000'))
+        today = date.today().isoformat()
+        response = self.client.get(self.url, {'date_from': today, 'date_to': today})
+        self.assertEqual(response.data['totals']['revenue'], Decimal('420000'))
+
+    def test_evicted_version_does_not_revive_old_reports(self):
+        cache.clear()
+        self.client.get(self.url)
+        Invoice.objects.filter(examination__dentist=self.dentists[0]).get().delete()
+        cache.delete(CACHE_VERSION_KEY)
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['totals']['revenue'], Decimal('420000'))
+
+    def test_invalid_pivot(self):
+        response = self.client.get(self.url, {'pivot': 'patient'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchBillingTestCase(TestCase):
+    """Examinations left without an invoice are billed in bulk."""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            phone_number='0961234567',
+            full_name='Staff User Batch',
+            password='password123',
+            user_type=User.UserType.STAFF
+        )
+        dentist = User.objects.create_user(
+            phone_number='0961234568',
+            full_name='Dentist User Batch',
+            password='password123',
+            user_type=User.UserType.DENTIST
+        )
+        patient = User.objects.create_user(
+            phone_number='0961234569',
+            full_name='Patient User Batch',
+            password='password123',
+            user_type=User.UserType.CUSTOMER
+        )
+        medical_record = MedicalRecord.objects.create(patient=patient)
+        service = DentalService.objects.create(name='Cạo vôi', price=150000)
+        
+        # Không chạy callback on_commit: các lần khám này chưa có hoá đơn
+        self.examinations = []
+        for i in range(6):
+            examination = Examination.objects.create(
+                medical_record=medical_record,
+                dentist=dentist,
+                examination_date=date.today() - timedelta(days=i % 2),
+                diagnosis=f'Chẩn đoán {i}'
+            )
+            ExaminationService.objects.create(examination=examination, service=service, price=service.price)
+            self.examinations.append(examination)
+        Invoice.objects.create(
+            examination=self.examinations[0],
+            patient=patient,
+            staff=self.staff,
+            invoice_number='INV-MANUAL',
+        )
+        
+        self.url = reverse('invoice-batch-billing')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff)
+
+    def test_batch_billing_creates_missing_invoices(self):
+        # Anti-join + một lô: savepoint, tổng tiền, hoá đơn hiện có, số hoá đơn (khoá và
+        # khởi tạo bộ đếm lần đầu), bulk_create, release
+        with self.assertNumQueries(14):
+            response = self.client.post(self.url, {'date_from': (date.today() - timedelta(days=1)).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['unbilled_count'], 5)
+        self.assertEqual(response.data['created_count'], 5)
+        
+        invoices = Invoice.objects.exclude(invoice_number='INV-MANUAL')
+        self.assertEqual(invoices.count(), 5)
+        self.assertTrue(all(invoice.total == Decimal('150000') for invoice in invoices))
+        self.assertEqual(Invoice.objects.filter(examination__in=self.examinations).count(), 6)
+
+    def test_batch_billing_dry_run_and_date_range(self):
+        response = self.client.post(self.url, {'dry_run': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Hôm nay: lần khám 0, 2, 4 - lần khám 0 đã có hoá đơn
+        self.assertEqual(response.data['unbilled_count'], 2)
+        self.assertEqual(response.data['created_count'], 0)
+        self.assertEqual(Invoice.objects.count(), 1)
+
+
+class DailyClosingTestCase(TestCase):
+    """End-of-day closing snapshots payment totals per staff and payment method."""
+
+    def setUp(self):
+        self.staff = [
+            User.objects.create_user(
+                phone_number=f'097123456{i}',
+                full_name=f'Cashier {i}',
+                password='password123',
+                user_type=User.UserType.STAFF
+            )
+            for i in range(2)
+        ]
+        dentist = User.objects.create_user(
+            phone_number='0971234570',
+            full_name='Dentist User Closing',
+            password='password123',
+            user_type=User.UserType.DENTIST
+        )
+        patient = User.objects.create_user(
+            phone_number='0971234571',
+            full_name='Patient User Closing',
+            password='password123',
+            user_type=User.UserType.CUSTOMER
+        )
+        examination = Examination.objects.create(
+            medical_record=MedicalRecord.objects.create(patient=patient),
+            dentist=dentist,
+            examination_date=date.today(),
+            diagnosis='Khám tổng quát'
+        )
+        invoice = Invoice.objects.create(
+            examination=examination,
+            patient=patient,
+            staff=self.staff[0],
+            invoice_number='INV-CLOSING',
+            total=10000000
+        )
+        for staff, method, amount in (
+            (self.staff[0], Payment.PaymentMethod.CASH, 100000),
+            (self.staff[0], Payment.PaymentMethod.CASH, 200000),
+            (self.staff[0], Payment.PaymentMethod.CARD, 300000),
+            (self.staff[1], Payment.PaymentMethod.TRANSFER, 400000),
+        ):
+            Payment.objects.create(invoice=invoice, amount=amount, payment_method=method, staff=staff)
+        # Chỉ chốt được ngày đã kết thúc: dời các khoản thu về hôm qua
+        self.day = timezone.localdate() - timedelta(days=1)
+        Payment.objects.update(payment_date=day_bounds(self.day)[0] + timedelta(hours=9))
+        
+        self.url = reverse('daily-closing-list')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff[0])
+
+    def test_close_day_snapshots_grouped_totals(self):
+        response = self.client.post(self.url, {'notes': 'Két khớp'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['payment_count'], 4)
+        self.assertEqual(Decimal(response.data['total_amount']), Decimal('1000000'))
+        lines = {(line['staff'], line['payment_method']): line for line in response.data['lines']}
+        self.assertEqual(len(lines), 3)
+        cash = lines[(self.staff[0].id, Payment.PaymentMethod.CASH)]
+        self.assertEqual(cash['payment_count'], 2)
+        self.assertEqual(Decimal(cash['total_amount']), Decimal('300000'))
+        
+        # Đã chốt thì không chốt lại được
+        response = self.client.post(self.url, {})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_closing_is_immutable_and_summary_reads_snapshot(self):
+        closing = close_day(self.day, closed_by=self.staff[0])
+        closing.notes = 'Sửa'
+        with self.assertRaises(ValueError):
+            closing.save()
+        with self.assertRaises(ValueError):
+            closing.lines.first().delete()
+        # update()/delete() hàng loạt cũng bị chặn
+        with self.assertRaises(ValueError):
+            DailyClosing.objects.filter(pk=closing.pk).update(notes='Sửa')
+        with self.assertRaises(ValueError):
+            closing.lines.all().delete()
+        with self.assertRaises(ValueError):
+            DailyClosing.objects.all().delete()
+        
+        # Báo cáo đọc bản chốt, không bị ảnh hưởng bởi thay đổi Payment sau đó
+        Payment.objects.filter(payment_method=Payment.PaymentMethod.TRANSFER).delete()
+        response = self.client.get(reverse('daily-closing-summary'), {
+            'date_from': (self.day - timedelta(days=1)).isoformat(),
+            'date_to': self.day.isoformat(),
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['total_amount'], Decimal('1000000'))
+        self.assertEqual(response.data['by_method'][Payment.PaymentMethod.TRANSFER]['total_amount'], Decimal('400000'))
+        self.assertEqual(response.data['missing_dates'], [self.day - timedelta(days=1)])
+
+    def test_payments_of_closed_day_cannot_change(self):
+        payment = Payment.objects.filter(payment_method=Payment.PaymentMethod.CARD).get()
+        url = reverse('payment-detail', args=[payment.id])
+        data = {'invoice': payment.invoice_id, 'amount': 300000, 'payment_method': Payment.PaymentMethod.CARD}
+        response = self.client.patch(url, dict(data, notes='Trước khi chốt'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        
+        close_day(self.day, closed_by=self.staff[0])
+        response = self.client.patch(url, dict(data, notes='Sau khi chốt'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(url, dict(data, amount=1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        payment.refresh_from_db()
+        self.assertEqual((payment.amount, payment.notes), (300000, 'Trước khi chốt'))
+
+    def test_cannot_close_day_before_it_ends(self):
+        today = timezone.localdate()
+        for day in (today, today + timedelta(days=1)):
+            response = self.client.post(self.url, {'closing_date': day.isoformat()})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(DailyClosing.objects.exists())
+
+
+class InvoiceConditionalGetTestCase(TestCase):
+    """Invoice retrieve answers 304 from a single version query when nothing changed."""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            phone_number='0981234567',
+            full_name='Staff User ETag',
+            password='password123',
+            user_type=User.UserType.STAFF
+        )
+        self.dentist = dentist = User.objects.create_user(
+            phone_number='0981234568',
+            full_name='Dentist User ETag',
+            password='password123',
+            user_type=User.UserType.DENTIST
+        )
+        patient = User.objects.create_user(
+            phone_number='0981234569',
+            full_name='Patient User ETag',
+            password='password123',
+            user_type=User.UserType.CUSTOMER
+        )
+        self.service = service = DentalService.objects.create(name='Trám răng', price=300000)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.examination = Examination.objects.create(
+                medical_record=MedicalRecord.objects.create(patient=patient),
+                dentist=dentist,
+                examination_date=date.today(),
+                diagnosis='Sâu răng'
+            )
+            ExaminationService.objects.create(examination=self.examination, service=service, price=service.price)
+        self.invoice = Invoice.objects.get(examination=self.examination)
+        self.url = reverse('invoice-detail', args=[self.invoice.id])
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff)
+
+    def test_not_modified_after_one_query(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+        
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        
+        # Thay đổi ?fields= thì nội dung khác nên ETag khác
+        response = self.client.get(self.url, {'fields': 'id,total'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_related_changes_produce_new_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        
+        Payment.objects.create(
+            invoice=self.invoice, amount=100000, payment_method=Payment.PaymentMethod.CASH, staff=self.staff
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        
+        line = self.examination.services.get()
+        line.notes = 'Răng số 6'
+        line.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_nested_user_and_service_changes_produce_new_etag(self):
+        params = {'expand': 'examination_detail.dentist_detail,examination_detail.services.service_detail'}
+        for instance, field, value in (
+            (self.dentist, 'full_name', 'Dentist Renamed'),
+            (self.service, 'name', 'Trám răng thẩm mỹ'),
+        ):
+            etag = self.client.get(self.url, params)['ETag']
+            setattr(instance, field, value)
+            instance.save()
+            response = self.client.get(self.url, params, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since_is_not_answered_with_304(self):
+        self.client.get(self.url)
+        # Xoá dòng dịch vụ chỉ đổi số dòng, không phải lúc nào cũng làm tăng thời điểm cập nhật
+        with self.captureOnCommitCallbacks(execute=True):
+            self.examination.services.get().delete()
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_version_query_applies_filters(self):
+        etag = self.client.get(self.url)['ETag']
+        # retrieve lọc theo ?status= nên hoá đơn chưa thanh toán không được trả 304
+        response = self.client.get(self.url, {'status': Invoice.InvoiceStatus.PAID}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_missing_invoice_is_404(self):
+        response = self.client.get(reverse('invoice-detail', args=[self.invoice.id + 100]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BankReconciliationTestCase(TestCase):
+    """Bank statement lines are matched to pending invoices and posted as transfers."""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            phone_number='0971234567',
+            full_name='Staff User Reconcile',
+            password='password123',
+            user_type=User.UserType.STAFF
+        )
+        dentist = User.objects.create_user(
+            phone_number='0971234568',
+            full_name='Dentist User Reconcile',
+            password='password123',
+            user_type=User.UserType.DENTIST
+        )
+        patient = User.objects.create_user(
+            phone_number='0971234569',
+            full_name='Patient User Reconcile',
+            password='password123',
+            user_type=User.UserType.CUSTOMER
+        )
+        medical_record = MedicalRecord.objects.create(patient=patient)
+        self.invoices = [
+            Invoice.objects.create(
+                examination=Examination.objects.create(
+                    medical_record=medical_record, dentist=dentist,
+                    examination_date=date.today(), diagnosis=f'Chẩn đoán {number}'
+                ),
+                patient=patient,
+                staff=self.staff,
+                invoice_number=f'INV-{number:06d}',
+                subtotal=100000,
+                total=100000,
+            )
+            for number in (12, 13)
+        ]
+        self.yesterday = date.today() - timedelta(days=1)
+        self.url = reverse('payment-reconcile')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff)
+
+    def statement(self, rows):
+        lines = ['date,amount,reference,description'] + [','.join(str(value) for value in row) for row in rows]
+        return SimpleUploadedFile('statement.csv', '\n'.join(lines).encode(), content_type='text/csv')
+
+    def test_matched_lines_post_payments_on_statement_date(self):
+        response = self.client.post(self.url, {'file': self.statement([
+            (self.yesterday.isoformat(), 45000, 'FT001', 'CK INV 000012 45000'),
+            (self.yesterday.strftime('%d/%m/%Y'), '"55,000"', 'FT002', 'inv-000012 con lai'),
+        ])}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['matched_count'], response.data['paid_invoice_count']), (2, 1))
+        payments = Payment.objects.filter(invoice=self.invoices[0])
+        self.assertEqual(sorted(payment.amount for payment in payments), [45000, 55000])
+        self.assertTrue(all(payment.payment_date == day_bounds(self.yesterday)[0] for payment in payments))
+        self.invoices[0].refresh_from_db()
+        self.assertEqual(self.invoices[0].status, Invoice.InvoiceStatus.PAID)
+
+    def test_unmatched_and_duplicate_lines_are_reported(self):
+        Payment.objects.create(
+            invoice=self.invoices[1], amount=1000, payment_method=Payment.PaymentMethod.TRANSFER,
+            reference_number='FT-OLD', staff=self.staff
+        )
+        closed_day = date.today() - timedelta(days=3)
+        DailyClosing.objects.create(closing_date=closed_day, closed_by=self.staff)
+        response = self.client.post(self.url, {'file': self.statement([
+            (self.yesterday, 10000, 'FT010', 'chuyen tien kham rang'),
+            (self.yesterday, 10000, 'FT-OLD', 'INV-000013'),
+            (self.yesterday, 10000, 'FT011', 'INV-000013'),
+            (self.yesterday, 10000, 'FT011', 'INV-000013'),
+            (self.yesterday, 'abc', 'FT012', 'INV-000013'),
+            ('hom qua', 10000, 'FT013', 'INV-000013'),
+            (closed_day, 10000, 'FT014', 'INV-000013'),
+            (date.today() + timedelta(days=1), 10000, 'FT015', 'INV-000013'),
+            (self.yesterday, 200000, 'FT016', 'INV-000012'),
+        ])}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['matched_count'], 1)
+        self.assertEqual(
+            [(line['line'], line['reason']) for line in response.data['unmatched']],
+            [(2, 'no_invoice'), (3, 'duplicate_reference'), (5, 'duplicate_reference'), (6, 'invalid_amount'),
+             (7, 'invalid_date'), (8, 'day_closed'), (9, 'future_date'), (10, 'exceeds_balance')]
+        )
+        self.assertEqual(Payment.objects.filter(reference_number='FT011').count(), 1)
+
+    def test_dry_run_posts_nothing(self):
+        response = self.client.post(self.url, {'file': self.statement([
+            (self.yesterday, 100000, 'FT020', 'INV-000012'),
+        ]), 'dry_run': 'true'}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['matched_count'], response.data['paid_invoice_count']), (1, 1))
+        self.assertFalse(Payment.objects.exists())
+        self.invoices[0].refresh_from_db()
+        self.assertEqual(self.invoices[0].status, Invoice.InvoiceStatus.PENDING)
+
+    def test_non_utf8_statement_is_rejected(self):
+        upload = SimpleUploadedFile(
+            'statement.csv', 'date,amount,reference,description\n2026-01-05,1000,FT1,Chuyển khoản\n'.encode('utf-16'),
+            content_type='text/csv'
+        )
+        response = self.client.post(self.url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Payment.objects.exists())
+
+
+class AgingReportTestCase(TestCase):
+    """Outstanding balances are bucketed by invoice age, per patient, as of a given date."""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            phone_number='0981234567',
+            full_name='Staff User Aging',
+            password='password123',
+            user_type=User.UserType.STAFF
+        )
+        self.dentist = User.objects.create_user(
+            phone_number='0981234568',
+            full_name='Dentist User Aging',
+            password='password123',
+            user_type=User.UserType.DENTIST
+        )
+        self.patients = [
+            User.objects.create_user(
+                phone_number=f'098123457{i}',
+                full_name=f'Patient Aging {i}',
+                password='password123',
+                user_type=User.UserType.CUSTOMER
+            )
+            for i in range(2)
+        ]
+        self.today = date.today()
+        patient_a, patient_b = self.patients
+        self.create_invoice(patient_a, 10, 100000, paid=30000)
+        self.create_invoice(patient_a, 45, 200000)
+        self.create_invoice(patient_a, 100, 50000)
+        self.create_invoice(patient_b, 70, 80000)
+        self.create_invoice(patient_b, 0, 60000, status=Invoice.InvoiceStatus.CANCELLED)
+        # Đã trả đủ 5 ngày trước: còn nợ nếu xem báo cáo ở thời điểm trước đó
+        self.create_invoice(patient_b, 20, 40000, paid=40000, paid_days_ago=5)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff)
+
+    def create_invoice(self, patient, age_days, total, paid=0, paid_days_ago=0, status=Invoice.InvoiceStatus.PENDING):
+        invoice = Invoice.objects.create(
+            examination=Examination.objects.create(
+                medical_record=MedicalRecord.objects.get_or_create(patient=patient)[0],
+                dentist=self.dentist,
+                examination_date=self.today - timedelta(days=age_days),
+                diagnosis='Sâu răng'
+            ),
+            patient=patient,
+            staff=self.staff,
+            invoice_number=f'INV-AGING-{Invoice.objects.count()}',
+            subtotal=total,
+            total=total,
+            status=status,
+        )
+        paid_at = timezone.now() - timedelta(days=paid_days_ago)
+        if paid:
+            Payment.objects.create(invoice=invoice, amount=paid, staff=self.staff, payment_date=paid_at)
+        Invoice.objects.filter(pk=invoice.pk).update(
+            invoice_date=self.today - timedelta(days=age_days), updated_at=paid_at
+        )
+        return invoice
+
+    def test_buckets_per_patient_and_totals(self):
+        with self.assertNumQueries(1):
+            report = aging_report()
+
+        patient_a, patient_b = report['patients']
+        self.assertEqual(
+            [patient_a[key] for key in ('days_0_30', 'days_31_60', 'days_61_90', 'days_90_plus', 'total_outstanding')],
+            [70000, 200000, 0, 50000, 320000]
+        )
+        self.assertEqual((patient_b['invoice_count'], patient_b['days_61_90']), (1, 80000))
+        self.assertEqual(report['totals']['total_outstanding'], 400000)
+
+    def test_past_as_of_uses_payments_and_status_at_that_date(self):
+        report = aging_report(as_of=self.today - timedelta(days=15))
+
+        totals = report['totals']
+        # Hoá đơn 10 ngày chưa có, hoá đơn trả đủ 5 ngày trước vẫn còn nợ 40.000;
+        # tuổi nợ tính tới ngày as_of (45 ngày -> 30, 70 -> 55, 100 -> 85)
+        self.assertEqual(totals['invoice_count'], 4)
+        self.assertEqual(
+            [totals[key] for key in ('days_0_30', 'days_31_60', 'days_61_90', 'days_90_plus')],
+            [240000, 80000, 50000, 0]
+        )
+
+    def test_endpoint_patient_filter_and_bad_input(self):
+        url = reverse('invoice-aging')
+        response = self.client.get(url, {'patient_id': self.patients[1].id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['patient_id'] for row in response.data['patients']], [self.patients[1].id])
+        self.assertEqual(response.data['totals']['total_outstanding'], 80000)
+
+        for params in ({'patient_id': 'abc'}, {'as_of': '15/01/2026'}):
+            self.assertEqual(self.client.get(url, params).status_code, status.HTTP_400_BAD_REQUEST, params)
+
+
+class InvoiceSearchTestCase(TestCase):
+    """Search keeps matching partial invoice numbers and names (type-ahead)."""
+
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            phone_number='0991234567',
+            full_name='Staff User Search',
+            password='password123',
+            user_type=User.UserType.STAFF
+        )
+        dentist = User.objects.create_user(
+            phone_number='0991234568',
+            full_name='Dentist User Search',
+            password='password123',
+            user_type=User.UserType.DENTIST
+        )
+        for i, name in enumerate(['Nguyễn Văn An', 'Trần Thị Bình']):
+            patient = User.objects.create_user(
+                phone_number=f'099123457{i}',
+                full_name=name,
+                password='password123',
+                user_type=User.UserType.CUSTOMER
+            )
+            Invoice.objects.create(
+                examination=Examination.objects.create(
+                    medical_record=MedicalRecord.objects.create(patient=patient),
+                    dentist=dentist,
+                    examination_date=date.today(),
+                    diagnosis='Sâu răng'
+                ),
+                patient=patient,
+                staff=self.staff,
+                invoice_number=f'INV-0042{i}7',
+                notes='Trả góp' if i else '',
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff)
+
+    def search(self, term):
+        response = self.client.get(reverse('invoice-list'), {'search': term})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(invoice['invoice_number'] for invoice in response.data['results'])
+
+    def test_partial_terms_match(self):
+        self.assertEqual(self.search('421'), ['INV-004217'])
+        self.assertEqual(self.search('0042'), ['INV-004207', 'INV-004217'])
+        self.assertEqual(self.search('Bìn'), ['INV-004217'])
+        self.assertEqual(self.search('An 004'), ['INV-004207'])
+        self.assertEqual(self.search('xyz'), [])
+        # Ghi chú hoá đơn vẫn nằm trong phạm vi tìm kiếm
+        self.assertEqual(self.search('trả gó'), ['INV-004217'])
+
+
+def fake_html_to_pdf(html):
+    return b'%PDF-' + html.encode('utf-8')[:32]
+
+
+class InlinePoolExecutor(ThreadPoolExecutor):
+    """Chạy render trong thread của tiến trình test để mock html_to_pdf có hiệu lực."""
+
+    def __init__(self, max_workers=None, mp_context=None):
+        super().__init__(max_workers=max_workers)
+
+
+@patch('billing.bundles.ProcessPoolExecutor', InlinePoolExecutor)
+class InvoicePdfBundleTestCase(TestCase):
+    """Gói PDF hoá đơn dùng lại PDF của hoá đơn không đổi và chỉ render lại phần đã sửa."""
+
+    def setUp(self):
+        self.bundle_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.bundle_dir, ignore_errors=True)
+        settings_override = override_settings(INVOICE_BUNDLE_DIR=self.bundle_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.staff = User.objects.create_user(
+            phone_number='0981234567',
+            full_name='Staff User Bundle',
+            password='password123',
+            user_type=User.UserType.STAFF
+        )
+        dentist = User.objects.create_user(
+            phone_number='0981234568',
+            full_name='Dentist User Bundle',
+            password='password123',
+            user_type=User.UserType.DENTIST
+        )
+        self.invoices = []
+        for i in range(2):
+            patient = User.objects.create_user(
+                phone_number=f'098123457{i}',
+                full_name=f'Patient Bundle {i}',
+                password='password123',
+                user_type=User.UserType.CUSTOMER
+            )
+            self.invoices.append(Invoice.objects.create(
+                examination=Examination.objects.create(
+                    medical_record=MedicalRecord.objects.create(patient=patient),
+                    dentist=dentist,
+                    examination_date=date.today(),
+                    diagnosis='Sâu răng'
+                ),
+                patient=patient,
+                staff=self.staff,
+                invoice_number=f'INV-B{i}',
+            ))
+        self.today = timezone.localdate()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.staff)
+
+    def build(self):
+        bundle = InvoicePdfBundle.objects.create(date_from=self.today, date_to=self.today)
+        return build_invoice_bundle(bundle, max_workers=1)
+
+    def archive_names(self, bundle):
+        with zipfile.ZipFile(bundle.file_path) as archive:
+            return sorted(archive.namelist())
+
+    @patch('billing.bundles.html_to_pdf', side_effect=fake_html_to_pdf)
+    def test_unchanged_invoices_are_reused(self, html_to_pdf):
+        first = self.build()
+        self.assertEqual((first.rendered_count, first.reused_count), (2, 0))
+        self.assertEqual(html_to_pdf.call_count, 2)
+
+        second = self.build()
+        self.assertEqual((second.rendered_count, second.reused_count), (0, 2))
+        self.assertEqual(html_to_pdf.call_count, 2)
+        self.assertEqual(self.archive_names(second), ['INV-B0.pdf', 'INV-B1.pdf'])
+        self.assertEqual(second.manifest, first.manifest)
+
+    @patch('billing.bundles.html_to_pdf', side_effect=fake_html_to_pdf)
+    def test_changed_invoice_is_rendered_again(self, html_to_pdf):
+        self.build()
+        changed = self.invoices[1]
+        changed.notes = 'Đã sửa'
+        changed.save()
+
+        bundle = self.build()
+        self.assertEqual((bundle.rendered_count, bundle.reused_count), (1, 1))
+        self.assertEqual(html_to_pdf.call_count, 3)
+        self.assertEqual(bundle.manifest[str(changed.pk)]['updated_at'], changed.updated_at.isoformat())
+        self.assertEqual(self.archive_names(bundle), ['INV-B0.pdf', 'INV-B1.pdf'])
+
+    @patch('billing.bundles.html_to_pdf', side_effect=fake_html_to_pdf)
+    def test_endpoint_queues_and_serves_bundle(self, html_to_pdf):
+        # Chạy job đồng bộ thay cho thread nền
+        with patch('billing.views.start_bundle_job',
+                   side_effect=lambda bundle: build_invoice_bundle(bundle, max_workers=1)) as start_job:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('invoice-bundle-list'), {
+                    'date_from': self.today.isoformat(),
+                    'date_to': self.today.isoformat(),
+                })
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], InvoicePdfBundle.BundleStatus.PENDING)
+        start_job.assert_called_once()
+
+        url = reverse('invoice-bundle-download', args=[response.data['id']])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Đọc hết nội dung: test client tự đóng file khi luồng kết thúc
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual(sorted(archive.namelist()), ['INV-B0.pdf', 'INV-B1.pdf'])
+        self.assertEqual(html_to_pdf.call_count, 2)
+
+    def test_download_before_completion_conflicts(self):
+        bundle = InvoicePdfBundle.objects.create(date_from=self.today, date_to=self.today)
+        response = self.client.get(reverse('invoice-bundle-download', args=[bundle.pk]))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
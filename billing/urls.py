@@ -1,10 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import InvoiceViewSet, PaymentViewSet, InvoicePrintView
+from .views import InvoiceViewSet, PaymentViewSet, InvoicePdfBundleViewSet, DailyClosingViewSet, InvoicePrintView
 
 router = DefaultRouter()
 router.register(r'invoices', InvoiceViewSet, basename='invoice')
 router.register(r'payments', PaymentViewSet, basename='payment')
+router.register(r'invoice-bundles', InvoicePdfBundleViewSet, basename='invoice-bundle')
+router.register(r'daily-closings', DailyClosingViewSet, basename='daily-closing')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -3,47 +3,111 @@ from rest_framework.response import Response
 from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Invoice, Payment
+from .models import Invoice, Payment, InvoicePdfBundle, DailyClosing, DailyClosingLine
 from .serializers import (
     InvoiceSerializer, InvoiceListSerializer,
-    PaymentSerializer, PaymentListSerializer
+    PaymentSerializer, PaymentListSerializer,
+    InvoicePdfBundleSerializer, DailyClosingSerializer
 )
 from accounts.permissions import IsStaffOrAdmin
+from core.pagination import StandardResultsSetPagination
+from core.serializers import is_field_requested
+from core.conditional import ConditionalRetrieveMixin, related_version
 from .filters import InvoiceFilter, PaymentFilter
+from .reports import aging_report
+from .analytics import PIVOT_COLUMNS, DEFAULT_STATUSES, revenue_report
+from .search import TrigramSearchFilter
+from .reconciliation import reconcile_file
+from .services import bill_examinations
+from .closing import DailyClosingError, close_day, closing_summary, ensure_day_open
 
 # Các module cần thiết cho việc xuất báo cáo hóa đơn và thanh toán
-from django.db.models import Sum
+from django.db.models import F, Sum, Prefetch
 from django.utils import timezone
-from datetime import timedelta
+from datetime import datetime, timedelta
 import csv
+import io
 from django.http import HttpResponse
 
 # Các module cần thiết cho việc hiển thị trang in hoá đơn
 from django.shortcuts import render, get_object_or_404
 from django.views import View
+from .bundles import get_invoice_print_context, get_print_queryset, start_bundle_job
 from medical_records.models import ExaminationService
-from pharmacy.models import PrescriptionItem
 
+# Các module cần thiết cho việc tải gói PDF hoá đơn
+import os
+from django.db import transaction
+from django.http import FileResponse
 
-class InvoiceViewSet(viewsets.ModelViewSet):
+
+class InvoiceViewSet(ConditionalRetrieveMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing invoices.
     """
     queryset = Invoice.objects.all()
     serializer_class = InvoiceSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, TrigramSearchFilter]
     filterset_class = InvoiceFilter
     filterset_fields = ['status', 'patient', 'invoice_date', 'examination']
     search_fields = ['invoice_number', 'patient__full_name', 'notes']
+    # Các trường có chỉ mục trigram, dùng cho tìm kiếm trên PostgreSQL
+    trigram_search_fields = search_fields
     ordering_fields = ['invoice_date', 'total', 'created_at', 'updated_at']
     ordering = ['-invoice_date']
+    pagination_class = StandardResultsSetPagination
+    # Các action trả về InvoiceListSerializer
+    list_actions = ['list', 'pending', 'paid', 'patient_invoices']
 
     def get_serializer_class(self):
         """Return different serializers based on action."""
-        if self.action == 'list':
+        if self.action in self.list_actions:
             return InvoiceListSerializer
         return InvoiceSerializer
 
+    def get_queryset(self):
+        """
+        Apply the select_related/prefetch_related plan the action's serializer needs,
+        so list and detail responses cost a fixed number of queries.
+        """
+        queryset = Invoice.objects.all()
+        if self.action == 'export_csv':
+            return queryset.select_related('patient')
+        
+        # Bỏ qua dữ liệu của các trường client không yêu cầu (?fields=/?expand=)
+        requested = lambda name: is_field_requested(self.request, name)
+        if requested('patient_detail'):
+            queryset = queryset.select_related('patient')
+        if any(requested(name) for name in ('total_paid', 'remaining_balance', 'payment_status_percent')):
+            queryset = queryset.prefetch_related('payments')
+        if self.action in self.list_actions:
+            # InvoiceListSerializer: patient_detail + tổng đã trả
+            return queryset
+        
+        # InvoiceSerializer: thêm staff, examination (nha sĩ + dịch vụ)
+        if requested('staff_detail'):
+            queryset = queryset.select_related('staff')
+        if requested('examination_detail'):
+            queryset = queryset.select_related('examination__dentist').prefetch_related(
+                Prefetch('examination__services', queryset=ExaminationService.objects.select_related('service'))
+            )
+        return queryset
+
+    def get_version_annotations(self):
+        """Phiên bản của hoá đơn: lần khám, bệnh nhân/nhân viên/nha sĩ, dịch vụ đã dùng và các thanh toán."""
+        return {
+            'examination_updated_at': F('examination__updated_at'),
+            'patient_updated_at': F('patient__updated_at'),
+            'staff_updated_at': F('staff__updated_at'),
+            'dentist_updated_at': F('examination__dentist__updated_at'),
+            **related_version('services', ExaminationService.objects.all(), 'examination', outer_ref='examination'),
+            **related_version(
+                'service_catalog', ExaminationService.objects.all(), 'examination', outer_ref='examination',
+                timestamp_field='service__updated_at'
+            ),
+            **related_version('payments', Payment.objects.all(), 'invoice'),
+        }
+
     def get_permissions(self):
         """
         Only admin and staff can manage invoices.
@@ -61,30 +125,30 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         invoice = self.get_object()
         invoice.calculate_totals()
         return Response(
-            InvoiceSerializer(invoice).data,
+            self.get_serializer(invoice).data,
             status=status.HTTP_200_OK
         )
     
     @action(detail=False)
     def pending(self, request):
         """Get pending invoices."""
-        invoices = self.queryset.filter(status=Invoice.InvoiceStatus.PENDING)
+        invoices = self.get_queryset().filter(status=Invoice.InvoiceStatus.PENDING)
         page = self.paginate_queryset(invoices)
         if page is not None:
-            serializer = InvoiceListSerializer(page, many=True)
+            serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-        serializer = InvoiceListSerializer(invoices, many=True)
+        serializer = self.get_serializer(invoices, many=True)
         return Response(serializer.data)
     
     @action(detail=False)
     def paid(self, request):
         """Get paid invoices."""
-        invoices = self.queryset.filter(status=Invoice.InvoiceStatus.PAID)
+        invoices = self.get_queryset().filter(status=Invoice.InvoiceStatus.PAID)
         page = self.paginate_queryset(invoices)
         if page is not None:
-            serializer = InvoiceListSerializer(page, many=True)
+            serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-        serializer = InvoiceListSerializer(invoices, many=True)
+        serializer = self.get_serializer(invoices, many=True)
         return Response(serializer.data)
     
     @action(detail=False)
@@ -97,12 +161,12 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        invoices = self.queryset.filter(patient_id=patient_id)
+        invoices = self.get_queryset().filter(patient_id=patient_id)
         page = self.paginate_queryset(invoices)
         if page is not None:
-            serializer = InvoiceListSerializer(page, many=True)
+            serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-        serializer = InvoiceListSerializer(invoices, many=True)
+        serializer = self.get_serializer(invoices, many=True)
         return Response(serializer.data)
     
     # Thêm các action liên quan đến xuất báo cáo hóa đơn
@@ -166,6 +230,86 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         
         return Response(stats)
 
+    @action(detail=False, methods=['get'])
+    def aging(self, request):
+        """Báo cáo tuổi nợ theo bệnh nhân (0-30, 31-60, 61-90, trên 90 ngày)"""
+        as_of = request.query_params.get('as_of')
+        if as_of:
+            try:
+                as_of = datetime.strptime(as_of, '%Y-%m-%d').date()
+            except ValueError:
+                return Response(
+                    {"error": "Invalid as_of date, expected YYYY-MM-DD"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        patient_id = request.query_params.get('patient_id')
+        if patient_id is not None and not patient_id.isdigit():
+            return Response(
+                {"error": "Invalid patient_id"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        report = aging_report(as_of=as_of, patient_id=int(patient_id) if patient_id else None)
+        return Response(report)
+
+    @action(detail=False, methods=['post'])
+    def batch_billing(self, request):
+        """Lập hoá đơn cho các lần khám chưa có hoá đơn trong khoảng ngày (mặc định hôm nay)"""
+        today = timezone.now().date().isoformat()
+        try:
+            date_from = datetime.strptime(request.data.get('date_from', today), '%Y-%m-%d').date()
+            date_to = datetime.strptime(request.data.get('date_to', today), '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "Invalid date, expected YYYY-MM-DD"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if date_from > date_to:
+            return Response(
+                {"error": "date_from must not be after date_to"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        result = bill_examinations(date_from, date_to, dry_run=dry_run)
+        return Response(result, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def revenue(self, request):
+        """Doanh thu theo nha sĩ, dịch vụ và thuốc trong khoảng ngày (mặc định từ đầu tháng)"""
+        today = timezone.now().date()
+        try:
+            date_from = datetime.strptime(
+                request.query_params.get('date_from', today.replace(day=1).isoformat()), '%Y-%m-%d'
+            ).date()
+            date_to = datetime.strptime(
+                request.query_params.get('date_to', today.isoformat()), '%Y-%m-%d'
+            ).date()
+        except ValueError:
+            return Response(
+                {"error": "Invalid date, expected YYYY-MM-DD"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        statuses = request.query_params.get('status')
+        statuses = statuses.split(',') if statuses else DEFAULT_STATUSES
+        if not set(statuses) <= set(Invoice.InvoiceStatus.values):
+            return Response(
+                {"error": f"Invalid status, expected one of {', '.join(Invoice.InvoiceStatus.values)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        pivot = request.query_params.get('pivot')
+        if pivot and pivot not in PIVOT_COLUMNS:
+            return Response(
+                {"error": f"Invalid pivot, expected one of {', '.join(PIVOT_COLUMNS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        report = revenue_report(date_from, date_to, statuses=statuses, pivot=pivot)
+        return Response(report)
+
 
 class PaymentViewSet(viewsets.ModelViewSet):
     """
@@ -173,12 +317,14 @@ class PaymentViewSet(viewsets.ModelViewSet):
     """
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, TrigramSearchFilter]
     filterset_class = PaymentFilter
     filterset_fields = ['invoice', 'payment_method', 'payment_date']
     search_fields = ['reference_number', 'invoice__invoice_number', 'invoice__patient__full_name']
+    trigram_search_fields = search_fields
     ordering_fields = ['payment_date', 'amount']
     ordering = ['-payment_date']
+    pagination_class = StandardResultsSetPagination
 
     def get_serializer_class(self):
         """Return different serializers based on action."""
@@ -186,6 +332,36 @@ class PaymentViewSet(viewsets.ModelViewSet):
             return PaymentListSerializer
         return PaymentSerializer
 
+    def get_queryset(self):
+        """
+        Apply the select_related/prefetch_related plan the action's serializer needs,
+        so list and detail responses cost a fixed number of queries.
+        """
+        queryset = Payment.objects.all()
+        requested = lambda name: is_field_requested(self.request, name)
+        if self.action == 'list':
+            # PaymentListSerializer: số hoá đơn, tên bệnh nhân, tên nhân viên
+            if requested('invoice_number') or requested('patient_name'):
+                queryset = queryset.select_related('invoice__patient')
+            if requested('staff_name'):
+                queryset = queryset.select_related('staff')
+            return queryset
+        
+        # PaymentSerializer: invoice_detail lồng toàn bộ InvoiceSerializer
+        if requested('staff_detail'):
+            queryset = queryset.select_related('staff')
+        if requested('invoice_detail'):
+            queryset = queryset.select_related(
+                'invoice__patient', 'invoice__staff', 'invoice__examination__dentist'
+            ).prefetch_related(
+                'invoice__payments',
+                Prefetch(
+                    'invoice__examination__services',
+                    queryset=ExaminationService.objects.select_related('service')
+                ),
+            )
+        return queryset
+
     def get_permissions(self):
         """
         Only admin and staff can manage payments.
@@ -197,6 +373,22 @@ class PaymentViewSet(viewsets.ModelViewSet):
         """Set the staff to the current user when creating a payment."""
         serializer.save(staff=self.request.user)
     
+    def update(self, request, *args, **kwargs):
+        """Update a payment unless its day has already been closed."""
+        try:
+            ensure_day_open(self.get_object().payment_date)
+        except DailyClosingError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return super().update(request, *args, **kwargs)
+    
+    def destroy(self, request, *args, **kwargs):
+        """Delete a payment unless its day has already been closed."""
+        try:
+            ensure_day_open(self.get_object().payment_date)
+        except DailyClosingError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return super().destroy(request, *args, **kwargs)
+    
     @action(detail=False)
     def invoice_payments(self, request):
         """Get payments for a specific invoice."""
@@ -207,7 +399,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        payments = self.queryset.filter(invoice_id=invoice_id)
+        payments = self.get_queryset().filter(invoice_id=invoice_id)
         page = self.paginate_queryset(payments)
         if page is not None:
             serializer = self.get_serializer(page, many=True)
@@ -215,28 +407,143 @@ class PaymentViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(payments, many=True)
         return Response(serializer.data)
     
-# Tạo view để in hóa đơn
-class InvoicePrintView(View):
-    def get(self, request, pk):
-        invoice = get_object_or_404(Invoice, pk=pk)
-        
-        # Lấy danh sách dịch vụ
-        services = ExaminationService.objects.filter(examination=invoice.examination)
+    @action(detail=False, methods=['post'])
+    def reconcile(self, request):
+        """
+        Đối soát sao kê ngân hàng (CSV: date, amount, reference, description)
+        và ghi nhận hàng loạt các khoản chuyển khoản khớp với hoá đơn.
+        """
+        statement = request.FILES.get('file')
+        if not statement:
+            return Response(
+                {"error": "Statement file is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Lấy danh sách thuốc nếu có
-        medicines = []
         try:
-            if hasattr(invoice.examination, 'prescription'):
-                medicines = PrescriptionItem.objects.filter(
-                    prescription=invoice.examination.prescription
-                )
-        except:
-            pass
-        
-        context = {
-            'invoice': invoice,
-            'services': services,
-            'medicines': medicines
-        }
+            text = statement.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return Response(
+                {"error": "Statement file must be UTF-8 encoded"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        return render(request, 'billing/invoice_print.html', context)
\ No newline at end of file
+        dry_run = str(request.data.get('dry_run', '')).lower() in ['1', 'true', 'yes']
+        result = reconcile_file(
+            io.StringIO(text, newline=''),
+            staff=request.user,
+            dry_run=dry_run
+        )
+        return Response(result, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+    
+class InvoicePdfBundleViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for monthly PDF bundles of invoices.
+    Creating a bundle starts a background job; poll the bundle and download it when completed.
+    """
+    queryset = InvoicePdfBundle.objects.all()
+    serializer_class = InvoicePdfBundleSerializer
+
+    def get_permissions(self):
+        """
+        Only admin and staff can export invoice bundles.
+        """
+        permission_classes = [permissions.IsAuthenticated, IsStaffOrAdmin]
+        return [permission() for permission in permission_classes]
+
+    def create(self, request, *args, **kwargs):
+        """Queue a new PDF bundle for the given date range."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        bundle = serializer.save(requested_by=request.user)
+        # Chỉ chạy job sau khi bản ghi gói đã được commit để thread nền đọc được
+        transaction.on_commit(lambda: start_bundle_job(bundle))
+        return Response(self.get_serializer(bundle).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Download the zip archive of a completed bundle."""
+        bundle = self.get_object()
+        if bundle.status != InvoicePdfBundle.BundleStatus.COMPLETED or not os.path.exists(bundle.file_path):
+            return Response(
+                {"error": "Bundle is not ready"},
+                status=status.HTTP_409_CONFLICT
+            )
+        return FileResponse(
+            open(bundle.file_path, 'rb'),
+            as_attachment=True,
+            filename=os.path.basename(bundle.file_path)
+        )
+
+
+class DailyClosingViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for end-of-day cash closings.
+    A closing is an immutable snapshot of the day's payments per staff and payment method.
+    """
+    serializer_class = DailyClosingSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['closing_date']
+    pagination_class = StandardResultsSetPagination
+
+    def get_queryset(self):
+        return DailyClosing.objects.select_related('closed_by').prefetch_related(
+            Prefetch('lines', queryset=DailyClosingLine.objects.select_related('staff'))
+        )
+
+    def get_permissions(self):
+        """
+        Only admin and staff can close the day.
+        """
+        permission_classes = [permissions.IsAuthenticated, IsStaffOrAdmin]
+        return [permission() for permission in permission_classes]
+
+    def create(self, request, *args, **kwargs):
+        """Close the given day (default: yesterday)."""
+        yesterday = timezone.localdate() - timedelta(days=1)
+        serializer = self.get_serializer(data={
+            'closing_date': request.data.get('closing_date', yesterday.isoformat()),
+            'notes': request.data.get('notes', ''),
+        })
+        serializer.is_valid(raise_exception=True)
+        try:
+            closing = close_day(
+                serializer.validated_data['closing_date'],
+                closed_by=request.user,
+                notes=serializer.validated_data.get('notes', '')
+            )
+        except DailyClosingError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(self.get_queryset().get(pk=closing.pk)).data,
+                        status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Tổng thu trong khoảng ngày, đọc từ các bản chốt sổ"""
+        today = timezone.localdate()
+        try:
+            date_from = datetime.strptime(
+                request.query_params.get('date_from', today.replace(day=1).isoformat()), '%Y-%m-%d'
+            ).date()
+            date_to = datetime.strptime(
+                request.query_params.get('date_to', today.isoformat()), '%Y-%m-%d'
+            ).date()
+        except ValueError:
+            return Response(
+                {"error": "Invalid date, expected YYYY-MM-DD"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if date_from > date_to:
+            return Response(
+                {"error": "date_from must not be after date_to"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(closing_summary(date_from, date_to))
+
+
+# Tạo view để in hóa đơn
+class InvoicePrintView(View):
+    def get(self, request, pk):
+        invoice = get_object_or_404(get_print_queryset(), pk=pk)
+        context = get_invoice_print_context(invoice)
+        return render(request, 'billing/invoice_print.html', context)
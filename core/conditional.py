@@ -0,0 +1,72 @@
+import hashlib
+import json
+
+from django.db.models import Count, DateTimeField, IntegerField, Max, OuterRef, Subquery
+from django.utils.cache import get_conditional_response, quote_etag
+
+from .serializers import get_field_selection
+
+
+def related_version(name, queryset, field, outer_ref='pk', timestamp_field='updated_at'):
+    """
+    Annotation phiên bản của các dòng liên quan: `<name>_count` và `<name>_updated_at`
+    (số dòng và thời điểm cập nhật gần nhất), tính bằng subquery gộp. Số dòng thay đổi
+    khi thêm/xoá, thời điểm thay đổi khi thêm/sửa.
+    """
+    related = queryset.filter(**{field: OuterRef(outer_ref)}).order_by().values(field)
+    return {
+        f'{name}_count': Subquery(
+            related.annotate(value=Count('pk')).values('value'), output_field=IntegerField()
+        ),
+        f'{name}_updated_at': Subquery(
+            related.annotate(value=Max(timestamp_field)).values('value'), output_field=DateTimeField()
+        ),
+    }
+
+
+class ConditionalRetrieveMixin:
+    """
+    Mixin cho ViewSet hỗ trợ GET có điều kiện (ETag) ở action retrieve.
+
+    Phiên bản của tài nguyên gồm `updated_at` của bản ghi cùng các annotation trong
+    get_version_annotations() (ví dụ related_version() của các dòng lồng nhau, updated_at
+    của người dùng/danh mục được lồng vào), lấy bằng một truy vấn nhẹ trên
+    filter_queryset(get_queryset()) - cùng phạm vi dữ liệu theo người dùng và bộ lọc
+    như get_object() của retrieve.
+    Nếu client gửi If-None-Match khớp thì trả về 304 mà không nạp và serialize bản ghi.
+
+    Không gửi Last-Modified: xoá một dòng lồng nhau chỉ làm đổi `<name>_count`, không làm
+    tăng thời điểm cập nhật nào, nên If-Modified-Since sẽ nhận 304 với dữ liệu cũ.
+    """
+    last_modified_field = 'updated_at'
+
+    def get_version_annotations(self):
+        return {}
+
+    def get_resource_version(self):
+        """Trả về ETag của bản ghi hoặc None nếu không tìm thấy bản ghi."""
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        annotations = self.get_version_annotations()
+        queryset = self.filter_queryset(self.get_queryset())
+        row = queryset.select_related(None).prefetch_related(None).order_by().filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        ).annotate(**annotations).values(self.last_modified_field, *annotations).first()
+        if row is None:
+            return None
+
+        # Cùng bản ghi nhưng khác ?fields=/?expand= thì nội dung trả về khác nhau
+        fields, expand = get_field_selection(self.request)
+        payload = [sorted(row.items()), sorted(fields or ()), sorted(expand)]
+        digest = hashlib.md5(json.dumps(payload, default=str).encode()).hexdigest()
+        return quote_etag(f'W/"{digest}"')
+
+    def retrieve(self, request, *args, **kwargs):
+        etag = self.get_resource_version()
+        if etag is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().retrieve(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
@@ -0,0 +1,27 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class StandardResultsSetPagination(PageNumberPagination):
+    """
+    Phân trang mặc định cho các danh sách lớn (mặc định 50 bản ghi/trang).
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class TimelineCursorPagination(CursorPagination):
+    """
+    Phân trang theo con trỏ cho các bảng ghi nhận theo thời gian, mới nhất trước.
+
+    Con trỏ của DRF chỉ định vị trên trường sắp xếp đầu tiên: mỗi trang là truy vấn
+    WHERE created_at < vị trí ORDER BY created_at DESC, id DESC OFFSET n LIMIT, với n là
+    số dòng cùng created_at ở cuối trang trước đã trả về (id chỉ giữ thứ tự ổn định giữa
+    các dòng trùng thời điểm). Không cần COUNT và không chậm dần khi đi sâu như phân trang
+    OFFSET; chỉ nhóm dòng trùng created_at (vd. ghi bằng bulk_create) mới phải bỏ qua
+    bằng OFFSET, tối đa offset_cutoff dòng.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created_at', '-id')
@@ -0,0 +1,137 @@
+import datetime
+from functools import lru_cache
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+# Ngày hiệu lực của giá trước lần đổi giá đầu tiên được ghi nhận (dữ liệu có trước
+# khi có bảng lịch sử giá): giá đó áp dụng cho mọi ngày trước lần đổi giá
+LEGACY_EFFECTIVE_FROM = datetime.date.min
+
+
+class PriceHistory:
+    """
+    Tra giá theo thời điểm từ bảng lịch sử giá (ví dụ MedicinePriceHistory) của một
+    model có trường `price` (Medicine, DentalService).
+
+    - price_on(): giá của một đối tượng tại một ngày, cache trong tiến trình (LRU). Chỉ
+      cache các ngày đã qua - giá quá khứ không đổi trừ khi nhập lịch sử lùi ngày, khi đó
+      gọi clear(). Giá hôm nay/tương lai luôn đọc từ CSDL.
+    - price_at(): biểu thức Coalesce(Subquery) để gắn giá theo ngày vào một queryset,
+      dùng cho các hàm tra giá hàng loạt trong một truy vấn.
+    Đối tượng chưa có lịch sử thì dùng giá hiện tại; lần đổi giá đầu tiên ghi thêm
+    giá cũ với ngày hiệu lực LEGACY_EFFECTIVE_FROM để các ngày trước đó giữ giá cũ.
+    """
+
+    def __init__(self, history_model, field, cache_size=4096):
+        self.history_model = history_model
+        self.field = field
+        self.model = history_model._meta.get_field(field).related_model
+        self._cached = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def price_at(self, object_ref, day, fallback):
+        """Giá của đối tượng `object_ref` (OuterRef/giá trị) tại ngày `day` (giá trị/OuterRef/F)."""
+        return Coalesce(
+            Subquery(
+                self.history_model.objects.filter(
+                    **{self.field: object_ref, 'effective_from__lte': day}
+                ).order_by('-effective_from').values('price')[:1]
+            ),
+            fallback
+        )
+
+    def _lookup(self, object_id, day):
+        return self.model.objects.filter(pk=object_id).annotate(
+            price_on_day=self.price_at(OuterRef('pk'), day, F('price'))
+        ).values_list('price_on_day', flat=True).first()
+
+    def price_on(self, object_id, day):
+        if day < timezone.localdate():
+            return self._cached(object_id, day)
+        return self._lookup(object_id, day)
+
+    def prices_on(self, object_ids, day):
+        """Giá của nhiều đối tượng tại cùng một ngày {id: giá} - một truy vấn."""
+        return dict(
+            self.model.objects.filter(pk__in=object_ids).annotate(
+                price_on_day=self.price_at(OuterRef('pk'), day, F('price'))
+            ).values_list('pk', 'price_on_day')
+        )
+
+    def seed_previous_prices(self, previous_prices):
+        """
+        Ghi giá cũ {id: giá} với ngày hiệu lực LEGACY_EFFECTIVE_FROM cho các đối tượng
+        chưa có dòng lịch sử nào - gọi trước khi ghi giá mới của lần đổi giá đầu tiên.
+        """
+        if not previous_prices:
+            return
+        with_history = set(
+            self.history_model.objects.filter(**{f'{self.field}__in': previous_prices}).values_list(
+                self.field, flat=True
+            ).distinct()
+        )
+        self.history_model.objects.bulk_create([
+            self.history_model(**{f'{self.field}_id': object_id, 'price': price,
+                                  'effective_from': LEGACY_EFFECTIVE_FROM})
+            for object_id, price in previous_prices.items()
+            if object_id not in with_history and price is not None
+        ])
+
+    def record(self, obj, day=None, previous_price=None):
+        """
+        Ghi giá hiện tại của `obj` có hiệu lực từ ngày `day` (mặc định hôm nay).
+        `previous_price` là giá trước khi đổi, được ghi lại nếu `obj` chưa có lịch sử.
+        """
+        day = day or timezone.localdate()
+        if previous_price is not None:
+            self.seed_previous_prices({obj.pk: previous_price})
+        self.history_model.objects.update_or_create(
+            **{self.field: obj, 'effective_from': day}, defaults={'price': obj.price}
+        )
+        if day < timezone.localdate():
+            self.clear()
+
+    def clear(self):
+        self._cached.cache_clear()
+
+
+class PriceHistoryMixin:
+    """
+    Mixin cho model có trường `price`: mỗi lần save() làm thay đổi giá thì ghi thêm một
+    dòng lịch sử giá (cùng transaction). Model khai báo `price_history_path`: đường
+    dẫn import tới PriceHistory tương ứng. bulk_create/bulk_update/update() không đi
+    qua save() nên nơi gọi phải tự ghi lịch sử.
+    """
+
+    price_history_path = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Giá lúc nạp từ CSDL, để save() biết giá có thay đổi không
+        instance._saved_price = instance.__dict__.get('price')
+        return instance
+
+    @classmethod
+    def get_price_history(cls):
+        # Import khi dùng: module PriceHistory import lại model này
+        return import_string(cls.price_history_path)
+
+    def _price_changed(self, update_fields):
+        # Trường price bị defer (only()) hoặc không nằm trong update_fields thì không đổi
+        if 'price' not in self.__dict__ or (update_fields is not None and 'price' not in update_fields):
+            return False
+        return self._state.adding or self.price != getattr(self, '_saved_price', None)
+
+    def save(self, *args, **kwargs):
+        if not self._price_changed(kwargs.get('update_fields')):
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.get_price_history().record(
+                self, previous_price=None if self._state.adding else getattr(self, '_saved_price', None)
+            )
+        self._saved_price = self.price
@@ -0,0 +1,56 @@
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def parse_field_list(value):
+    """Tách chuỗi 'a,b,c' thành tập tên trường; None nếu không truyền."""
+    if not value:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def get_field_selection(request):
+    """
+    Đọc ?fields= và ?expand= của request GET.
+    Trả về (fields, expand); fields là None nghĩa là trả về đầy đủ các trường.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None, set()
+    params = getattr(request, 'query_params', request.GET)
+    return parse_field_list(params.get('fields')), parse_field_list(params.get('expand')) or set()
+
+
+def is_field_requested(request, name):
+    """Cho view biết có cần nạp dữ liệu (select_related/prefetch) cho trường này không."""
+    fields, expand = get_field_selection(request)
+    return fields is None or name in fields or name in expand
+
+
+class DynamicFieldsMixin:
+    """
+    Mixin cho ModelSerializer hỗ trợ sparse fieldsets:
+    - ?fields=id,total chỉ trả về các trường được liệt kê.
+    - ?expand=examination_detail thêm các trường lồng nhau nặng khai báo trong
+      Meta.expandable_fields vào danh sách ?fields=.
+    Không truyền ?fields= thì trả về đầy đủ như trước. Chỉ áp dụng cho
+    serializer gốc của response, serializer lồng bên trong giữ nguyên.
+    """
+
+    def _is_root_serializer(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self._is_root_serializer():
+            return fields
+
+        selected, expand = get_field_selection(self.context.get('request'))
+        if selected is None:
+            return fields
+
+        expandable = set(getattr(self.Meta, 'expandable_fields', ()))
+        keep = selected | (expand & expandable)
+        return {name: field for name, field in fields.items() if name in keep}
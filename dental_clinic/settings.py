@@ -10,12 +10,16 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Đang chạy `manage.py test`
+TESTING = sys.argv[1:2] == ['test']
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -38,8 +42,10 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
+    'core.apps.CoreConfig',
     'accounts.apps.AccountsConfig',
     'appointments.apps.AppointmentsConfig',
     'medical_records.apps.MedicalRecordsConfig',
@@ -67,7 +73,7 @@ ROOT_URLCONF = 'dental_clinic.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
+        'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -206,4 +212,31 @@ LOGGING = {
             'propagate': True,
         },
     },
-}
\ No newline at end of file
+}
+
+# Cache dùng chung cho mọi tiến trình (web worker, lệnh quản trị chạy theo lịch): tốc độ
+# tiêu thụ thuốc (refresh_reorder_rates), dashboard hạn dùng (sweep_expired_medicines) và
+# phiên bản cache doanh thu phải được các worker khác nhìn thấy, nên không dùng cache
+# trong tiến trình (LocMemCache). Tạo bảng cache một lần: python manage.py createcachetable
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    }
+}
+if TESTING:
+    CACHES['default'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+
+# Thư mục lưu các gói PDF hoá đơn (file zip) xuất hàng tháng
+INVOICE_BUNDLE_DIR = BASE_DIR / 'exports' / 'invoice_bundles'
+
+# Cấu hình hàng đợi ghi nhật ký thao tác thanh toán (BillingLogMiddleware)
+# Khi chạy test: không khởi động thread ghi nền và không ghi bảng AuditEvent (thread
+# dùng kết nối DB riêng, nằm ngoài transaction của test); test gọi billing.audit.flush()
+BILLING_AUDIT = {
+    'SINKS': ('file',) if TESTING else ('file', 'db'),  # Ghi ra logs/billing.log và bảng AuditEvent
+    'WRITER_THREAD': not TESTING,
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 2.0,  # Giây
+    'QUEUE_SIZE': 10000,
+}
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from .models import (
     DentalService, 
+    DentalServicePriceHistory,
     MedicalRecord, 
     Examination, 
     ExaminationService
@@ -14,6 +15,15 @@ class DentalServiceAdmin(admin.ModelAdmin):
     list_filter = ('price',)
 
 
+@admin.register(DentalServicePriceHistory)
+class DentalServicePriceHistoryAdmin(admin.ModelAdmin):
+    """Admin configuration for Dental Service price history."""
+    list_display = ('service', 'price', 'effective_from', 'created_at')
+    search_fields = ('service__name',)
+    list_filter = ('effective_from',)
+    readonly_fields = ('created_at',)
+
+
 @admin.register(MedicalRecord)
 class MedicalRecordAdmin(admin.ModelAdmin):
     """Admin configuration for Medical Records."""
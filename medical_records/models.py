@@ -2,15 +2,19 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from accounts.models import User
+from core.price_history import PriceHistoryMixin
 from appointments.models import Appointment
 
 # Create your models here.
-class DentalService(models.Model):
+class DentalService(PriceHistoryMixin, models.Model):
     """Model for storing dental services information."""
     
     name = models.CharField(_('Tên dịch vụ'), max_length=255)
     description = models.TextField(_('Mô tả dịch vụ'), blank=True)
     price = models.DecimalField(_('Giá'), max_digits=10, decimal_places=0)
+    updated_at = models.DateTimeField(_('Cập nhật lần cuối'), auto_now=True)
+    
+    price_history_path = 'medical_records.pricing.service_prices'
     
     class Meta:
         verbose_name = _('Dịch vụ nha khoa')
@@ -20,6 +24,34 @@ class DentalService(models.Model):
         return self.name
 
 
+class DentalServicePriceHistory(models.Model):
+    """
+    Model lưu giá dịch vụ theo thời gian: giá có hiệu lực từ ngày `effective_from` tới
+    ngày hiệu lực của dòng kế tiếp. Được ghi khi giá dịch vụ thay đổi.
+    """
+    
+    service = models.ForeignKey(
+        DentalService,
+        on_delete=models.CASCADE,
+        related_name='price_history'
+    )
+    price = models.DecimalField(_('Giá'), max_digits=10, decimal_places=0)
+    effective_from = models.DateField(_('Áp dụng từ ngày'))
+    created_at = models.DateTimeField(_('Ngày tạo'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('Lịch sử giá dịch vụ')
+        verbose_name_plural = _('Lịch sử giá dịch vụ')
+        ordering = ['service', '-effective_from']
+        constraints = [
+            # Chỉ mục (service, effective_from) cho tra giá theo ngày
+            models.UniqueConstraint(fields=['service', 'effective_from'], name='service_price_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.service_id} - {self.effective_from}: {self.price}"
+
+
 class MedicalRecord(models.Model):
     """Main medical record for a patient."""
     
@@ -66,6 +98,7 @@ class Examination(models.Model):
     diagnosis = models.TextField(_('Chẩn đoán'))
     treatment_plan = models.TextField(_('Kế hoạch điều trị'), blank=True)
     notes = models.TextField(_('Ghi chú'), blank=True)
+    updated_at = models.DateTimeField(_('Cập nhật lần cuối'), auto_now=True)
     
     class Meta:
         verbose_name = _('Lần khám')
@@ -92,6 +125,7 @@ class ExaminationService(models.Model):
     quantity = models.PositiveIntegerField(_('Số lượng'), default=1)
     price = models.DecimalField(_('Giá áp dụng'), max_digits=10, decimal_places=0)
     notes = models.TextField(_('Ghi chú'), blank=True)
+    updated_at = models.DateTimeField(_('Cập nhật lần cuối'), auto_now=True)
     
     class Meta:
         verbose_name = _('Dịch vụ đã sử dụng')
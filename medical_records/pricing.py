@@ -0,0 +1,20 @@
+from django.db.models import F, OuterRef
+
+from core.price_history import PriceHistory
+
+from .models import DentalServicePriceHistory, ExaminationService
+
+# Giá dịch vụ theo ngày; cache trong tiến trình cho các ngày đã qua
+service_prices = PriceHistory(DentalServicePriceHistory, 'service')
+
+
+def price_examination_services(examination_ids):
+    """
+    Các dịch vụ của những lần khám kèm `catalog_price`: giá niêm yết của dịch vụ vào
+    ngày khám - một truy vấn cho cả danh sách lần khám (hoặc hoá đơn của chúng).
+    """
+    return ExaminationService.objects.filter(examination_id__in=examination_ids).annotate(
+        catalog_price=service_prices.price_at(
+            OuterRef('service'), OuterRef('examination__examination_date'), F('service__price')
+        )
+    )
@@ -1,10 +1,12 @@
+from django.db import transaction
 from rest_framework import serializers
 from .models import DentalService, MedicalRecord, Examination, ExaminationService
 from accounts.serializers import UserPublicSerializer
+from core.serializers import DynamicFieldsMixin
 from accounts.models import User
 
 
-class DentalServiceSerializer(serializers.ModelSerializer):
+class DentalServiceSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for DentalService model."""
     
     class Meta:
@@ -13,7 +15,7 @@ class DentalServiceSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class ExaminationServiceSerializer(serializers.ModelSerializer):
+class ExaminationServiceSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for ExaminationService model."""
     
     service_detail = DentalServiceSerializer(source='service', read_only=True)
@@ -22,9 +24,10 @@ class ExaminationServiceSerializer(serializers.ModelSerializer):
         model = ExaminationService
         fields = ('id', 'examination', 'service', 'service_detail', 'quantity', 'price', 'notes')
         read_only_fields = ('id',)
+        expandable_fields = ('service_detail',)
 
 
-class ExaminationSerializer(serializers.ModelSerializer):
+class ExaminationSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for Examination model."""
     
     dentist_detail = UserPublicSerializer(source='dentist', read_only=True)
@@ -35,9 +38,10 @@ class ExaminationSerializer(serializers.ModelSerializer):
         fields = ('id', 'medical_record', 'appointment', 'dentist', 'dentist_detail',
                   'examination_date', 'diagnosis', 'treatment_plan', 'notes', 'services')
         read_only_fields = ('id',)
+        expandable_fields = ('dentist_detail', 'services')
 
 
-class MedicalRecordSerializer(serializers.ModelSerializer):
+class MedicalRecordSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for MedicalRecord model."""
     
     patient_detail = UserPublicSerializer(source='patient', read_only=True)
@@ -48,6 +52,7 @@ class MedicalRecordSerializer(serializers.ModelSerializer):
         fields = ('id', 'patient', 'patient_detail', 'created_at', 'updated_at',
                   'notes', 'examinations')
         read_only_fields = ('id', 'created_at', 'updated_at')
+        expandable_fields = ('patient_detail', 'examinations')
 
 
 class ExaminationServiceCreateSerializer(serializers.ModelSerializer):
@@ -89,15 +94,18 @@ class ExaminationCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """Create an examination with nested services."""
         services_data = validated_data.pop('services', [])
-        examination = Examination.objects.create(**validated_data)
         
-        for service_data in services_data:
-            service = service_data.pop('service')
-            ExaminationService.objects.create(
-                examination=examination,
-                service=service,
-                price=service.price,
-                **service_data
-            )
+        # Hoá đơn của lần khám được tạo khi giao dịch commit, sau khi đã lưu đủ dịch vụ
+        with transaction.atomic():
+            examination = Examination.objects.create(**validated_data)
+            
+            for service_data in services_data:
+                service = service_data.pop('service')
+                ExaminationService.objects.create(
+                    examination=examination,
+                    service=service,
+                    price=service.price,
+                    **service_data
+                )
         
         return examination
\ No newline at end of file
@@ -1,6 +1,7 @@
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db.models import F
 from django.shortcuts import get_object_or_404
 
 from .models import (
@@ -17,6 +18,7 @@ from .serializers import (
     ExaminationServiceSerializer
 )
 from accounts.models import User
+from core.conditional import ConditionalRetrieveMixin, related_version
 
 
 class DentalServiceViewSet(viewsets.ModelViewSet):
@@ -38,7 +40,7 @@ class DentalServiceViewSet(viewsets.ModelViewSet):
         return [permission() for permission in permission_classes]
 
 
-class MedicalRecordViewSet(viewsets.ReadOnlyModelViewSet):
+class MedicalRecordViewSet(ConditionalRetrieveMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for medical records with custom actions."""
     queryset = MedicalRecord.objects.all()
     serializer_class = MedicalRecordSerializer
@@ -64,6 +66,21 @@ class MedicalRecordViewSet(viewsets.ReadOnlyModelViewSet):
             return MedicalRecord.objects.filter(patient=user)
         return MedicalRecord.objects.none()
 
+    def get_version_annotations(self):
+        """Phiên bản của hồ sơ: bệnh nhân, các lần khám (kèm nha sĩ) và dịch vụ đã dùng."""
+        return {
+            'patient_updated_at': F('patient__updated_at'),
+            **related_version('examinations', Examination.objects.all(), 'medical_record'),
+            **related_version(
+                'dentists', Examination.objects.all(), 'medical_record', timestamp_field='dentist__updated_at'
+            ),
+            **related_version('services', ExaminationService.objects.all(), 'examination__medical_record'),
+            **related_version(
+                'service_catalog', ExaminationService.objects.all(), 'examination__medical_record',
+                timestamp_field='service__updated_at'
+            ),
+        }
+
     @action(detail=False, methods=['GET'], url_path='my-record')
     def get_current_user_record(self, request):
         """
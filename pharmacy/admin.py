@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Medicine, Prescription, PrescriptionItem, MedicineStock
+from .models import (
+    Medicine, MedicineLot, Prescription, PrescriptionItem, MedicineStock, MedicineStockSnapshot,
+    StockImportFile, StockReservation, MedicinePriceHistory
+)
 
 
 @admin.register(Medicine)
@@ -20,6 +23,24 @@ class MedicineAdmin(admin.ModelAdmin):
     list_per_page = 20
 
 
+@admin.register(MedicineLot)
+class MedicineLotAdmin(admin.ModelAdmin):
+    """Admin configuration for MedicineLot model."""
+    
+    list_display = (
+        'medicine', 
+        'lot_number', 
+        'expiry_date', 
+        'quantity_received', 
+        'quantity_remaining', 
+        'received_at'
+    )
+    list_filter = ('expiry_date',)
+    search_fields = ('medicine__name', 'medicine__code', 'lot_number')
+    readonly_fields = ('quantity_received', 'quantity_remaining', 'received_at')
+    list_per_page = 20
+
+
 class PrescriptionItemInline(admin.TabularInline):
     """Inline admin for PrescriptionItem."""
     
@@ -57,4 +78,58 @@ class MedicineStockAdmin(admin.ModelAdmin):
     )
     list_filter = ('stock_type', 'created_at')
     search_fields = ('medicine__name', 'reference')
-    list_per_page = 20
\ No newline at end of file
+    list_per_page = 20
+
+
+@admin.register(MedicineStockSnapshot)
+class MedicineStockSnapshotAdmin(admin.ModelAdmin):
+    """Admin configuration for MedicineStockSnapshot model."""
+    
+    list_display = ('medicine', 'snapshot_date', 'quantity', 'created_at')
+    list_filter = ('snapshot_date',)
+    search_fields = ('medicine__name', 'medicine__code')
+    readonly_fields = ('medicine', 'snapshot_date', 'quantity', 'created_at')
+    list_per_page = 20
+
+
+@admin.register(StockImportFile)
+class StockImportFileAdmin(admin.ModelAdmin):
+    """Admin configuration for StockImportFile model."""
+    
+    list_display = (
+        'file_name', 
+        'line_count', 
+        'created_medicine_count', 
+        'updated_medicine_count', 
+        'total_quantity', 
+        'imported_by', 
+        'created_at'
+    )
+    search_fields = ('file_name', 'sha256')
+    readonly_fields = (
+        'sha256', 'file_name', 'line_count', 'created_medicine_count', 'updated_medicine_count',
+        'total_quantity', 'imported_by', 'created_at'
+    )
+    list_per_page = 20
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    """Admin configuration for StockReservation model."""
+    
+    list_display = ('token', 'medicine', 'quantity', 'examination', 'reserved_by', 'expires_at')
+    list_filter = ('expires_at',)
+    search_fields = ('token', 'medicine__name', 'medicine__code')
+    readonly_fields = ('created_at',)
+    list_per_page = 20
+
+
+@admin.register(MedicinePriceHistory)
+class MedicinePriceHistoryAdmin(admin.ModelAdmin):
+    """Admin configuration for MedicinePriceHistory model."""
+    
+    list_display = ('medicine', 'price', 'effective_from', 'created_at')
+    list_filter = ('effective_from',)
+    search_fields = ('medicine__name', 'medicine__code')
+    readonly_fields = ('created_at',)
+    list_per_page = 20
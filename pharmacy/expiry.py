@@ -0,0 +1,137 @@
+import datetime
+
+from django.core.cache import cache
+from django.db.models import BooleanField, Case, CharField, Count, DateField, Exists, F, OuterRef, Q, Sum, Value, When
+from django.utils import timezone
+
+from .models import Medicine, MedicineLot
+
+# Các khoảng hạn dùng: (tên, số ngày tính từ hôm nay); trước hôm nay là 'expired'
+EXPIRY_BUCKETS = (('expired', 0), ('under_30_days', 30), ('under_90_days', 90))
+
+CACHE_TIMEOUT = 15 * 60
+DASHBOARD_LIST_LIMIT = 50
+
+
+def _cache_key(today):
+    return f'pharmacy:expiry-dashboard:{today.isoformat()}'
+
+
+def expiry_bucket(today, field='expiry_date'):
+    """Biểu thức Case gán mỗi dòng vào một khoảng hạn dùng trong EXPIRY_BUCKETS."""
+    return Case(
+        *(When(**{f'{field}__lt': today + datetime.timedelta(days=days)}, then=Value(name))
+          for name, days in EXPIRY_BUCKETS),
+        output_field=CharField(),
+    )
+
+
+def _horizon(today):
+    return today + datetime.timedelta(days=EXPIRY_BUCKETS[-1][1])
+
+
+def _empty_buckets(*fields):
+    return {name: dict.fromkeys(fields, 0) for name, _ in EXPIRY_BUCKETS}
+
+
+def medicine_buckets(today):
+    """
+    Thuốc còn tồn kho gom theo khoảng hạn dùng gần nhất (Medicine.expiry_date) -
+    một truy vấn GROUP BY, chỉ đọc các dòng trong 90 ngày tới qua chỉ mục expiry_date.
+    """
+    buckets = _empty_buckets('medicine_count', 'quantity')
+    rows = Medicine.objects.filter(
+        is_active=True, quantity_in_stock__gt=0, expiry_date__lt=_horizon(today)
+    ).values(bucket=expiry_bucket(today)).annotate(
+        medicine_count=Count('id'), quantity=Sum('quantity_in_stock')
+    ).order_by()
+    for row in rows:
+        buckets[row.pop('bucket')] = row
+    return buckets
+
+
+def lot_buckets(today):
+    """Các lô còn hàng gom theo khoảng hạn dùng - một truy vấn GROUP BY."""
+    buckets = _empty_buckets('lot_count', 'medicine_count', 'quantity')
+    rows = MedicineLot.objects.filter(
+        quantity_remaining__gt=0, expiry_date__lt=_horizon(today)
+    ).values(bucket=expiry_bucket(today)).annotate(
+        lot_count=Count('id'),
+        medicine_count=Count('medicine_id', distinct=True),
+        quantity=Sum('quantity_remaining'),
+    ).order_by()
+    for row in rows:
+        buckets[row.pop('bucket')] = row
+    return buckets
+
+
+def expired_medicines(today):
+    """
+    Thuốc đang sử dụng mà toàn bộ tồn kho đã hết hạn: hạn dùng gần nhất đã qua và
+    không còn lô nào còn hạn. Thuốc có lô hết hạn nhưng vẫn còn lô khác dùng được
+    thì không bị ngừng sử dụng (FEFO đã bỏ qua lô hết hạn).
+    """
+    usable_lots = MedicineLot.objects.filter(
+        medicine=OuterRef('pk'), quantity_remaining__gt=0, expiry_date__gte=today
+    )
+    return Medicine.objects.filter(
+        is_active=True, quantity_in_stock__gt=0, expiry_date__lt=today
+    ).filter(~Exists(usable_lots))
+
+
+def reactivation_updates(medicine_ids=None):
+    """
+    Các biểu thức cho update() khi nhận lô còn hạn: bật lại thuốc đã bị rà soát hạn
+    dùng ngừng sử dụng (expired_on). Thuốc bị ngừng sử dụng thủ công giữ nguyên.
+    """
+    restored = Q(expired_on__isnull=False)
+    if medicine_ids is not None:
+        restored &= Q(pk__in=medicine_ids)
+    return {
+        'is_active': Case(When(restored, then=Value(True)), default=F('is_active'), output_field=BooleanField()),
+        'expired_on': Case(When(restored, then=Value(None)), default=F('expired_on'), output_field=DateField()),
+    }
+
+
+def expiry_dashboard(today=None, refresh=False):
+    """
+    Tổng quan hạn dùng: số thuốc/lô và số lượng theo từng khoảng hạn dùng, kèm danh
+    sách thuốc hết hạn sớm nhất. Kết quả được cache theo ngày và làm mới sau mỗi lần
+    rà soát (sweep_expired_medicines).
+    """
+    today = today or timezone.localdate()
+    key = _cache_key(today)
+    if not refresh:
+        dashboard = cache.get(key)
+        if dashboard is not None:
+            return dashboard
+
+    dashboard = {
+        'as_of': today,
+        'medicines': medicine_buckets(today),
+        'lots': lot_buckets(today),
+        'expiring_soon': list(
+            Medicine.objects.filter(
+                is_active=True, quantity_in_stock__gt=0, expiry_date__lt=_horizon(today)
+            ).order_by('expiry_date', 'name').values(
+                'id', 'code', 'name', 'unit', 'quantity_in_stock', 'expiry_date'
+            )[:DASHBOARD_LIST_LIMIT]
+        ),
+    }
+    cache.set(key, dashboard, CACHE_TIMEOUT)
+    return dashboard
+
+
+def sweep_expired(today=None, dry_run=False):
+    """
+    Ngừng sử dụng (is_active=False, ghi expired_on) các thuốc đã hết hạn bằng một lệnh
+    UPDATE rồi làm mới dashboard. Thuốc được bật lại khi nhập lô còn hạn (receive_lot,
+    nhập file). Trả về danh sách thuốc bị ngừng sử dụng.
+    """
+    today = today or timezone.localdate()
+    expired = list(expired_medicines(today).values('id', 'code', 'name', 'quantity_in_stock', 'expiry_date'))
+    if not dry_run and expired:
+        expired_medicines(today).update(is_active=False, expired_on=today, updated_at=timezone.now())
+    if not dry_run:
+        expiry_dashboard(today, refresh=True)
+    return expired
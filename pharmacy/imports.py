@@ -0,0 +1,246 @@
+import csv
+import datetime
+import hashlib
+import io
+import re
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, PositiveIntegerField, When
+from django.utils import timezone
+
+from .expiry import reactivation_updates
+from .inventory import nearest_expiry
+from .models import Medicine, MedicineLot, MedicinePriceHistory, MedicineStock, StockImportFile
+from .pricing import medicine_prices
+
+# Các cột danh mục: bắt buộc khi thuốc chưa có, nếu có thì cập nhật danh mục
+CATALOG_COLUMNS = ('name', 'unit', 'price')
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+
+
+class StockImportError(Exception):
+    """File nhập kho không hợp lệ hoặc đã được nhập trước đó."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+def file_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"Ngày không hợp lệ: {value!r}")
+
+
+def parse_quantity(value):
+    if not (value or '').isdigit():
+        raise ValueError(f"Số lượng không hợp lệ: {value!r}")
+    return int(value)
+
+
+def parse_price(value):
+    """Giá VNĐ không có phần thập phân: bỏ dấu phân cách hàng nghìn (, hoặc .)."""
+    digits = re.sub(r'[^0-9]', '', value or '')
+    if not digits or (value or '').strip().startswith('-'):
+        raise ValueError(f"Giá không hợp lệ: {value!r}")
+    return Decimal(digits)
+
+
+def parse_stock_file(file):
+    """
+    Đọc file nhập kho CSV với các cột: code, quantity, expiry_date và tuỳ chọn
+    lot_number, name, unit, price, indication. Trả về danh sách dòng (đã chuẩn hoá)
+    và danh sách dòng lỗi định dạng.
+    """
+    lines, errors = [], []
+    reader = csv.DictReader(file)
+    for line_number, row in enumerate(reader, start=2):
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        try:
+            if not row.get('code'):
+                raise ValueError("Thiếu mã thuốc")
+            line = {
+                'line': line_number,
+                'code': row['code'],
+                'quantity': parse_quantity(row.get('quantity')),
+                'expiry_date': parse_date(row.get('expiry_date', '')),
+                'lot_number': row.get('lot_number', ''),
+                'indication': row.get('indication', ''),
+            }
+            if any(row.get(column) for column in CATALOG_COLUMNS):
+                line.update(name=row.get('name', ''), unit=row.get('unit', ''), price=parse_price(row.get('price')))
+        except ValueError as e:
+            errors.append({'line': line_number, 'reason': 'invalid_format', 'detail': str(e), 'row': row})
+            continue
+        lines.append(line)
+    return lines, errors
+
+
+def import_stock(lines, imported_by=None, file_name='', digest='', dry_run=False):
+    """
+    Nhập kho hàng loạt các dòng đã đọc từ file nhà cung cấp, số truy vấn không phụ
+    thuộc số dòng:
+
+    - Danh mục thuốc được upsert theo mã bằng một lệnh bulk_create(update_conflicts=True).
+      Dòng không có name/unit/price chỉ cộng tồn kho cho thuốc đã có. Thuốc mới hoặc
+      đổi giá được ghi lịch sử giá bằng một lệnh bulk_create.
+    - Mỗi dòng có số lượng tạo một lô (MedicineLot, bulk_create) và một dòng sổ kho
+      (bulk_create); tồn kho được cộng bằng một lệnh UPDATE với Case/When F(), hạn dùng
+      của thuốc là hạn gần nhất của các lô còn hàng, thuốc đã bị rà soát hạn dùng ngừng
+      sử dụng được bật lại nếu có lô còn hạn.
+    - File được ghi nhận bằng StockImportFile (mã băm duy nhất) trong cùng transaction:
+      nhập lại cùng một file sẽ bị từ chối và không làm thay đổi tồn kho.
+
+    Cả file được nhập hoặc không nhập gì: nếu có dòng lỗi thì ném StockImportError.
+    """
+    existing = dict(Medicine.objects.filter(code__in={line['code'] for line in lines}).values_list('code', 'price'))
+    errors = [
+        {'line': line['line'], 'reason': 'unknown_medicine',
+         'detail': f"Thuốc {line['code']} chưa có trong danh mục, cần khai báo name, unit, price"}
+        for line in lines
+        if line['code'] not in existing and not all(line.get(column) for column in CATALOG_COLUMNS)
+    ]
+    if errors:
+        raise StockImportError("File nhập kho có dòng không hợp lệ.", errors)
+
+    # Dòng sau ghi đè thông tin danh mục của dòng trước cùng mã
+    catalog = {}
+    for line in lines:
+        if 'name' in line:
+            catalog[line['code']] = line
+    quantities = {}
+    for line in lines:
+        quantities[line['code']] = quantities.get(line['code'], 0) + line['quantity']
+
+    result = {
+        'dry_run': dry_run,
+        'file_name': file_name,
+        'line_count': len(lines),
+        'created_medicine_count': len({code for code in catalog if code not in existing}),
+        'updated_medicine_count': len({code for code in catalog if code in existing}),
+        'total_quantity': sum(quantities.values()),
+    }
+    if dry_run:
+        return result
+
+    try:
+        with transaction.atomic():
+            record = StockImportFile.objects.create(
+                sha256=digest,
+                file_name=file_name,
+                imported_by=imported_by,
+                **{key: result[key] for key in (
+                    'line_count', 'created_medicine_count', 'updated_medicine_count', 'total_quantity'
+                )}
+            )
+            _apply_stock_import(record, lines, catalog, quantities, existing)
+    except IntegrityError:
+        # Chỉ trùng sha256 mới là file đã nhập; lỗi ràng buộc khác (vd. trùng mã thuốc
+        # do hai lần nhập chạy song song) phải được báo nguyên trạng
+        if not StockImportFile.objects.filter(sha256=digest).exists():
+            raise
+        raise StockImportError(f"File {file_name or digest[:12]} đã được nhập trước đó.")
+    result['import_id'] = record.id
+    return result
+
+
+def _apply_stock_import(record, lines, catalog, quantities, existing_prices):
+    now = timezone.now()
+    if catalog:
+        medicines = []
+        for line in catalog.values():
+            medicine = Medicine(
+                code=line['code'], name=line['name'], unit=line['unit'], price=line['price'],
+                indication=line['indication'], expiry_date=line['expiry_date'],
+                created_at=now, updated_at=now
+            )
+            medicine.refresh_search_fields()
+            medicines.append(medicine)
+        Medicine.objects.bulk_create(
+            medicines,
+            update_conflicts=True,
+            unique_fields=['code'],
+            update_fields=['name', 'unit', 'price', 'name_normalized', 'code_normalized', 'updated_at'],
+        )
+    medicine_ids = dict(Medicine.objects.filter(code__in=quantities).values_list('code', 'id'))
+    # bulk_create bỏ qua Medicine.save() nên tự ghi lịch sử cho thuốc mới/đổi giá;
+    # thuốc cũ chưa có lịch sử được ghi thêm giá trước khi đổi
+    changed = {code: line for code, line in catalog.items() if existing_prices.get(code) != line['price']}
+    medicine_prices.seed_previous_prices({
+        medicine_ids[code]: existing_prices[code] for code in changed if code in existing_prices
+    })
+    price_changes = [
+        MedicinePriceHistory(medicine_id=medicine_ids[code], price=line['price'], effective_from=timezone.localdate())
+        for code, line in changed.items()
+    ]
+    if price_changes:
+        MedicinePriceHistory.objects.bulk_create(
+            price_changes,
+            update_conflicts=True,
+            unique_fields=['medicine', 'effective_from'],
+            update_fields=['price'],
+        )
+
+    reference = f'StockImport-{record.id}'
+    lots = MedicineLot.objects.bulk_create([
+        MedicineLot(
+            medicine_id=medicine_ids[line['code']],
+            lot_number=line['lot_number'],
+            expiry_date=line['expiry_date'],
+            quantity_received=line['quantity'],
+            quantity_remaining=line['quantity'],
+            reference=reference
+        )
+        for line in lines if line['quantity']
+    ])
+    MedicineStock.objects.bulk_create([
+        MedicineStock(
+            medicine_id=lot.medicine_id,
+            lot=lot,
+            quantity=lot.quantity_received,
+            stock_type=MedicineStock.StockType.IMPORT,
+            reference=reference,
+            notes=f"Nhập kho từ file {record.file_name}".strip()
+        )
+        for lot in lots
+    ])
+
+    increments = {medicine_ids[code]: quantity for code, quantity in quantities.items() if quantity}
+    if increments:
+        Medicine.objects.filter(pk__in=increments).update(
+            quantity_in_stock=Case(
+                *(When(pk=medicine_id, then=F('quantity_in_stock') + quantity)
+                  for medicine_id, quantity in increments.items()),
+                output_field=PositiveIntegerField()
+            ),
+            expiry_date=nearest_expiry(),
+            updated_at=timezone.now(),
+            # Thuốc bị rà soát hạn dùng ngừng sử dụng được bật lại khi nhận lô còn hạn
+            **reactivation_updates({lot.medicine_id for lot in lots if lot.expiry_date >= timezone.localdate()})
+        )
+
+
+def import_stock_file(data, imported_by=None, file_name='', dry_run=False):
+    """Đọc nội dung file CSV (bytes) và nhập kho; dòng lỗi định dạng làm cả file bị từ chối."""
+    digest = file_digest(data)
+    if not dry_run and StockImportFile.objects.filter(sha256=digest).exists():
+        raise StockImportError(f"File {file_name or digest[:12]} đã được nhập trước đó.")
+
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise StockImportError("File nhập kho phải được mã hoá UTF-8.")
+    lines, errors = parse_stock_file(io.StringIO(text, newline=''))
+    if errors:
+        raise StockImportError("File nhập kho có dòng không hợp lệ.", errors)
+    if not lines:
+        raise StockImportError("File nhập kho không có dòng nào.")
+    return import_stock(lines, imported_by=imported_by, file_name=file_name, digest=digest, dry_run=dry_run)
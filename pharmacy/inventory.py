@@ -0,0 +1,197 @@
+from collections import defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, PositiveIntegerField, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .expiry import reactivation_updates
+from .models import Medicine, MedicineLot, MedicineStock, StockReservation
+
+
+class InsufficientStockError(Exception):
+    """Không đủ thuốc còn hạn để xuất; `shortages` = {medicine_id: (tên, có thể xuất, cần xuất)}."""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(self.messages())
+
+    def messages(self):
+        return [
+            f"Số lượng thuốc {name} trong kho không đủ (còn {available}, cần {requested})."
+            for name, available, requested in self.shortages.values()
+        ]
+
+
+def nearest_expiry():
+    """Hạn dùng gần nhất trong các lô còn hàng; giữ nguyên giá trị cũ nếu thuốc chưa có lô."""
+    return Coalesce(
+        Subquery(
+            MedicineLot.objects.filter(
+                medicine=OuterRef('pk'), quantity_remaining__gt=0
+            ).order_by('expiry_date').values('expiry_date')[:1]
+        ),
+        F('expiry_date')
+    )
+
+
+def held_quantity(exclude_token=None, now=None):
+    """
+    Tổng số lượng đang được giữ chỗ (chưa hết hạn) của thuốc, dùng làm annotation trên
+    Medicine: một subquery gộp trên chỉ mục (medicine, expires_at). Bỏ qua giữ chỗ của
+    `exclude_token` (đơn đang được lưu).
+    """
+    holds = StockReservation.objects.filter(medicine=OuterRef('pk'), expires_at__gt=now or timezone.now())
+    if exclude_token:
+        holds = holds.exclude(token=exclude_token)
+    return Coalesce(
+        Subquery(
+            holds.order_by().values('medicine').annotate(total=Sum('quantity')).values('total'),
+            output_field=IntegerField()
+        ),
+        Value(0)
+    )
+
+
+def available_stock(medicine_ids, exclude_token=None):
+    """Tồn kho khả dụng {medicine_id: tồn kho - giữ chỗ của đơn khác} - một truy vấn."""
+    return {
+        medicine_id: quantity - held
+        for medicine_id, quantity, held in Medicine.objects.filter(pk__in=medicine_ids).annotate(
+            held=held_quantity(exclude_token)
+        ).values_list('id', 'quantity_in_stock', 'held')
+    }
+
+
+def receive_lot(medicine, quantity, expiry_date, lot_number='', reference='', notes=''):
+    """
+    Nhập kho một lô thuốc: tạo MedicineLot, cộng dồn Medicine.quantity_in_stock bằng F()
+    và ghi sổ kho. Medicine.expiry_date là hạn gần nhất của các lô còn hàng, không bị
+    hạn của lô mới ghi đè. Lô còn hạn bật lại thuốc đã bị rà soát hạn dùng ngừng sử dụng.
+    """
+    usable = expiry_date >= timezone.localdate()
+    with transaction.atomic():
+        lot = MedicineLot.objects.create(
+            medicine=medicine,
+            lot_number=lot_number,
+            expiry_date=expiry_date,
+            quantity_received=quantity,
+            quantity_remaining=quantity,
+            reference=reference
+        )
+        Medicine.objects.filter(pk=medicine.pk).update(
+            quantity_in_stock=F('quantity_in_stock') + quantity,
+            expiry_date=nearest_expiry(),
+            updated_at=timezone.now(),
+            **(reactivation_updates() if usable else {})
+        )
+        return MedicineStock.objects.create(
+            medicine=medicine,
+            lot=lot,
+            quantity=quantity,
+            stock_type=MedicineStock.StockType.IMPORT,
+            reference=reference,
+            notes=notes
+        )
+
+
+def lock_stock(medicine_ids, reservation_token=None, today=None):
+    """
+    Khoá các thuốc và các lô còn hàng của chúng (sắp theo id để tránh deadlock) trong hai
+    truy vấn. Mỗi thuốc được gắn `available`: số lượng còn hạn (lô chưa hết hạn cộng tồn
+    kho cũ chưa theo lô) trừ đi giữ chỗ của các đơn khác. Trả về ({id: thuốc}, {id: [lô]}).
+    """
+    today = today or timezone.localdate()
+    medicines = {
+        medicine.id: medicine
+        for medicine in Medicine.objects.select_for_update().filter(
+            pk__in=medicine_ids
+        ).order_by('id').only('id', 'name', 'quantity_in_stock').annotate(
+            held=held_quantity(reservation_token)
+        )
+    }
+    lots = defaultdict(list)
+    for lot in MedicineLot.objects.select_for_update().filter(
+        medicine_id__in=medicine_ids, quantity_remaining__gt=0
+    ).order_by('medicine_id', 'expiry_date', 'id'):
+        lots[lot.medicine_id].append(lot)
+
+    for medicine in medicines.values():
+        tracked = sum(lot.quantity_remaining for lot in lots[medicine.id])
+        usable = sum(lot.quantity_remaining for lot in lots[medicine.id] if lot.expiry_date >= today)
+        medicine.available = usable + max(0, medicine.quantity_in_stock - tracked) - medicine.held
+    return medicines, lots
+
+
+def check_available(quantities, medicines):
+    """Ném InsufficientStockError nếu có thuốc không đủ số lượng khả dụng."""
+    shortages = {
+        medicine_id: (medicines[medicine_id].name, max(medicines[medicine_id].available, 0), requested)
+        for medicine_id, requested in quantities.items()
+        if requested > medicines[medicine_id].available
+    }
+    if shortages:
+        raise InsufficientStockError(shortages)
+
+
+def allocate_fefo(quantities, today=None, reservation_token=None):
+    """
+    Phân bổ số lượng cần xuất {medicine_id: số lượng} vào các lô theo FEFO (hết hạn trước
+    xuất trước) và trừ kho. Phải gọi trong transaction.atomic(). Số lượng đang được giữ
+    chỗ cho đơn khác không được xuất; giữ chỗ của `reservation_token` thì được dùng.
+
+    Số truy vấn cố định, không phụ thuộc số dòng thuốc:
+    - Khoá các thuốc và toàn bộ lô còn hàng của chúng (lock_stock); tổng giữ chỗ được
+      đọc cùng lúc khoá thuốc.
+    - Phân bổ trên Python; lô đã hết hạn không được xuất. Tồn kho cũ chưa theo lô
+      (quantity_in_stock lớn hơn tổng các lô) được xuất sau cùng.
+    - Cập nhật lô bằng một bulk_update, cập nhật quantity_in_stock và hạn dùng gần nhất
+      của thuốc bằng một lệnh UPDATE.
+
+    Trả về danh sách (medicine_id, lot hoặc None, số lượng); ném InsufficientStockError
+    nếu có thuốc không đủ.
+    """
+    today = today or timezone.localdate()
+    medicines, lots = lock_stock(quantities, reservation_token, today)
+    check_available(quantities, medicines)
+
+    allocations = []
+    changed_lots = []
+    for medicine_id, requested in quantities.items():
+        remaining = requested
+        for lot in lots[medicine_id]:
+            if not remaining:
+                break
+            if lot.expiry_date < today:
+                continue
+            taken = min(remaining, lot.quantity_remaining)
+            lot.quantity_remaining -= taken
+            remaining -= taken
+            changed_lots.append(lot)
+            allocations.append((medicine_id, lot, taken))
+        if remaining:
+            allocations.append((medicine_id, None, remaining))
+
+    if changed_lots:
+        MedicineLot.objects.bulk_update(changed_lots, ['quantity_remaining'])
+    # Vẫn giữ điều kiện quantity_in_stock >= số lượng xuất cho CSDL không khoá được dòng
+    updated = Medicine.objects.filter(reduce(or_, (
+        Q(pk=medicine_id, quantity_in_stock__gte=quantity)
+        for medicine_id, quantity in quantities.items()
+    ))).update(
+        quantity_in_stock=Case(
+            *(When(pk=medicine_id, then=F('quantity_in_stock') - quantity)
+              for medicine_id, quantity in quantities.items()),
+            output_field=PositiveIntegerField()
+        ),
+        expiry_date=nearest_expiry(),
+        updated_at=timezone.now()
+    )
+    if updated != len(quantities):
+        raise InsufficientStockError({
+            medicine_id: (medicines[medicine_id].name, medicines[medicine_id].quantity_in_stock, quantity)
+            for medicine_id, quantity in quantities.items()
+        })
+    return allocations
@@ -0,0 +1,74 @@
+import datetime
+import random
+import time
+from unittest import mock
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from pharmacy.models import Medicine, MedicineStock
+from pharmacy.snapshots import build_snapshots, ledger_totals, end_of_day, stock_as_of
+
+class Command(BaseCommand):
+    help = ('Benchmark as-of-date stock (snapshot + ledger tail) against summing the whole ledger. '
+            'Seeds synthetic rows inside a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000_000, help='Ledger rows to seed')
+        parser.add_argument('--medicines', type=int, default=500, help='Medicines to seed')
+        parser.add_argument('--months', type=int, default=36, help='Months of history to spread rows over')
+        parser.add_argument('--batch-size', type=int, default=50_000, help='Rows per bulk insert')
+
+    def _timed(self, label, func):
+        started = time.perf_counter()
+        result = func()
+        self.stdout.write(f'  {label:<40} {time.perf_counter() - started:>8.3f}s')
+        return result
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['medicines'] < 1 or options['months'] < 1:
+            raise CommandError('--rows, --medicines and --months must be positive')
+
+        today = timezone.localdate()
+        first_day = (today.replace(day=1) - datetime.timedelta(days=31 * options['months'])).replace(day=1)
+        span = (today - first_day).days * 86400
+        start = timezone.make_aware(datetime.datetime.combine(first_day, datetime.time.min))
+        as_of = today - datetime.timedelta(days=10)
+
+        with transaction.atomic():
+            medicines = Medicine.objects.bulk_create([
+                Medicine(code=f'BENCH-{i:05d}', name=f'Benchmark {i}', unit='viên',
+                         expiry_date=today, price=1000)
+                for i in range(options['medicines'])
+            ])
+            medicine_ids = [medicine.id for medicine in medicines]
+
+            # Giữ created_at rải đều theo thời gian thay vì auto_now_add = thời điểm chèn
+            created_at = MedicineStock._meta.get_field('created_at')
+            started = time.perf_counter()
+            with mock.patch.object(created_at, 'auto_now_add', False):
+                remaining = options['rows']
+                while remaining:
+                    size = min(remaining, options['batch_size'])
+                    MedicineStock.objects.bulk_create([
+                        MedicineStock(
+                            medicine_id=random.choice(medicine_ids),
+                            quantity=random.randint(-5, 10),
+                            stock_type=MedicineStock.StockType.ADJUST,
+                            reference='benchmark',
+                            created_at=start + datetime.timedelta(seconds=random.randrange(span))
+                        )
+                        for _ in range(size)
+                    ])
+                    remaining -= size
+            self.stdout.write(f'Seeded {options["rows"]:,} ledger rows in {time.perf_counter() - started:.1f}s')
+
+            full = self._timed('full ledger scan', lambda: ledger_totals(None, end_of_day(as_of)))
+            built = self._timed('build snapshots (first run)', build_snapshots)
+            self._timed('build snapshots (incremental, no-op)', build_snapshots)
+            fast = self._timed('snapshot + ledger tail', lambda: stock_as_of(as_of))
+            self._timed('snapshot + ledger tail (one medicine)', lambda: stock_as_of(as_of, medicine_ids[:1]))
+
+            if {key: value for key, value in full.items() if value} != fast:
+                raise CommandError('Snapshot result differs from the full ledger scan')
+            self.stdout.write(self.style.SUCCESS(f'Results match ({len(built)} monthly snapshots); rolling back'))
+            transaction.set_rollback(True)
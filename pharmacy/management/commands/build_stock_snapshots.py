@@ -0,0 +1,29 @@
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from pharmacy.snapshots import build_snapshots
+
+class Command(BaseCommand):
+    help = 'Build the missing month-end medicine stock snapshots from the stock ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--until', type=str,
+                           help='Last snapshot date, format YYYY-MM-DD (default: end of previous month)')
+
+    def handle(self, *args, **options):
+        until = None
+        if options['until']:
+            try:
+                until = datetime.strptime(options['until'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(f'Invalid date "{options["until"]}", expected YYYY-MM-DD')
+
+        try:
+            built = build_snapshots(until=until)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not built:
+            self.stdout.write('Snapshots are up to date')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Built {len(built)} snapshots ({built[0]} -> {built[-1]})'
+        ))
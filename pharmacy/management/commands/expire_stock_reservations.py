@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+from pharmacy.reservations import SWEEP_BATCH_SIZE, sweep_expired_reservations
+
+class Command(BaseCommand):
+    help = 'Delete expired stock reservations of draft prescriptions in batches (run every few minutes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE,
+                           help=f'Number of reservations deleted per query (default: {SWEEP_BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('Batch size must be a positive number')
+        deleted = sweep_expired_reservations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired reservations'))
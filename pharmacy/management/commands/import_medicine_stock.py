@@ -0,0 +1,48 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import User
+from pharmacy.imports import StockImportError, import_stock_file
+
+class Command(BaseCommand):
+    help = 'Import a supplier CSV: upsert medicines by code and add the received lots to stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', type=str,
+                           help='CSV with code, quantity, expiry_date and optional lot_number, name, unit, price, indication')
+        parser.add_argument('--staff', type=str,
+                           help='Phone number of the staff member recording the import')
+        parser.add_argument('--dry-run', action='store_true', help='Validate the file without importing')
+
+    def handle(self, *args, **options):
+        staff = None
+        if options['staff']:
+            try:
+                staff = User.objects.get(
+                    phone_number=options['staff'],
+                    user_type__in=[User.UserType.STAFF, User.UserType.ADMIN]
+                )
+            except User.DoesNotExist:
+                raise CommandError(f'Staff user not found with phone: {options["staff"]}')
+
+        try:
+            with open(options['csv_file'], 'rb') as file:
+                data = file.read()
+        except OSError as e:
+            raise CommandError(f'Failed to read import file: {str(e)}')
+
+        try:
+            result = import_stock_file(
+                data, imported_by=staff, file_name=os.path.basename(options['csv_file']),
+                dry_run=options['dry_run']
+            )
+        except StockImportError as e:
+            for error in e.errors:
+                self.stderr.write(f'Line {error["line"]}: {error["detail"]}')
+            raise CommandError(str(e))
+
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Imported {result["line_count"]} lines ({result["total_quantity"]} units): '
+            f'{result["created_medicine_count"]} new medicines, '
+            f'{result["updated_medicine_count"]} catalog updates'
+        ))
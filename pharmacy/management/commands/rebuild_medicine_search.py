@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from pharmacy.models import Medicine
+
+class Command(BaseCommand):
+    help = 'Recompute the diacritic-folded name/code columns used by medicine autocomplete'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                           help='Number of medicines updated per query (default: 1000)')
+
+    def handle(self, *args, **options):
+        medicines = list(Medicine.objects.only('id', 'name', 'code', 'name_normalized', 'code_normalized'))
+        changed = []
+        for medicine in medicines:
+            before = (medicine.name_normalized, medicine.code_normalized)
+            medicine.refresh_search_fields()
+            if (medicine.name_normalized, medicine.code_normalized) != before:
+                changed.append(medicine)
+
+        Medicine.objects.bulk_update(
+            changed, ['name_normalized', 'code_normalized'], batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated search columns for {len(changed)} of {len(medicines)} medicines'
+        ))
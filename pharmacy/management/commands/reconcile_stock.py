@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+from pharmacy.reconciliation import TRUST_CHOICES, reconcile_stock
+
+class Command(BaseCommand):
+    help = 'Compare stored medicine stock with the stock ledger and optionally fix the drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Correct the drift instead of only reporting it')
+        parser.add_argument('--trust', choices=TRUST_CHOICES, default='stock',
+                           help='Source kept when fixing: "stock" writes ADJUST ledger rows, '
+                                '"ledger" rewrites the stored quantities (default: stock)')
+        parser.add_argument('--limit', type=int, default=50,
+                           help='Maximum number of drifted medicines to list (default: 50)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = reconcile_stock(fix=options['fix'], trust=options['trust'])
+        elapsed = time.perf_counter() - started
+
+        for row in result['drift'][:options['limit']]:
+            self.stdout.write(
+                f'{row["code"]} {row["name"]}: stock {row["quantity_in_stock"]}, '
+                f'ledger {row["ledger_quantity"]} (drift {row["drift"]:+d})'
+            )
+        if result['drift_count'] > options['limit']:
+            self.stdout.write(f'... and {result["drift_count"] - options["limit"]} more')
+
+        if not result['drift_count']:
+            self.stdout.write(self.style.SUCCESS(f'No stock drift found ({elapsed:.2f}s)'))
+        elif result['fixed']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Fixed {result["drift_count"]} medicines trusting the {result["trust"]} ({elapsed:.2f}s)'
+            ))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'{result["drift_count"]} medicines drifted, run with --fix to correct them ({elapsed:.2f}s)'
+            ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from pharmacy.reorder import DEFAULT_WINDOW_DAYS, refresh_consumption_rates
+
+class Command(BaseCommand):
+    help = 'Recompute the cached medicine consumption rates used by reorder suggestions (run nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', type=int, nargs='+', default=[DEFAULT_WINDOW_DAYS],
+                           help=f'Rolling window(s) in days (default: {DEFAULT_WINDOW_DAYS})')
+
+    def handle(self, *args, **options):
+        for window_days in options['window']:
+            if window_days <= 0:
+                raise CommandError(f'Invalid window "{window_days}", expected a positive number of days')
+            rates = refresh_consumption_rates(window_days)
+            self.stdout.write(self.style.SUCCESS(
+                f'Cached consumption rates for {len(rates)} medicines ({window_days}-day window)'
+            ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from pharmacy.expiry import sweep_expired
+
+class Command(BaseCommand):
+    help = 'Deactivate medicines whose remaining stock has expired and refresh the expiry dashboard (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='List expired medicines without deactivating them')
+
+    def handle(self, *args, **options):
+        expired = sweep_expired(dry_run=options['dry_run'])
+        for medicine in expired:
+            self.stdout.write(
+                f'{medicine["code"]} {medicine["name"]}: {medicine["quantity_in_stock"]} units, '
+                f'expired {medicine["expiry_date"]}'
+            )
+
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(f'{prefix}Deactivated {len(expired)} expired medicines'))
@@ -1,10 +1,13 @@
 
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from django.utils.translation import gettext_lazy as _
+from accounts.models import User
+from core.price_history import PriceHistoryMixin
 from medical_records.models import Examination
 
 # Create your models here.
-class Medicine(models.Model):
+class Medicine(PriceHistoryMixin, models.Model):
     """Model for storing medicine information."""
     
     code = models.CharField(_('Mã thuốc'), max_length=50, unique=True)
@@ -15,16 +18,109 @@ class Medicine(models.Model):
     expiry_date = models.DateField(_('Ngày hết hạn'))
     price = models.DecimalField(_('Giá'), max_digits=10, decimal_places=0)
     is_active = models.BooleanField(_('Còn sử dụng'), default=True)
+    # Ngày bị rà soát hạn dùng ngừng sử dụng (pharmacy/expiry.py); nhập lô còn hạn thì bật lại
+    expired_on = models.DateField(_('Ngừng sử dụng do hết hạn từ'), null=True, blank=True, editable=False)
+    # Tên/mã đã bỏ dấu và viết thường, dùng cho tìm kiếm gợi ý (xem pharmacy/search.py)
+    name_normalized = models.CharField(_('Tên thuốc (không dấu)'), max_length=255, blank=True, editable=False)
+    code_normalized = models.CharField(_('Mã thuốc (không dấu)'), max_length=50, blank=True, editable=False)
     created_at = models.DateTimeField(_('Ngày tạo'), auto_now_add=True)
     updated_at = models.DateTimeField(_('Cập nhật lần cuối'), auto_now=True)
     
+    price_history_path = 'pharmacy.pricing.medicine_prices'
+    
     class Meta:
         verbose_name = _('Thuốc')
         verbose_name_plural = _('Thuốc')
         ordering = ['name']
+        indexes = [
+            # Tìm theo tiền tố (LIKE 'abc%') trên cột không dấu
+            models.Index(fields=['name_normalized'], name='medicine_name_prefix_idx',
+                         opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['code_normalized'], name='medicine_code_prefix_idx',
+                         opclasses=['varchar_pattern_ops']),
+            # Chỉ mục trigram (pg_trgm) cho tìm gần đúng/giữa chuỗi
+            GinIndex(fields=['name_normalized'], name='medicine_name_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['code_normalized'], name='medicine_code_trgm_idx', opclasses=['gin_trgm_ops']),
+            # Rà soát thuốc sắp hết hạn/đã hết hạn (pharmacy/expiry.py)
+            models.Index(fields=['expiry_date'], name='medicine_expiry_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.code})"
+    
+    def refresh_search_fields(self):
+        """Cập nhật các cột không dấu; gọi trước bulk_create/bulk_update vì các lệnh này bỏ qua save()."""
+        from .search import fold_text
+        self.name_normalized = fold_text(self.name)
+        self.code_normalized = fold_text(self.code)
+    
+    def save(self, *args, **kwargs):
+        self.refresh_search_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'name', 'code'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'name_normalized', 'code_normalized'}
+        super().save(*args, **kwargs)
+
+
+class MedicinePriceHistory(models.Model):
+    """
+    Model lưu giá thuốc theo thời gian: giá có hiệu lực từ ngày `effective_from` tới
+    ngày hiệu lực của dòng kế tiếp. Được ghi khi giá thuốc thay đổi (xem pharmacy/pricing.py).
+    """
+    
+    medicine = models.ForeignKey(
+        Medicine,
+        on_delete=models.CASCADE,
+        related_name='price_history'
+    )
+    price = models.DecimalField(_('Giá'), max_digits=10, decimal_places=0)
+    effective_from = models.DateField(_('Áp dụng từ ngày'))
+    created_at = models.DateTimeField(_('Ngày tạo'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('Lịch sử giá thuốc')
+        verbose_name_plural = _('Lịch sử giá thuốc')
+        ordering = ['medicine', '-effective_from']
+        constraints = [
+            # Chỉ mục (medicine, effective_from) cho tra giá theo ngày
+            models.UniqueConstraint(fields=['medicine', 'effective_from'], name='medicine_price_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.medicine_id} - {self.effective_from}: {self.price}"
+
+
+class MedicineLot(models.Model):
+    """
+    Model for a received lot/batch of a medicine with its own expiry date.
+    Dispensing takes from the lot that expires first (FEFO).
+    """
+    
+    medicine = models.ForeignKey(
+        Medicine,
+        on_delete=models.CASCADE,
+        related_name='lots'
+    )
+    lot_number = models.CharField(_('Số lô'), max_length=100, blank=True)
+    expiry_date = models.DateField(_('Ngày hết hạn'))
+    quantity_received = models.PositiveIntegerField(_('Số lượng nhập'))
+    quantity_remaining = models.PositiveIntegerField(_('Số lượng còn lại'))
+    reference = models.CharField(_('Mã tham chiếu'), max_length=255, blank=True)
+    received_at = models.DateTimeField(_('Ngày nhập'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('Lô thuốc')
+        verbose_name_plural = _('Lô thuốc')
+        ordering = ['medicine', 'expiry_date', 'id']
+        indexes = [
+            models.Index(fields=['medicine', 'expiry_date'], name='medicine_lot_expiry_idx'),
+            # Chỉ các lô còn hàng, dùng khi gom lô theo khoảng hạn dùng
+            models.Index(fields=['expiry_date'], name='medicine_lot_stocked_idx',
+                         condition=models.Q(quantity_remaining__gt=0)),
+        ]
+    
+    def __str__(self):
+        return f"{self.medicine.name} - {self.lot_number or self.id} ({self.expiry_date})"
 
 
 class Prescription(models.Model):
@@ -37,6 +133,7 @@ class Prescription(models.Model):
     )
     prescription_date = models.DateField(_('Ngày kê đơn'), auto_now_add=True)
     notes = models.TextField(_('Ghi chú'), blank=True)
+    updated_at = models.DateTimeField(_('Cập nhật lần cuối'), auto_now=True)
     
     class Meta:
         verbose_name = _('Đơn thuốc')
@@ -64,6 +161,7 @@ class PrescriptionItem(models.Model):
     dosage = models.CharField(_('Liều dùng'), max_length=255)
     instructions = models.TextField(_('Hướng dẫn sử dụng'))
     price = models.DecimalField(_('Giá áp dụng'), max_digits=10, decimal_places=0)
+    updated_at = models.DateTimeField(_('Cập nhật lần cuối'), auto_now=True)
     
     class Meta:
         verbose_name = _('Chi tiết đơn thuốc')
@@ -97,6 +195,13 @@ class MedicineStock(models.Model):
         max_length=10,
         choices=StockType.choices
     )
+    lot = models.ForeignKey(
+        MedicineLot,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_records'
+    )
     reference = models.CharField(_('Mã tham chiếu'), max_length=255, blank=True)
     notes = models.TextField(_('Ghi chú'), blank=True)
     created_at = models.DateTimeField(_('Ngày tạo'), auto_now_add=True)
@@ -105,6 +210,115 @@ class MedicineStock(models.Model):
         verbose_name = _('Biến động kho thuốc')
         verbose_name_plural = _('Biến động kho thuốc')
         ordering = ['-created_at']
+        indexes = [
+            # Cộng phần sổ kho phát sinh sau bản chụp tồn kho gần nhất
+            models.Index(fields=['created_at', 'medicine'], name='medicine_stock_created_idx'),
+            # Lịch sử/biểu đồ biến động kho của một thuốc
+            models.Index(fields=['medicine', 'created_at'], name='medicine_stock_timeline_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.medicine.name} - {self.stock_type} - {self.quantity}"
+
+
+class MedicineStockSnapshot(models.Model):
+    """
+    Model lưu tồn kho của từng thuốc tại cuối một ngày (bản chụp định kỳ, mặc định cuối tháng).
+    Tồn kho tại một ngày bất kỳ = bản chụp gần nhất + các dòng sổ kho phát sinh sau đó.
+    """
+    
+    medicine = models.ForeignKey(
+        Medicine,
+        on_delete=models.CASCADE,
+        related_name='stock_snapshots'
+    )
+    snapshot_date = models.DateField(_('Ngày chụp'))
+    quantity = models.IntegerField(_('Số lượng tồn'))
+    created_at = models.DateTimeField(_('Ngày tạo'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('Bản chụp tồn kho')
+        verbose_name_plural = _('Bản chụp tồn kho')
+        ordering = ['-snapshot_date', 'medicine']
+        constraints = [
+            models.UniqueConstraint(fields=['snapshot_date', 'medicine'], name='medicine_snapshot_unique'),
+        ]
+    
+    def __str__(self):
+        return f"{self.medicine_id} - {self.snapshot_date}: {self.quantity}"
+
+
+
+class StockImportFile(models.Model):
+    """
+    Model ghi nhận một file nhập kho hàng loạt đã được áp dụng. Mỗi file chỉ được
+    nhập một lần (theo mã băm SHA-256 của nội dung) nên tải lại cùng file là an toàn.
+    """
+    
+    sha256 = models.CharField(_('Mã băm SHA-256'), max_length=64, unique=True)
+    file_name = models.CharField(_('Tên file'), max_length=255, blank=True)
+    line_count = models.PositiveIntegerField(_('Số dòng'), default=0)
+    created_medicine_count = models.PositiveIntegerField(_('Số thuốc thêm mới'), default=0)
+    updated_medicine_count = models.PositiveIntegerField(_('Số thuốc cập nhật'), default=0)
+    total_quantity = models.PositiveIntegerField(_('Tổng số lượng nhập'), default=0)
+    imported_by = models.ForeignKey(
+        User,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='stock_imports'
+    )
+    created_at = models.DateTimeField(_('Ngày nhập'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('File nhập kho')
+        verbose_name_plural = _('File nhập kho')
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.file_name or self.sha256[:12]} ({self.created_at:%Y-%m-%d})"
+
+
+class StockReservation(models.Model):
+    """
+    Model giữ chỗ tồn kho có thời hạn cho đơn thuốc đang soạn. Các dòng giữ chỗ của
+    cùng một đơn dùng chung `token`; tồn kho khả dụng = tồn kho - giữ chỗ còn hiệu lực.
+    """
+    
+    token = models.CharField(_('Mã giữ chỗ'), max_length=32, db_index=True)
+    medicine = models.ForeignKey(
+        Medicine,
+        on_delete=models.CASCADE,
+        related_name='reservations'
+    )
+    quantity = models.PositiveIntegerField(_('Số lượng giữ'))
+    examination = models.ForeignKey(
+        Examination,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='stock_reservations'
+    )
+    reserved_by = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='stock_reservations'
+    )
+    expires_at = models.DateTimeField(_('Hết hạn lúc'))
+    created_at = models.DateTimeField(_('Ngày tạo'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('Giữ chỗ tồn kho')
+        verbose_name_plural = _('Giữ chỗ tồn kho')
+        ordering = ['expires_at']
+        indexes = [
+            # Tổng giữ chỗ còn hiệu lực theo thuốc
+            models.Index(fields=['medicine', 'expires_at'], name='reservation_medicine_idx'),
+            # Dọn các giữ chỗ đã hết hạn
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.medicine.name} - {self.stock_type} - {self.quantity}"
\ No newline at end of file
+        return f"{self.token} - {self.medicine_id}: {self.quantity} (đến {self.expires_at})"
@@ -0,0 +1,63 @@
+import datetime
+
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+
+from .models import MedicineStock
+from .snapshots import end_of_day
+
+# Khoảng gom nhóm: ngày, tuần (bắt đầu thứ Hai), tháng - tính theo múi giờ hiện tại
+INTERVALS = {
+    'day': TruncDate,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+# Khoảng thời gian tối đa của một chuỗi (ngày)
+MAX_SERIES_DAYS = 731
+
+# Tên cột trong kết quả theo loại biến động
+STOCK_TYPE_COLUMNS = {
+    MedicineStock.StockType.IMPORT: 'imported',
+    MedicineStock.StockType.EXPORT: 'exported',
+    MedicineStock.StockType.ADJUST: 'adjusted',
+}
+
+
+def stock_movement_series(date_from, date_to, interval='day', medicine_id=None):
+    """
+    Nhập/xuất/điều chỉnh kho theo từng ngày, tuần hoặc tháng trong khoảng
+    [date_from, date_to] - một truy vấn GROUP BY (Trunc + Sum) trên chỉ mục created_at.
+    Số xuất kho được trả về dưới dạng số dương; `net` là biến động ròng.
+    Kỳ không có biến động không có trong kết quả.
+    """
+    ledger = MedicineStock.objects.filter(
+        created_at__gte=end_of_day(date_from - datetime.timedelta(days=1)),
+        created_at__lt=end_of_day(date_to),
+    )
+    if medicine_id is not None:
+        ledger = ledger.filter(medicine_id=medicine_id)
+
+    rows = ledger.annotate(
+        period=INTERVALS[interval]('created_at', output_field=DateField())
+    ).values('period', 'stock_type').annotate(
+        total=Sum('quantity'), movement_count=Count('id')
+    ).order_by('period')
+
+    series = {}
+    for row in rows:
+        point = series.setdefault(row['period'], {
+            'period': row['period'], 'imported': 0, 'exported': 0, 'adjusted': 0, 'net': 0, 'movement_count': 0,
+        })
+        total = row['total']
+        point[STOCK_TYPE_COLUMNS[row['stock_type']]] = -total if row['stock_type'] == MedicineStock.StockType.EXPORT else total
+        point['net'] += total
+        point['movement_count'] += row['movement_count']
+
+    return {
+        'interval': interval,
+        'date_from': date_from,
+        'date_to': date_to,
+        'medicine_id': medicine_id,
+        'series': list(series.values()),
+    }
@@ -0,0 +1,21 @@
+from django.db.models import F, OuterRef
+
+from core.price_history import PriceHistory
+
+from .models import MedicinePriceHistory, PrescriptionItem
+
+# Giá thuốc theo ngày; cache trong tiến trình cho các ngày đã qua
+medicine_prices = PriceHistory(MedicinePriceHistory, 'medicine')
+
+
+def price_prescription_items(prescription_ids):
+    """
+    Các dòng thuốc của những đơn thuốc kèm `catalog_price`: giá niêm yết của thuốc
+    vào ngày kê đơn - một truy vấn cho cả danh sách đơn. So với `price` (giá đã áp
+    dụng) để báo cáo chênh lệch/biên lợi nhuận theo thời điểm.
+    """
+    return PrescriptionItem.objects.filter(prescription_id__in=prescription_ids).annotate(
+        catalog_price=medicine_prices.price_at(
+            OuterRef('medicine'), OuterRef('prescription__prescription_date'), F('medicine__price')
+        )
+    )
@@ -0,0 +1,97 @@
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Medicine, MedicineStock
+
+# Nguồn được coi là đúng khi sửa lệch:
+# - 'stock': tồn kho đã lưu (ví dụ đã kiểm kê và sửa trong admin), ghi dòng ADJUST vào sổ kho
+# - 'ledger': tổng sổ kho, cập nhật lại Medicine.quantity_in_stock
+TRUST_CHOICES = ('stock', 'ledger')
+BATCH_SIZE = 1000
+
+
+def ledger_balances(medicine_ids=None):
+    """Tổng sổ kho theo thuốc - một truy vấn GROUP BY trên toàn bộ sổ kho."""
+    ledger = MedicineStock.objects.all()
+    if medicine_ids is not None:
+        ledger = ledger.filter(medicine_id__in=medicine_ids)
+    return dict(
+        ledger.values('medicine_id').annotate(total=Sum('quantity')).order_by().values_list('medicine_id', 'total')
+    )
+
+
+def stock_drift(medicine_ids=None, lock=False):
+    """
+    Các thuốc có tồn kho đã lưu khác tổng sổ kho. Trả về danh sách dict gồm
+    id, code, name, quantity_in_stock, ledger_quantity và drift (= tồn kho - sổ kho).
+    Với lock=True các thuốc được khoá (SELECT ... FOR UPDATE) trước khi tính sổ kho.
+    """
+    medicines = Medicine.objects.order_by('id')
+    if medicine_ids is not None:
+        medicines = medicines.filter(pk__in=medicine_ids)
+    if lock:
+        medicines = medicines.select_for_update()
+    stored = list(medicines.values_list('id', 'code', 'name', 'quantity_in_stock'))
+    balances = ledger_balances(medicine_ids)
+
+    drift = []
+    for medicine_id, code, name, quantity in stored:
+        ledger_quantity = balances.get(medicine_id, 0)
+        if quantity != ledger_quantity:
+            drift.append({
+                'id': medicine_id,
+                'code': code,
+                'name': name,
+                'quantity_in_stock': quantity,
+                'ledger_quantity': ledger_quantity,
+                'drift': quantity - ledger_quantity,
+            })
+    return drift
+
+
+def reconcile_stock(fix=False, trust='stock'):
+    """
+    Đối chiếu Medicine.quantity_in_stock với tổng sổ kho của mọi thuốc.
+
+    Lần quét đầu không khoá: hai truy vấn (tồn kho và tổng sổ kho gộp theo thuốc).
+    Khi sửa, chỉ các thuốc bị lệch được khoá và tính lại trong transaction để không
+    ghi đè một lần nhập/xuất vừa hoàn tất, rồi sửa hàng loạt:
+    - trust='stock': ghi một dòng ADJUST cho mỗi thuốc (bulk_create).
+    - trust='ledger': cập nhật tồn kho theo sổ kho (bulk_update); sổ kho âm thì tồn
+      kho về 0 và ghi thêm dòng ADJUST để sổ kho cũng về 0.
+    """
+    if trust not in TRUST_CHOICES:
+        raise ValueError(f"trust phải là một trong {TRUST_CHOICES}")
+
+    drift = stock_drift()
+    if not fix or not drift:
+        return {'fixed': False, 'trust': trust, 'drift_count': len(drift), 'drift': drift}
+
+    with transaction.atomic():
+        drift = stock_drift([row['id'] for row in drift], lock=True)
+        reference = f"Reconcile-{timezone.localdate():%Y%m%d}"
+        adjustments = []
+        if trust == 'stock':
+            adjustments = [(row['id'], row['drift']) for row in drift]
+        else:
+            now = timezone.now()
+            medicines = [
+                Medicine(id=row['id'], quantity_in_stock=max(row['ledger_quantity'], 0), updated_at=now)
+                for row in drift
+            ]
+            Medicine.objects.bulk_update(medicines, ['quantity_in_stock', 'updated_at'], batch_size=BATCH_SIZE)
+            adjustments = [(row['id'], -row['ledger_quantity']) for row in drift if row['ledger_quantity'] < 0]
+
+        MedicineStock.objects.bulk_create([
+            MedicineStock(
+                medicine_id=medicine_id,
+                quantity=quantity,
+                stock_type=MedicineStock.StockType.ADJUST,
+                reference=reference,
+                notes="Điều chỉnh chênh lệch giữa tồn kho và sổ kho"
+            )
+            for medicine_id, quantity in adjustments
+        ], batch_size=BATCH_SIZE)
+
+    return {'fixed': True, 'trust': trust, 'drift_count': len(drift), 'drift': drift}
@@ -0,0 +1,94 @@
+import datetime
+import math
+
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Medicine, MedicineStock
+from .snapshots import end_of_day
+
+# Tốc độ tiêu thụ tính trên các ngày trọn vẹn gần nhất (không tính hôm nay)
+DEFAULT_WINDOW_DAYS = 30
+# Thời gian chờ hàng về: thuốc còn đủ dùng ít hơn số ngày này thì cần đặt thêm
+DEFAULT_LEAD_TIME_DAYS = 14
+# Lượng đặt đề xuất đủ dùng trong thời gian chờ hàng cộng thêm số ngày này
+DEFAULT_COVER_DAYS = 30
+
+# Tốc độ tiêu thụ được làm mới hằng đêm (lệnh refresh_reorder_rates) vào cache dùng
+# chung (settings.CACHES) để các web worker đọc lại; giữ hơn một ngày để cache không
+# hết hạn trước lần chạy kế tiếp
+CACHE_TIMEOUT = 26 * 60 * 60
+
+
+def _cache_key(window_days, today):
+    return f'pharmacy:consumption:{today.isoformat()}:{window_days}'
+
+
+def compute_consumption_rates(window_days=DEFAULT_WINDOW_DAYS, today=None):
+    """
+    Lượng dùng trung bình mỗi ngày của từng thuốc trong `window_days` ngày trước hôm nay,
+    tính từ các dòng xuất kho (EXPORT) bằng một truy vấn GROUP BY.
+    Trả về {medicine_id: số lượng/ngày}; thuốc không xuất trong kỳ không có trong kết quả.
+    """
+    today = today or timezone.localdate()
+    start = end_of_day(today - datetime.timedelta(days=window_days + 1))
+    end = end_of_day(today - datetime.timedelta(days=1))
+    exported = MedicineStock.objects.filter(
+        stock_type=MedicineStock.StockType.EXPORT,
+        created_at__gte=start,
+        created_at__lt=end,
+    ).values('medicine_id').annotate(total=Sum('quantity')).order_by().values_list('medicine_id', 'total')
+    # Dòng xuất kho ghi số âm
+    return {medicine_id: -total / window_days for medicine_id, total in exported if total}
+
+
+def refresh_consumption_rates(window_days=DEFAULT_WINDOW_DAYS, today=None):
+    today = today or timezone.localdate()
+    rates = compute_consumption_rates(window_days, today)
+    cache.set(_cache_key(window_days, today), rates, CACHE_TIMEOUT)
+    return rates
+
+
+def consumption_rates(window_days=DEFAULT_WINDOW_DAYS, today=None):
+    """Tốc độ tiêu thụ đọc từ cache của ngày hôm nay, tính lại nếu chưa có."""
+    today = today or timezone.localdate()
+    rates = cache.get(_cache_key(window_days, today))
+    if rates is None:
+        rates = refresh_consumption_rates(window_days, today)
+    return rates
+
+
+def reorder_suggestions(lead_time_days=DEFAULT_LEAD_TIME_DAYS, window_days=DEFAULT_WINDOW_DAYS,
+                        cover_days=DEFAULT_COVER_DAYS):
+    """
+    Thuốc cần đặt thêm: số ngày còn đủ dùng (tồn kho hiện tại / lượng dùng mỗi ngày) nhỏ
+    hơn thời gian chờ hàng. Tốc độ tiêu thụ lấy từ cache, tồn kho đọc trực tiếp nên
+    phản ánh ngay các lần nhập/xuất trong ngày. Sắp theo số ngày còn đủ dùng tăng dần.
+    """
+    rates = consumption_rates(window_days)
+    medicines = Medicine.objects.filter(
+        pk__in=rates, is_active=True
+    ).values('id', 'code', 'name', 'unit', 'quantity_in_stock')
+
+    suggestions = []
+    for medicine in medicines:
+        daily_usage = rates[medicine['id']]
+        days_of_cover = medicine['quantity_in_stock'] / daily_usage
+        if days_of_cover >= lead_time_days:
+            continue
+        target = math.ceil(daily_usage * (lead_time_days + cover_days))
+        suggestions.append(dict(
+            medicine,
+            daily_usage=round(daily_usage, 2),
+            days_of_cover=round(days_of_cover, 1),
+            suggested_quantity=max(0, target - medicine['quantity_in_stock']),
+        ))
+    suggestions.sort(key=lambda row: (row['days_of_cover'], row['code']))
+
+    return {
+        'window_days': window_days,
+        'lead_time_days': lead_time_days,
+        'cover_days': cover_days,
+        'medicines': suggestions,
+    }
@@ -0,0 +1,66 @@
+import datetime
+import uuid
+
+from django.db import transaction
+from django.utils import timezone
+
+from .inventory import check_available, lock_stock
+from .models import StockReservation
+
+# Thời gian giữ chỗ mặc định cho một đơn thuốc đang soạn
+HOLD_MINUTES = 15
+SWEEP_BATCH_SIZE = 1000
+
+
+def reserve_stock(quantities, token=None, examination=None, reserved_by=None, minutes=HOLD_MINUTES):
+    """
+    Giữ chỗ {medicine_id: số lượng} cho một đơn thuốc đang soạn trong `minutes` phút.
+
+    Các thuốc được khoá như khi xuất kho (lock_stock) nên hai đơn không thể cùng giữ
+    số lượng cuối cùng. Gọi lại với cùng `token` thì thay toàn bộ giữ chỗ cũ của đơn
+    (và gia hạn). Trả về (token, expires_at); ném InsufficientStockError nếu không đủ.
+    """
+    token = token or uuid.uuid4().hex
+    expires_at = timezone.now() + datetime.timedelta(minutes=minutes)
+    with transaction.atomic():
+        medicines, _ = lock_stock(quantities, reservation_token=token)
+        check_available(quantities, medicines)
+        StockReservation.objects.filter(token=token).delete()
+        StockReservation.objects.bulk_create([
+            StockReservation(
+                token=token,
+                medicine_id=medicine_id,
+                quantity=quantity,
+                examination=examination,
+                reserved_by=reserved_by,
+                expires_at=expires_at
+            )
+            for medicine_id, quantity in quantities.items()
+        ])
+    return token, expires_at
+
+
+def release_stock(token):
+    """Huỷ giữ chỗ của một đơn (đã lưu hoặc bỏ soạn). Trả về số dòng giữ chỗ đã xoá."""
+    deleted, _ = StockReservation.objects.filter(token=token).delete()
+    return deleted
+
+
+def sweep_expired_reservations(batch_size=SWEEP_BATCH_SIZE, now=None):
+    """
+    Xoá các giữ chỗ đã hết hạn theo từng lô `batch_size` dòng (chỉ mục expires_at) để
+    không giữ khoá lâu trên bảng. Giữ chỗ hết hạn vốn đã không được tính vào tồn kho
+    khả dụng, việc dọn chỉ giữ bảng nhỏ. Trả về số dòng đã xoá.
+    """
+    now = now or timezone.now()
+    total = 0
+    while True:
+        ids = list(
+            StockReservation.objects.filter(expires_at__lte=now).order_by('expires_at').values_list(
+                'pk', flat=True
+            )[:batch_size]
+        )
+        if not ids:
+            return total
+        deleted, _ = StockReservation.objects.filter(pk__in=ids).delete()
+        total += deleted
@@ -0,0 +1,62 @@
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Case, F, FloatField, IntegerField, Q, Value, When
+from django.contrib.postgres.search import TrigramWordSimilarity
+
+from .models import Medicine
+
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+
+# Các trường form kê đơn cần: hiển thị, kiểm tra tồn kho và điền giá
+AUTOCOMPLETE_FIELDS = ('id', 'code', 'name', 'unit', 'quantity_in_stock', 'price')
+
+
+def fold_text(value):
+    """
+    Chuẩn hoá chuỗi để tìm kiếm: bỏ dấu tiếng Việt (kể cả đ -> d), viết thường
+    và gộp khoảng trắng, ví dụ 'Amoxicillin Đặc trị' -> 'amoxicillin dac tri'.
+    """
+    value = unicodedata.normalize('NFD', value or '')
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    value = value.replace('đ', 'd').replace('Đ', 'D').lower()
+    return re.sub(r'\s+', ' ', value).strip()
+
+
+def medicine_autocomplete(term, limit=AUTOCOMPLETE_LIMIT):
+    """
+    Gợi ý thuốc đang sử dụng theo tên hoặc mã, so khớp trên các cột không dấu.
+
+    Xếp hạng: trùng mã, mã bắt đầu bằng từ khoá, tên bắt đầu bằng từ khoá, một từ
+    trong tên bắt đầu bằng từ khoá, rồi tới kết quả gần đúng (trigram, chỉ trên
+    PostgreSQL); cùng hạng thì theo độ tương đồng rồi theo tên.
+    Trả về danh sách dict chỉ gồm AUTOCOMPLETE_FIELDS.
+    """
+    term = fold_text(term)
+    if not term:
+        return []
+
+    word_prefix = Q(name_normalized__contains=f' {term}')
+    condition = Q(code_normalized__startswith=term) | Q(name_normalized__startswith=term) | word_prefix
+    if connection.vendor == 'postgresql':
+        condition |= Q(name_normalized__trigram_word_similar=term) | Q(code_normalized__trigram_word_similar=term)
+        similarity = TrigramWordSimilarity(term, 'name_normalized')
+    else:
+        condition |= Q(name_normalized__contains=term)
+        similarity = Value(0.0, output_field=FloatField())
+
+    return list(
+        Medicine.objects.filter(condition, is_active=True).annotate(
+            match_rank=Case(
+                When(code_normalized=term, then=Value(0)),
+                When(code_normalized__startswith=term, then=Value(1)),
+                When(name_normalized__startswith=term, then=Value(2)),
+                When(word_prefix, then=Value(3)),
+                default=Value(4),
+                output_field=IntegerField(),
+            ),
+            similarity=similarity,
+        ).order_by('match_rank', F('similarity').desc(), 'name').values(*AUTOCOMPLETE_FIELDS)[:limit]
+    )
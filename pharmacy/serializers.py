@@ -1,9 +1,16 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import Q
 from rest_framework import serializers
 from .models import Medicine, Prescription, PrescriptionItem, MedicineStock
+from .inventory import InsufficientStockError, allocate_fefo, available_stock, receive_lot
+from .reservations import release_stock, reserve_stock
+from medical_records.models import Examination
 from medical_records.serializers import ExaminationSerializer
+from core.serializers import DynamicFieldsMixin
 
 
-class MedicineSerializer(serializers.ModelSerializer):
+class MedicineSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for Medicine model."""
     
     class Meta:
@@ -13,7 +20,7 @@ class MedicineSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'created_at', 'updated_at')
 
 
-class PrescriptionItemSerializer(serializers.ModelSerializer):
+class PrescriptionItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for PrescriptionItem model."""
     
     medicine_detail = MedicineSerializer(source='medicine', read_only=True)
@@ -23,9 +30,10 @@ class PrescriptionItemSerializer(serializers.ModelSerializer):
         fields = ('id', 'prescription', 'medicine', 'medicine_detail',
                   'quantity', 'dosage', 'instructions', 'price')
         read_only_fields = ('id',)
+        expandable_fields = ('medicine_detail',)
 
 
-class PrescriptionSerializer(serializers.ModelSerializer):
+class PrescriptionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for Prescription model."""
     
     items = PrescriptionItemSerializer(many=True, read_only=True)
@@ -36,6 +44,22 @@ class PrescriptionSerializer(serializers.ModelSerializer):
         fields = ('id', 'examination', 'examination_detail', 'prescription_date',
                   'notes', 'items')
         read_only_fields = ('id', 'prescription_date')
+        expandable_fields = ('examination_detail', 'items')
+
+
+class PrescriptionListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Simplified serializer for listing prescriptions."""
+    
+    examination_date = serializers.DateField(source='examination.examination_date', read_only=True)
+    dentist_name = serializers.CharField(source='examination.dentist.full_name', read_only=True)
+    patient_name = serializers.CharField(source='examination.medical_record.patient.full_name', read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    total_amount = serializers.DecimalField(max_digits=12, decimal_places=0, read_only=True)
+    
+    class Meta:
+        model = Prescription
+        fields = ('id', 'examination', 'examination_date', 'dentist_name', 'patient_name',
+                  'prescription_date', 'notes', 'item_count', 'total_amount')
 
 
 class PrescriptionItemCreateSerializer(serializers.ModelSerializer):
@@ -47,58 +71,136 @@ class PrescriptionItemCreateSerializer(serializers.ModelSerializer):
     
     def validate_medicine(self, value):
         """Validate that the medicine exists and is active."""
-        try:
-            medicine = Medicine.objects.get(id=value.id, is_active=True)
-            if medicine.quantity_in_stock < self.initial_data.get('quantity', 0):
-                raise serializers.ValidationError("Số lượng thuốc trong kho không đủ.")
-            return value
-        except Medicine.DoesNotExist:
+        if not value.is_active:
             raise serializers.ValidationError("Thuốc không tồn tại hoặc không còn được sử dụng.")
+        return value
+    
+
+
+def requested_quantities(items):
+    """Số lượng gộp theo thuốc (một thuốc có thể xuất hiện ở nhiều dòng)."""
+    quantities = defaultdict(int)
+    for item in items:
+        quantities[item['medicine'].id] += item['quantity']
+    return quantities
+
+
+def validate_available(items, reservation_token=None):
+    """
+    Kiểm tra sơ bộ tồn kho khả dụng (tồn kho - giữ chỗ của đơn khác) cho cả đơn bằng
+    một truy vấn. Khi lưu, allocate_fefo/reserve_stock kiểm tra lại trên các dòng đã khoá.
+    """
+    quantities = requested_quantities(items)
+    available = available_stock(quantities, exclude_token=reservation_token)
+    errors = [
+        f"Số lượng thuốc {item['medicine'].name} trong kho không đủ (còn {max(available[item['medicine'].id], 0)}, "
+        f"cần {quantities[item['medicine'].id]})."
+        for item in {item['medicine'].id: item for item in items}.values()
+        if quantities[item['medicine'].id] > available[item['medicine'].id]
+    ]
+    if errors:
+        raise serializers.ValidationError({'items': errors})
 
 
 class PrescriptionCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating Prescription with nested items."""
     
     items = PrescriptionItemCreateSerializer(many=True)
+    # Mã giữ chỗ của đơn đang soạn: số lượng đã giữ được dùng và giữ chỗ được huỷ khi lưu
+    reservation_token = serializers.CharField(write_only=True, required=False, max_length=32)
     
     class Meta:
         model = Prescription
-        fields = ('examination', 'notes', 'items')
+        fields = ('examination', 'notes', 'items', 'reservation_token')
+    
+    def validate(self, data):
+        """Validate that there is enough available stock for the whole prescription."""
+        validate_available(data['items'], data.get('reservation_token'))
+        return data
     
     def create(self, validated_data):
         """Create a prescription with nested items and update medicine stock."""
         items_data = validated_data.pop('items', [])
-        prescription = Prescription.objects.create(**validated_data)
+        reservation_token = validated_data.pop('reservation_token', None)
+        quantities = requested_quantities(items_data)
         
-        for item_data in items_data:
-            medicine = item_data.pop('medicine')
-            quantity = item_data.get('quantity')
+        # Tổng tiền thuốc của hoá đơn được tính lại một lần khi giao dịch commit
+        with transaction.atomic():
+            prescription = Prescription.objects.create(**validated_data)
             
-            # Create prescription item
-            PrescriptionItem.objects.create(
-                prescription=prescription,
-                medicine=medicine,
-                price=medicine.price,
-                **item_data
-            )
+            # Xuất kho theo lô, hết hạn trước xuất trước (FEFO); thiếu thuốc thì rollback cả đơn
+            try:
+                allocations = allocate_fefo(quantities, reservation_token=reservation_token) if quantities else []
+            except InsufficientStockError as e:
+                raise serializers.ValidationError({'items': e.messages()})
+            if reservation_token:
+                release_stock(reservation_token)
             
-            # Update medicine stock
-            medicine.quantity_in_stock -= quantity
-            medicine.save()
+            patient_name = Examination.objects.filter(
+                pk=prescription.examination_id
+            ).values_list('medical_record__patient__full_name', flat=True).first()
             
-            # Create stock record
-            MedicineStock.objects.create(
-                medicine=medicine,
-                quantity=-quantity,
-                stock_type=MedicineStock.StockType.EXPORT,
-                reference=f"Prescription-{prescription.id}",
-                notes=f"Xuất thuốc theo đơn thuốc cho bệnh nhân {prescription.examination.medical_record.patient.full_name}"
-            )
+            PrescriptionItem.objects.bulk_create([
+                PrescriptionItem(prescription=prescription, price=item_data['medicine'].price, **item_data)
+                for item_data in items_data
+            ])
+            # Mỗi lô được xuất ghi một dòng sổ kho
+            MedicineStock.objects.bulk_create([
+                MedicineStock(
+                    medicine_id=medicine_id,
+                    lot=lot,
+                    quantity=-quantity,
+                    stock_type=MedicineStock.StockType.EXPORT,
+                    reference=f"Prescription-{prescription.id}",
+                    notes=f"Xuất thuốc theo đơn thuốc cho bệnh nhân {patient_name}"
+                )
+                for medicine_id, lot, quantity in allocations
+            ])
         
         return prescription
 
 
-class MedicineStockSerializer(serializers.ModelSerializer):
+class StockReservationItemSerializer(serializers.Serializer):
+    """Serializer for one line of a stock reservation request."""
+    
+    medicine = serializers.PrimaryKeyRelatedField(queryset=Medicine.objects.filter(is_active=True))
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class StockReservationSerializer(serializers.Serializer):
+    """Serializer for placing (or replacing) the stock holds of a draft prescription."""
+    
+    token = serializers.CharField(required=False, max_length=32)
+    examination = serializers.PrimaryKeyRelatedField(queryset=Examination.objects.all(), required=False)
+    items = StockReservationItemSerializer(many=True, allow_empty=False)
+    
+    def validate(self, data):
+        validate_available(data['items'], data.get('token'))
+        return data
+    
+    def create(self, validated_data):
+        try:
+            token, expires_at = reserve_stock(
+                requested_quantities(validated_data['items']),
+                token=validated_data.get('token'),
+                examination=validated_data.get('examination'),
+                reserved_by=self.context['request'].user if 'request' in self.context else None
+            )
+        except InsufficientStockError as e:
+            raise serializers.ValidationError({'items': e.messages()})
+        return {'token': token, 'expires_at': expires_at, 'items': validated_data['items']}
+    
+    def to_representation(self, instance):
+        return {
+            'token': instance['token'],
+            'expires_at': serializers.DateTimeField().to_representation(instance['expires_at']),
+            'items': [
+                {'medicine': item['medicine'].id, 'quantity': item['quantity']} for item in instance['items']
+            ],
+        }
+
+
+class MedicineStockSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Serializer for MedicineStock model."""
     
     medicine_detail = MedicineSerializer(source='medicine', read_only=True)
@@ -106,42 +208,51 @@ class MedicineStockSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = MedicineStock
-        fields = ('id', 'medicine', 'medicine_detail', 'quantity', 'stock_type',
+        fields = ('id', 'medicine', 'medicine_detail', 'lot', 'quantity', 'stock_type',
                   'stock_type_display', 'reference', 'notes', 'created_at')
-        read_only_fields = ('id', 'created_at', 'stock_type_display')
+        read_only_fields = ('id', 'lot', 'created_at', 'stock_type_display')
+        expandable_fields = ('medicine_detail',)
+
+
+class MedicineStockListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    """Simplified serializer for listing stock records."""
+    
+    medicine_code = serializers.CharField(source='medicine.code', read_only=True)
+    medicine_name = serializers.CharField(source='medicine.name', read_only=True)
+    
+    class Meta:
+        model = MedicineStock
+        fields = ('id', 'medicine', 'medicine_code', 'medicine_name', 'lot', 'quantity',
+                  'stock_type', 'reference', 'created_at')
 
 
 class MedicineImportSerializer(serializers.Serializer):
-    """Serializer for importing medicine to stock."""
+    """Serializer for importing a lot of medicine to stock."""
     
     medicine_id = serializers.IntegerField()
     quantity = serializers.IntegerField(min_value=1)
+    expiry_date = serializers.DateField(required=False)
+    lot_number = serializers.CharField(required=False, allow_blank=True, max_length=100)
     reference = serializers.CharField(required=False, allow_blank=True)
     notes = serializers.CharField(required=False, allow_blank=True)
     
     def validate_medicine_id(self, value):
-        """Validate that the medicine exists."""
+        """Validate that the medicine exists (or was only deactivated by the expiry sweep)."""
         try:
-            return Medicine.objects.get(id=value, is_active=True)
+            return Medicine.objects.get(Q(is_active=True) | Q(expired_on__isnull=False), id=value)
         except Medicine.DoesNotExist:
             raise serializers.ValidationError("Thuốc không tồn tại hoặc không còn được sử dụng.")
     
     def create(self, validated_data):
-        """Import medicine to stock."""
+        """Import a lot of medicine to stock."""
         medicine = validated_data.pop('medicine_id')
-        quantity = validated_data.get('quantity')
         
-        # Update medicine stock
-        medicine.quantity_in_stock += quantity
-        medicine.save()
-        
-        # Create stock record
-        stock_record = MedicineStock.objects.create(
-            medicine=medicine,
-            quantity=quantity,
-            stock_type=MedicineStock.StockType.IMPORT,
+        # Lô không khai báo hạn dùng thì lấy hạn dùng hiện tại của thuốc
+        return receive_lot(
+            medicine,
+            validated_data['quantity'],
+            expiry_date=validated_data.get('expiry_date', medicine.expiry_date),
+            lot_number=validated_data.get('lot_number', ''),
             reference=validated_data.get('reference', ''),
             notes=validated_data.get('notes', '')
         )
-        
-        return stock_record
\ No newline at end of file
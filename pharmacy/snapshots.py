@@ -0,0 +1,107 @@
+import calendar
+import datetime
+
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .models import Medicine, MedicineStock, MedicineStockSnapshot
+
+
+def end_of_day(day):
+    """Thời điểm 00:00 ngày hôm sau (theo múi giờ hiện tại): mốc chặn trên của sổ kho ngày `day`."""
+    return timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min))
+
+
+def month_end(day):
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def ledger_totals(start, end, medicine_ids=None):
+    """Tổng biến động sổ kho theo thuốc trong khoảng [start, end) - một truy vấn GROUP BY."""
+    ledger = MedicineStock.objects.filter(created_at__lt=end)
+    if start is not None:
+        ledger = ledger.filter(created_at__gte=start)
+    if medicine_ids is not None:
+        ledger = ledger.filter(medicine_id__in=medicine_ids)
+    return dict(
+        ledger.values('medicine_id').annotate(total=Sum('quantity')).order_by().values_list('medicine_id', 'total')
+    )
+
+
+def build_snapshots(until=None):
+    """
+    Tạo bản chụp tồn kho cuối tháng còn thiếu, từ tháng sau bản chụp gần nhất tới `until`
+    (mặc định: cuối tháng trước). Mỗi tháng chỉ cộng phần sổ kho phát sinh trong tháng vào
+    bản chụp trước đó, không quét lại toàn bộ lịch sử. Trả về danh sách ngày đã chụp.
+
+    `until` phải trước tháng hiện tại: bản chụp của tháng chưa kết thúc sẽ bỏ sót các
+    biến động sau đó (stock_as_of chỉ cộng sổ kho phát sinh sau ngày chụp).
+    """
+    last_month_end = timezone.localdate().replace(day=1) - datetime.timedelta(days=1)
+    if until is None:
+        until = last_month_end
+    elif until > last_month_end:
+        raise ValueError(f"Chỉ chụp được tồn kho của tháng đã kết thúc (tới {last_month_end}).")
+
+    last_date = MedicineStockSnapshot.objects.aggregate(last=Max('snapshot_date'))['last']
+    if last_date is not None:
+        balances = dict(
+            MedicineStockSnapshot.objects.filter(snapshot_date=last_date).values_list('medicine_id', 'quantity')
+        )
+        day = month_end(last_date + datetime.timedelta(days=1))
+    else:
+        balances = {}
+        first = MedicineStock.objects.order_by('created_at').values_list('created_at', flat=True).first()
+        if first is None:
+            return []
+        day = month_end(timezone.localtime(first).date())
+
+    built = []
+    while day <= until:
+        start = end_of_day(last_date) if last_date else None
+        for medicine_id, total in ledger_totals(start, end_of_day(day)).items():
+            balances[medicine_id] = balances.get(medicine_id, 0) + total
+        # Thuốc tồn 0 không cần lưu: không có bản chụp nghĩa là tồn 0
+        with transaction.atomic():
+            MedicineStockSnapshot.objects.bulk_create([
+                MedicineStockSnapshot(medicine_id=medicine_id, snapshot_date=day, quantity=quantity)
+                for medicine_id, quantity in balances.items() if quantity
+            ])
+        balances = {medicine_id: quantity for medicine_id, quantity in balances.items() if quantity}
+        built.append(day)
+        last_date = day
+        day = month_end(day + datetime.timedelta(days=1))
+    return built
+
+
+def stock_as_of(day, medicine_ids=None):
+    """
+    Tồn kho của các thuốc tại cuối ngày `day`: đọc bản chụp gần nhất không sau `day`
+    rồi chỉ cộng phần sổ kho phát sinh từ bản chụp đó tới hết ngày `day`.
+    Trả về {medicine_id: số lượng} (thuốc không có trong kết quả là tồn 0).
+    """
+    snapshots = MedicineStockSnapshot.objects.filter(snapshot_date__lte=day)
+    snapshot_date = snapshots.aggregate(last=Max('snapshot_date'))['last']
+
+    balances = {}
+    if snapshot_date is not None:
+        snapshots = snapshots.filter(snapshot_date=snapshot_date)
+        if medicine_ids is not None:
+            snapshots = snapshots.filter(medicine_id__in=medicine_ids)
+        balances = dict(snapshots.values_list('medicine_id', 'quantity'))
+
+    start = end_of_day(snapshot_date) if snapshot_date else None
+    for medicine_id, total in ledger_totals(start, end_of_day(day), medicine_ids).items():
+        balances[medicine_id] = balances.get(medicine_id, 0) + total
+    return {medicine_id: quantity for medicine_id, quantity in balances.items() if quantity}
+
+
+def stock_report_as_of(day, medicine_ids=None):
+    """Danh sách tồn kho tại cuối ngày `day` kèm mã/tên thuốc, dùng cho API và kiểm toán."""
+    balances = stock_as_of(day, medicine_ids)
+    medicines = Medicine.objects.filter(pk__in=balances).values('id', 'code', 'name', 'unit').order_by('name')
+    return {
+        'as_of': day,
+        'medicines': [dict(medicine, quantity=balances[medicine['id']]) for medicine in medicines],
+    }
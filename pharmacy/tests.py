@@ -1,3 +1,959 @@
-from django.test import TestCase
+import threading
+from datetime import date, datetime, time, timedelta
+from unittest.mock import patch
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from medical_records.models import MedicalRecord, Examination, DentalService, ExaminationService
+from .models import (
+    Medicine, MedicineLot, Prescription, PrescriptionItem, MedicineStock, MedicineStockSnapshot, StockImportFile,
+    StockReservation, MedicinePriceHistory
+)
+from .serializers import PrescriptionCreateSerializer, MedicineImportSerializer
+from .inventory import receive_lot
+from .snapshots import build_snapshots, stock_as_of
+from .reorder import reorder_suggestions
+from .search import fold_text, medicine_autocomplete
+from .imports import StockImportError, import_stock_file
+from .reconciliation import reconcile_stock
+from .expiry import expiry_dashboard, sweep_expired
+from .reservations import reserve_stock, sweep_expired_reservations
+from .inventory import InsufficientStockError
+from .pricing import medicine_prices, price_prescription_items
+from .movements import stock_movement_series
+from medical_records.pricing import price_examination_services
+
+
+def create_examination(suffix):
+    dentist = User.objects.create_user(
+        phone_number=f'091000{suffix}1',
+        full_name=f'Dentist {suffix}',
+        password='password123',
+        user_type=User.UserType.DENTIST
+    )
+    patient = User.objects.create_user(
+        phone_number=f'091000{suffix}2',
+        full_name=f'Patient {suffix}',
+        password='password123',
+        user_type=User.UserType.CUSTOMER
+    )
+    return Examination.objects.create(
+        medical_record=MedicalRecord.objects.create(patient=patient),
+        dentist=dentist,
+        examination_date=date.today(),
+        diagnosis='Viêm nướu'
+    )
+
+
+def create_medicine(code, quantity_in_stock):
+    return Medicine.objects.create(
+        code=code, name=f'Thuốc {code}', unit='viên', quantity_in_stock=quantity_in_stock,
+        expiry_date=date.today() + timedelta(days=365), price=2000
+    )
+
+
+def prescription_serializer(examination, medicine, quantity):
+    serializer = PrescriptionCreateSerializer(data={
+        'examination': examination.id,
+        'items': [{'medicine': medicine.id, 'quantity': quantity, 'dosage': '1 viên', 'instructions': 'Sau ăn'}],
+    })
+    serializer.is_valid(raise_exception=True)
+    return serializer
+
+
+class PrescriptionCreateTestCase(TestCase):
+    """Prescription creation decrements stock atomically and bulk-inserts items and ledger rows."""
+
+    def setUp(self):
+        self.examination = create_examination('01')
+        self.medicines = [create_medicine(f'A{i}', 10) for i in range(3)]
+
+    def test_create_decrements_stock_and_writes_ledger(self):
+        serializer = PrescriptionCreateSerializer(data={
+            'examination': self.examination.id,
+            'items': [
+                {'medicine': medicine.id, 'quantity': 2, 'dosage': '1 viên', 'instructions': 'Sau ăn'}
+                for medicine in self.medicines
+            ] + [{'medicine': self.medicines[0].id, 'quantity': 3, 'dosage': '1 viên', 'instructions': 'Tối'}],
+        })
+        serializer.is_valid(raise_exception=True)
+
+        # Savepoint, đơn thuốc, khoá thuốc + lô, UPDATE tồn kho, tên bệnh nhân,
+        # bulk_create dòng thuốc + sổ kho, release (chưa có lô nên không bulk_update lô)
+        with self.assertNumQueries(9):
+            prescription = serializer.save()
+
+        stock = dict(Medicine.objects.values_list('code', 'quantity_in_stock'))
+        self.assertEqual(stock, {'A0': 5, 'A1': 8, 'A2': 8})
+        self.assertEqual(prescription.items.count(), 4)
+        # Sổ kho ghi theo thuốc/lô được xuất, không theo dòng đơn
+        ledger = MedicineStock.objects.filter(reference=f'Prescription-{prescription.id}')
+        self.assertEqual(ledger.count(), 3)
+        self.assertTrue(all(row.notes.endswith('Patient 01') for row in ledger))
+
+    def test_stale_validation_cannot_drive_stock_negative(self):
+        # Hai dược sĩ cùng kiểm tra tồn kho (10) trước khi lưu
+        first = prescription_serializer(self.examination, self.medicines[0], 6)
+        second = prescription_serializer(create_examination('02'), self.medicines[0], 6)
+
+        first.save()
+        with self.assertRaises(serializers.ValidationError):
+            second.save()
+
+        self.medicines[0].refresh_from_db()
+        self.assertEqual(self.medicines[0].quantity_in_stock, 4)
+        self.assertEqual(Prescription.objects.count(), 1)
+        self.assertEqual(PrescriptionItem.objects.count(), 1)
+        self.assertEqual(MedicineStock.objects.count(), 1)
+
+
+class MedicineLotTestCase(TestCase):
+    """Imports create lots and dispensing allocates first-expiry-first-out."""
+
+    def setUp(self):
+        self.examination = create_examination('03')
+        self.medicine = create_medicine('L0', 0)
+        today = date.today()
+        # Nhập không theo thứ tự hạn dùng; một lô đã hết hạn
+        for lot_number, days, quantity in (('LATE', 300, 10), ('SOON', 30, 5), ('OLD', -1, 7)):
+            receive_lot(self.medicine, quantity, today + timedelta(days=days), lot_number=lot_number)
+
+    def lots(self):
+        return dict(self.medicine.lots.values_list('lot_number', 'quantity_remaining'))
+
+    def test_import_creates_lot_and_keeps_nearest_expiry(self):
+        serializer = MedicineImportSerializer(data={
+            'medicine_id': self.medicine.id, 'quantity': 4,
+            'expiry_date': (date.today() + timedelta(days=600)).isoformat(), 'lot_number': 'NEW'
+        })
+        serializer.is_valid(raise_exception=True)
+        stock_record = serializer.save()
+
+        self.medicine.refresh_from_db()
+        self.assertEqual(stock_record.lot.lot_number, 'NEW')
+        self.assertEqual(self.medicine.quantity_in_stock, 26)
+        # Hạn dùng của thuốc là hạn gần nhất còn hàng, không bị lô mới ghi đè
+        self.assertEqual(self.medicine.expiry_date, date.today() - timedelta(days=1))
+
+    def test_dispense_fefo_skips_expired_lots(self):
+        prescription_serializer(self.examination, self.medicine, 8).save()
+
+        self.assertEqual(self.lots(), {'SOON': 0, 'LATE': 7, 'OLD': 7})
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.quantity_in_stock, 14)
+        ledger = MedicineStock.objects.filter(stock_type=MedicineStock.StockType.EXPORT)
+        self.assertEqual(
+            sorted(ledger.values_list('lot__lot_number', 'quantity')), [('LATE', -3), ('SOON', -5)]
+        )
+
+        # Chỉ còn 7 viên còn hạn
+        serializer = prescription_serializer(create_examination('04'), self.medicine, 8)
+        with self.assertRaises(serializers.ValidationError):
+            serializer.save()
+
+    def test_untracked_legacy_stock_is_used_after_lots(self):
+        Medicine.objects.filter(pk=self.medicine.pk).update(quantity_in_stock=F('quantity_in_stock') + 20)
+        prescription_serializer(self.examination, self.medicine, 25).save()
+
+        self.assertEqual(self.lots(), {'SOON': 0, 'LATE': 0, 'OLD': 7})
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.quantity_in_stock, 17)
+        self.assertTrue(MedicineStock.objects.filter(lot__isnull=True, quantity=-10).exists())
+
+    def test_twenty_item_prescription_is_fixed_query_count(self):
+        medicines = [create_medicine(f'M{i:02d}', 0) for i in range(20)]
+        for medicine in medicines:
+            for days in (10, 20):
+                receive_lot(medicine, 3, date.today() + timedelta(days=days))
+        serializer = PrescriptionCreateSerializer(data={
+            'examination': self.examination.id,
+            'items': [
+                {'medicine': medicine.id, 'quantity': 4, 'dosage': '1 viên', 'instructions': 'Sau ăn'}
+                for medicine in medicines
+            ],
+        })
+        serializer.is_valid(raise_exception=True)
+
+        # Như trên, thêm một bulk_update cho các lô
+        with self.assertNumQueries(10):
+            serializer.save()
+        self.assertEqual(MedicineStock.objects.filter(stock_type=MedicineStock.StockType.EXPORT).count(), 40)
+        self.assertFalse(Medicine.objects.filter(pk__in=[m.id for m in medicines]).exclude(quantity_in_stock=2).exists())
+
+
+class PrescriptionConcurrencyTestCase(TransactionTestCase):
+    """Two pharmacists dispensing the last units at the same time cannot oversell."""
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_prescriptions(self):
+        medicine = create_medicine('C0', 10)
+        serializers_ = [
+            prescription_serializer(create_examination(f'1{i}'), medicine, 6) for i in range(2)
+        ]
+        barrier = threading.Barrier(len(serializers_))
+        results = []
+
+        def dispense(serializer):
+            try:
+                barrier.wait()
+                serializer.save()
+                results.append('ok')
+            except serializers.ValidationError:
+                results.append('short')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=dispense, args=(serializer,)) for serializer in serializers_]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        medicine.refresh_from_db()
+        self.assertEqual(sorted(results), ['ok', 'short'])
+        self.assertEqual(medicine.quantity_in_stock, 4)
+        self.assertEqual(MedicineStock.objects.filter(medicine=medicine).count(), 1)
+
+
+class StockSnapshotTestCase(TestCase):
+    """As-of-date stock reads the nearest month-end snapshot plus the ledger tail."""
+
+    def setUp(self):
+        self.medicine = create_medicine('S0', 0)
+        self.other = create_medicine('S1', 0)
+        # (ngày, thuốc, số lượng) trải trên 3 tháng
+        self.movements = [
+            (date(2026, 1, 5), self.medicine, 100),
+            (date(2026, 1, 20), self.medicine, -30),
+            (date(2026, 1, 31), self.other, 10),
+            (date(2026, 2, 10), self.medicine, -20),
+            (date(2026, 2, 28), self.other, -10),
+            (date(2026, 3, 3), self.medicine, 5),
+        ]
+        for day, medicine, quantity in self.movements:
+            row = MedicineStock.objects.create(
+                medicine=medicine, quantity=quantity, stock_type=MedicineStock.StockType.ADJUST
+            )
+            MedicineStock.objects.filter(pk=row.pk).update(
+                created_at=timezone.make_aware(datetime.combine(day, time(12)))
+            )
+
+    def expected(self, day):
+        balances = {}
+        for moved_on, medicine, quantity in self.movements:
+            if moved_on <= day:
+                balances[medicine.id] = balances.get(medicine.id, 0) + quantity
+        return {medicine_id: quantity for medicine_id, quantity in balances.items() if quantity}
+
+    def test_build_snapshots_incrementally(self):
+        self.assertEqual(build_snapshots(until=date(2026, 1, 31)), [date(2026, 1, 31)])
+        self.assertEqual(build_snapshots(until=date(2026, 3, 31)), [date(2026, 2, 28), date(2026, 3, 31)])
+        self.assertEqual(build_snapshots(until=date(2026, 3, 31)), [])
+        
+        snapshots = dict(
+            MedicineStockSnapshot.objects.filter(snapshot_date=date(2026, 2, 28)).values_list('medicine', 'quantity')
+        )
+        # Thuốc S1 tồn 0 thì không lưu bản chụp
+        self.assertEqual(snapshots, {self.medicine.id: 50})
+
+    def test_snapshots_of_current_month_are_rejected(self):
+        today = timezone.localdate()
+        for until in (today.replace(day=1), today, today + timedelta(days=40)):
+            with self.assertRaises(ValueError):
+                build_snapshots(until=until)
+        with self.assertRaises(CommandError):
+            call_command('build_stock_snapshots', until=today.isoformat())
+        self.assertFalse(MedicineStockSnapshot.objects.exists())
+
+    def test_stock_as_of_matches_full_ledger(self):
+        build_snapshots(until=date(2026, 2, 28))
+        for day in (date(2025, 12, 31), date(2026, 1, 19), date(2026, 1, 31),
+                    date(2026, 2, 15), date(2026, 3, 3), date(2026, 4, 1)):
+            self.assertEqual(stock_as_of(day), self.expected(day), day)
+        self.assertEqual(stock_as_of(date(2026, 3, 3), [self.other.id]), {})
+
+    def test_as_of_endpoint(self):
+        build_snapshots(until=date(2026, 1, 31))
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(
+            phone_number='0910009999', full_name='Staff Stock', password='password123',
+            user_type=User.UserType.STAFF
+        ))
+        response = client.get(reverse('medicine-stock-as-of'), {'date': '2026-02-15'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['code'], row['quantity']) for row in response.data['medicines']],
+            [('S0', 50), ('S1', 10)]
+        )
+        response = client.get(reverse('medicine-stock-as-of'), {'date': 'yesterday'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReorderSuggestionTestCase(TestCase):
+    """Reorder suggestions compare each medicine's stock with its own consumption rate."""
+
+    def setUp(self):
+        cache.clear()
+        # Cùng tồn 60 viên: thuốc F dùng 10 viên/ngày, thuốc S dùng 1 viên/ngày
+        self.fast = create_medicine('F0', 60)
+        self.slow = create_medicine('S0', 60)
+        yesterday = timezone.localdate() - timedelta(days=1)
+        rows = [(self.fast, -100), (self.fast, -200), (self.slow, -30)]
+        for medicine, quantity in rows + [(self.fast, 500)]:
+            stock_type = MedicineStock.StockType.EXPORT if quantity < 0 else MedicineStock.StockType.IMPORT
+            row = MedicineStock.objects.create(medicine=medicine, quantity=quantity, stock_type=stock_type)
+            MedicineStock.objects.filter(pk=row.pk).update(
+                created_at=timezone.make_aware(datetime.combine(yesterday, time(12)))
+            )
+        # Xuất kho hôm nay chưa được tính vào tốc độ tiêu thụ
+        MedicineStock.objects.create(medicine=self.slow, quantity=-1000, stock_type=MedicineStock.StockType.EXPORT)
+
+    def test_suggestions_use_per_medicine_velocity(self):
+        report = reorder_suggestions(lead_time_days=14, window_days=30, cover_days=30)
+
+        self.assertEqual(len(report['medicines']), 1)
+        row = report['medicines'][0]
+        self.assertEqual(row['code'], 'F0')
+        self.assertEqual(row['daily_usage'], 10)
+        self.assertEqual(row['days_of_cover'], 6)
+        self.assertEqual(row['suggested_quantity'], 10 * 44 - 60)
+
+    def test_rates_are_cached_and_stock_is_live(self):
+        reorder_suggestions()
+        Medicine.objects.filter(pk=self.fast.pk).update(quantity_in_stock=500)
+
+        # Chỉ còn truy vấn tồn kho
+        with self.assertNumQueries(1):
+            report = reorder_suggestions()
+        self.assertEqual(report['medicines'], [])
+
+    def test_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(
+            phone_number='0910008888', full_name='Staff Reorder', password='password123',
+            user_type=User.UserType.STAFF
+        ))
+        response = client.get(reverse('medicine-reorder-suggestions'), {'lead_time': '90'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['code'] for row in response.data['medicines']], ['F0', 'S0'])
+        response = client.get(reverse('medicine-reorder-suggestions'), {'window': '0'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MedicineAutocompleteTestCase(TestCase):
+    """Autocomplete matches folded names/codes and ranks prefix matches first."""
+
+    def setUp(self):
+        for code, name in (('PARA500', 'Paracetamol 500mg'), ('AMOX', 'Amoxicillin'),
+                           ('DT01', 'Nước súc miệng Đặc trị'), ('PA02', 'Thuốc giảm đau Para')):
+            Medicine.objects.create(code=code, name=name, unit='viên', expiry_date=date.today(), price=1000)
+        Medicine.objects.create(code='PARAOLD', name='Paracetamol cũ', unit='viên',
+                                expiry_date=date.today(), price=1000, is_active=False)
+
+    def test_fold_text(self):
+        self.assertEqual(fold_text('  Nước   súc miệng ĐẶC trị '), 'nuoc suc mieng dac tri')
+        medicine = Medicine.objects.get(code='DT01')
+        self.assertEqual(medicine.name_normalized, 'nuoc suc mieng dac tri')
+
+        medicine.name = 'Dung dịch Đỏ'
+        medicine.save(update_fields=['name'])
+        medicine.refresh_from_db()
+        self.assertEqual(medicine.name_normalized, 'dung dich do')
+
+    def test_ranking_and_diacritics(self):
+        with self.assertNumQueries(1):
+            results = medicine_autocomplete('PARA')
+        self.assertEqual([row['code'] for row in results], ['PARA500', 'PA02'])
+        self.assertEqual(set(results[0]), {'id', 'code', 'name', 'unit', 'quantity_in_stock', 'price'})
+
+        self.assertEqual([row['code'] for row in medicine_autocomplete('dac tri')], ['DT01'])
+        self.assertEqual([row['code'] for row in medicine_autocomplete('đặc')], ['DT01'])
+        self.assertEqual(medicine_autocomplete('   '), [])
+
+    def test_endpoint_for_dentist(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(
+            phone_number='0910007777', full_name='Dentist Search', password='password123',
+            user_type=User.UserType.DENTIST
+        ))
+        response = client.get(reverse('medicine-autocomplete'), {'q': 'amox', 'limit': '5'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['code'] for row in response.data], ['AMOX'])
+        response = client.get(reverse('medicine-autocomplete'), {'q': 'amox', 'limit': '500'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        # Các thao tác khác với danh mục thuốc vẫn chỉ dành cho nhân viên
+        self.assertEqual(client.get(reverse('medicine-list')).status_code, status.HTTP_403_FORBIDDEN)
+
+
+def stock_csv(rows):
+    header = 'code,name,unit,price,quantity,expiry_date,lot_number'
+    return '\n'.join([header] + [','.join(row) for row in rows]).encode()
+
+
+class StockImportTestCase(TestCase):
+    """Bulk stock import upserts the catalog, adds lots in bulk and is idempotent per file."""
+
+    def setUp(self):
+        self.existing = create_medicine('E0', 5)
+
+    def test_import_upserts_catalog_and_adds_stock(self):
+        rows = [
+            ('E0', 'Thuốc E0 mới', 'hộp', '"12,000"', '10', '2027-01-31', 'LOT-A'),
+            ('E0', '', '', '', '4', '31/12/2026', 'LOT-B'),
+        ] + [
+            (f'N{i:03d}', f'Thuốc mới {i}', 'viên', '1000', '20', '2027-06-30', '') for i in range(50)
+        ]
+        # Số truy vấn không phụ thuộc số dòng
+        with self.assertNumQueries(12):
+            result = import_stock_file(stock_csv(rows), file_name='supplier.csv')
+
+        self.assertEqual(result['created_medicine_count'], 50)
+        self.assertEqual(result['updated_medicine_count'], 1)
+        self.assertEqual(result['total_quantity'], 1014)
+
+        self.existing.refresh_from_db()
+        self.assertEqual(
+            (self.existing.name, self.existing.unit, self.existing.price, self.existing.quantity_in_stock),
+            ('Thuốc E0 mới', 'hộp', 12000, 19)
+        )
+        self.assertEqual(self.existing.name_normalized, 'thuoc e0 moi')
+        self.assertEqual(self.existing.expiry_date, date(2026, 12, 31))
+        self.assertEqual(Medicine.objects.get(code='N007').quantity_in_stock, 20)
+        # Thuốc mới và thuốc đổi giá được ghi lịch sử giá (E0 đã có dòng hôm nay, được cập nhật)
+        self.assertEqual(MedicinePriceHistory.objects.filter(effective_from=date.today()).count(), 51)
+        self.assertEqual(self.existing.price_history.get().price, 12000)
+        self.assertEqual(MedicineLot.objects.count(), 52)
+        ledger = MedicineStock.objects.filter(reference=f'StockImport-{result["import_id"]}')
+        self.assertEqual(ledger.count(), 52)
+
+    def test_same_file_is_imported_once(self):
+        data = stock_csv([('E0', '', '', '', '10', '2027-01-31', '')])
+        import_stock_file(data)
+        with self.assertRaises(StockImportError):
+            import_stock_file(data)
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.quantity_in_stock, 15)
+        self.assertEqual(StockImportFile.objects.count(), 1)
+
+    def test_other_integrity_errors_are_not_reported_as_duplicate_file(self):
+        data = stock_csv([('N1', 'Thuốc mới', 'viên', '1000', '10', '2027-01-31', '')])
+        # Vd. một lần nhập song song vừa tạo cùng mã thuốc N1
+        with patch('pharmacy.imports._apply_stock_import', side_effect=IntegrityError('medicine code')):
+            with self.assertRaises(IntegrityError):
+                import_stock_file(data)
+        self.assertFalse(StockImportFile.objects.exists())
+
+        # Lần nhập lại sau đó vẫn thành công
+        import_stock_file(data)
+        self.assertEqual(Medicine.objects.get(code='N1').quantity_in_stock, 10)
+
+    def test_invalid_lines_reject_whole_file(self):
+        data = stock_csv([
+            ('E0', '', '', '', '10', '2027-01-31', ''),
+            ('E0', '', '', '', '-3', '2027-01-31', ''),
+            ('X9', '', '', '', '10', '2027-01-31', ''),
+        ])
+        with self.assertRaises(StockImportError) as context:
+            import_stock_file(data)
+        self.assertEqual([error['line'] for error in context.exception.errors], [3])
+
+        data = stock_csv([('E0', '', '', '', '10', '2027-01-31', ''), ('X9', '', '', '', '10', '2027-01-31', '')])
+        with self.assertRaises(StockImportError) as context:
+            import_stock_file(data)
+        self.assertEqual([error['reason'] for error in context.exception.errors], ['unknown_medicine'])
+
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.quantity_in_stock, 5)
+        self.assertFalse(StockImportFile.objects.exists())
+
+    def test_bulk_import_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(
+            phone_number='0910006666', full_name='Staff Import', password='password123',
+            user_type=User.UserType.STAFF
+        ))
+        upload = SimpleUploadedFile('supplier.csv', stock_csv([('E0', '', '', '', '3', '2027-01-31', '')]))
+        response = client.post(reverse('medicine-stock-bulk-import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(StockImportFile.objects.get().imported_by.full_name, 'Staff Import')
+
+        upload.seek(0)
+        response = client.post(reverse('medicine-stock-bulk-import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StockReconciliationTestCase(TestCase):
+    """Stock drift is detected in bulk and fixed from the trusted side."""
+
+    def setUp(self):
+        self.medicines = [create_medicine(f'R{i}', 0) for i in range(3)]
+        for medicine in self.medicines:
+            receive_lot(medicine, 10, date.today() + timedelta(days=30))
+        # R1 bị sửa tay trong admin, R2 có dòng xuất kho làm sổ kho âm
+        Medicine.objects.filter(code='R1').update(quantity_in_stock=7)
+        MedicineStock.objects.create(
+            medicine=self.medicines[2], quantity=-15, stock_type=MedicineStock.StockType.EXPORT
+        )
+
+    def stock(self):
+        return dict(Medicine.objects.values_list('code', 'quantity_in_stock'))
+
+    def test_report_only(self):
+        with self.assertNumQueries(2):
+            result = reconcile_stock()
+        self.assertFalse(result['fixed'])
+        self.assertEqual([(row['code'], row['drift']) for row in result['drift']], [('R1', -3), ('R2', 15)])
+        self.assertFalse(MedicineStock.objects.filter(stock_type=MedicineStock.StockType.ADJUST).exists())
+
+    def test_fix_trusting_stock_writes_adjustments(self):
+        result = reconcile_stock(fix=True, trust='stock')
+
+        self.assertEqual(result['drift_count'], 2)
+        self.assertEqual(self.stock(), {'R0': 10, 'R1': 7, 'R2': 10})
+        self.assertEqual(reconcile_stock()['drift_count'], 0)
+        adjustments = MedicineStock.objects.filter(stock_type=MedicineStock.StockType.ADJUST)
+        self.assertEqual(sorted(adjustments.values_list('quantity', flat=True)), [-3, 15])
+
+    def test_fix_trusting_ledger_updates_stock(self):
+        reconcile_stock(fix=True, trust='ledger')
+
+        # Sổ kho R2 âm (-5): tồn kho về 0 và sổ kho được điều chỉnh +5
+        self.assertEqual(self.stock(), {'R0': 10, 'R1': 10, 'R2': 0})
+        self.assertEqual(reconcile_stock()['drift_count'], 0)
+        adjustments = MedicineStock.objects.filter(stock_type=MedicineStock.StockType.ADJUST)
+        self.assertEqual(list(adjustments.values_list('quantity', flat=True)), [5])
+
+
+class ExpirySweepTestCase(TestCase):
+    """The expiry sweep buckets stock by expiry window and deactivates fully expired medicines."""
+
+    def setUp(self):
+        cache.clear()
+        today = date.today()
+        # Hết hạn hoàn toàn / lô hết hạn nhưng còn lô dùng được / sắp hết hạn / còn xa
+        self.expired = create_medicine('X0', 0)
+        receive_lot(self.expired, 5, today - timedelta(days=3))
+        self.mixed = create_medicine('X1', 0)
+        receive_lot(self.mixed, 4, today - timedelta(days=1))
+        receive_lot(self.mixed, 6, today + timedelta(days=60))
+        self.soon = create_medicine('X2', 0)
+        receive_lot(self.soon, 8, today + timedelta(days=10))
+        self.later = create_medicine('X3', 0)
+        receive_lot(self.later, 9, today + timedelta(days=200))
+        # Thuốc cũ chưa theo lô, hết hạn nhưng không còn tồn
+        Medicine.objects.create(code='X4', name='Hết hàng', unit='viên', price=1000,
+                                expiry_date=today - timedelta(days=30))
+
+    def test_dashboard_buckets(self):
+        dashboard = expiry_dashboard()
+
+        self.assertEqual(dashboard['medicines']['expired'], {'medicine_count': 2, 'quantity': 15})
+        self.assertEqual(dashboard['medicines']['under_30_days'], {'medicine_count': 1, 'quantity': 8})
+        self.assertEqual(dashboard['lots']['expired'], {'lot_count': 2, 'medicine_count': 2, 'quantity': 9})
+        self.assertEqual(dashboard['lots']['under_90_days'], {'lot_count': 1, 'medicine_count': 1, 'quantity': 6})
+        self.assertEqual([row['code'] for row in dashboard['expiring_soon']], ['X0', 'X1', 'X2'])
+
+        with self.assertNumQueries(0):
+            expiry_dashboard()
+
+    def test_sweep_deactivates_fully_expired_only(self):
+        expired = sweep_expired()
+
+        self.assertEqual([medicine['code'] for medicine in expired], ['X0'])
+        self.assertEqual(
+            set(Medicine.objects.filter(is_active=False).values_list('code', flat=True)), {'X0'}
+        )
+        # Dashboard được làm mới sau khi rà soát
+        self.assertEqual(expiry_dashboard()['medicines']['expired'], {'medicine_count': 1, 'quantity': 10})
+
+    def test_restock_after_sweep_reactivates(self):
+        sweep_expired()
+        discontinued = create_medicine('X5', 0)
+        Medicine.objects.filter(pk=discontinued.pk).update(is_active=False)
+
+        # Lô đã hết hạn không bật lại thuốc
+        receive_lot(self.expired, 2, date.today() - timedelta(days=1))
+        self.assertFalse(Medicine.objects.get(pk=self.expired.pk).is_active)
+
+        serializer = MedicineImportSerializer(data={
+            'medicine_id': self.expired.id, 'quantity': 10, 'expiry_date': date.today() + timedelta(days=90)
+        })
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.expired.refresh_from_db()
+        self.assertEqual((self.expired.is_active, self.expired.expired_on), (True, None))
+        prescription_serializer(create_examination('09'), self.expired, 3)
+
+        # Thuốc bị ngừng sử dụng thủ công không được nhập lại
+        self.assertFalse(MedicineImportSerializer(data={'medicine_id': discontinued.id, 'quantity': 1}).is_valid())
+
+        # Nhập file: chỉ thuốc có lô còn hạn được bật lại
+        Medicine.objects.filter(code='X0').update(is_active=False, expired_on=date.today())
+        import_stock_file(stock_csv([
+            ('X0', '', '', '', '5', (date.today() + timedelta(days=30)).isoformat(), ''),
+            ('X5', '', '', '', '5', (date.today() + timedelta(days=30)).isoformat(), ''),
+        ]), file_name='restock.csv')
+        self.assertEqual(
+            dict(Medicine.objects.filter(code__in=['X0', 'X5']).values_list('code', 'is_active')),
+            {'X0': True, 'X5': False}
+        )
+
+    def test_dashboard_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(user=User.objects.create_user(
+            phone_number='0910005555', full_name='Staff Expiry', password='password123',
+            user_type=User.UserType.STAFF
+        ))
+        response = client.get(reverse('medicine-expiry-dashboard'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['medicines']['under_30_days']['medicine_count'], 1)
+
+
+class PrescriptionListTestCase(TestCase):
+    """Prescription list and detail responses cost a fixed number of queries."""
+
+    def setUp(self):
+        self.examination = create_examination('05')
+        self.record = self.examination.medical_record
+        self.medicines = [create_medicine(f'P{i}', 1000) for i in range(3)]
+        self.service = DentalService.objects.create(name='Cạo vôi', price=100000)
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.examination.dentist)
+
+    def create_prescriptions(self, count):
+        for _ in range(count):
+            examination = Examination.objects.create(
+                medical_record=self.record, dentist=self.examination.dentist,
+                examination_date=date.today(), diagnosis='Sâu răng'
+            )
+            ExaminationService.objects.create(examination=examination, service=self.service, price=100000)
+            prescription = Prescription.objects.create(examination=examination)
+            PrescriptionItem.objects.bulk_create([
+                PrescriptionItem(prescription=prescription, medicine=medicine, quantity=2,
+                                 dosage='1 viên', instructions='Sau ăn', price=medicine.price)
+                for medicine in self.medicines
+            ])
+
+    def test_list_query_count_is_constant(self):
+        url = reverse('prescription-list')
+        params = {'patient_id': self.record.patient_id}
+        self.create_prescriptions(3)
+        # COUNT cho phân trang + một trang
+        with self.assertNumQueries(2):
+            self.client.get(url, params)
+
+        self.create_prescriptions(27)
+        with self.assertNumQueries(2):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 30)
+        row = response.data['results'][0]
+        self.assertEqual((row['patient_name'], row['dentist_name']), ('Patient 05', 'Dentist 05'))
+        self.assertEqual((row['item_count'], row['total_amount']), (3, '12000'))
+
+    def test_detail_query_count(self):
+        self.create_prescriptions(1)
+        prescription = Prescription.objects.get()
+        # Phiên bản (ETag) + đơn thuốc kèm lần khám/nha sĩ + dòng thuốc + dịch vụ
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('prescription-detail', args=[prescription.id]))
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(response.data['items'][0]['medicine_detail']['code'], 'P0')
+        self.assertEqual(len(response.data['examination_detail']['services']), 1)
+
+        with self.assertNumQueries(3):
+            self.client.get(reverse('prescription-detail', args=[prescription.id]), {'fields': 'id,items'})
+
+
+class StockReservationTestCase(TestCase):
+    """Draft prescriptions hold stock; holds reduce availability until used or expired."""
+
+    def setUp(self):
+        self.medicine = create_medicine('H0', 10)
+        self.examination = create_examination('06')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.examination.dentist)
+
+    def test_holds_reduce_available_stock(self):
+        token, _ = reserve_stock({self.medicine.id: 7})
+        with self.assertRaises(InsufficientStockError):
+            reserve_stock({self.medicine.id: 4})
+
+        # Đơn khác chỉ còn 3 viên khả dụng
+        serializer = PrescriptionCreateSerializer(data={
+            'examination': create_examination('07').id,
+            'items': [{'medicine': self.medicine.id, 'quantity': 4, 'dosage': '1 viên', 'instructions': 'Sau ăn'}],
+        })
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('items', serializer.errors)
+
+        # Đơn giữ chỗ dùng được số lượng đã giữ và giữ chỗ được huỷ khi lưu
+        serializer = PrescriptionCreateSerializer(data={
+            'examination': self.examination.id,
+            'reservation_token': token,
+            'items': [{'medicine': self.medicine.id, 'quantity': 7, 'dosage': '1 viên', 'instructions': 'Sau ăn'}],
+        })
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.medicine.refresh_from_db()
+        self.assertEqual(self.medicine.quantity_in_stock, 3)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_replacing_holds_with_same_token(self):
+        token, _ = reserve_stock({self.medicine.id: 7})
+        self.assertEqual(reserve_stock({self.medicine.id: 9}, token=token)[0], token)
+        self.assertEqual(StockReservation.objects.get().quantity, 9)
+
+    def test_expired_holds_are_ignored_and_swept(self):
+        reserve_stock({self.medicine.id: 10}, minutes=-1)
+        for _ in range(4):
+            reserve_stock({self.medicine.id: 1}, minutes=-1)
+        # Giữ chỗ hết hạn không làm giảm tồn kho khả dụng
+        reserve_stock({self.medicine.id: 10})
+
+        with self.assertNumQueries(7):
+            self.assertEqual(sweep_expired_reservations(batch_size=2), 5)
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+    def test_reservation_endpoints(self):
+        url = reverse('prescription-reserve')
+        response = self.client.post(url, {
+            'examination': self.examination.id,
+            'items': [{'medicine': self.medicine.id, 'quantity': 6}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        token = response.data['token']
+        self.assertEqual(StockReservation.objects.get().reserved_by, self.examination.dentist)
+
+        response = self.client.post(url, {'items': [{'medicine': self.medicine.id, 'quantity': 6}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.delete(reverse('prescription-release', args=[token]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class PriceHistoryTestCase(TestCase):
+    """Price changes are kept as history and resolved per date, singly or in bulk."""
+
+    def setUp(self):
+        medicine_prices.clear()
+        self.medicine = create_medicine('G0', 100)
+        today = date.today()
+        self.past = today - timedelta(days=40)
+        # Lịch sử giá: 1.500 từ 60 ngày trước, 1.800 từ 20 ngày trước, hiện tại 2.000
+        MedicinePriceHistory.objects.bulk_create([
+            MedicinePriceHistory(medicine=self.medicine, price=1500, effective_from=today - timedelta(days=60)),
+            MedicinePriceHistory(medicine=self.medicine, price=1800, effective_from=today - timedelta(days=20)),
+        ])
+
+    def test_save_records_price_changes(self):
+        self.assertEqual(self.medicine.price_history.get(effective_from=date.today()).price, 2000)
+
+        medicine = Medicine.objects.get(pk=self.medicine.pk)
+        medicine.name = 'Đổi tên'
+        medicine.save()
+        self.assertEqual(medicine.price_history.count(), 3)
+
+        medicine.price = 2500
+        medicine.save()
+        medicine.price = 2600
+        medicine.save()
+        # Đổi giá nhiều lần trong ngày: giữ giá cuối cùng của ngày
+        self.assertEqual(medicine.price_history.count(), 3)
+        self.assertEqual(medicine_prices.price_on(medicine.id, date.today()), 2600)
+
+    def test_first_change_of_legacy_row_keeps_old_price(self):
+        # Thuốc có từ trước khi có bảng lịch sử giá
+        legacy = create_medicine('G2', 10)
+        legacy.price_history.all().delete()
+        month_ago = date.today() - timedelta(days=30)
+
+        legacy = Medicine.objects.get(pk=legacy.pk)
+        legacy.price = 3000
+        legacy.save()
+        self.assertEqual(medicine_prices.price_on(legacy.id, month_ago), 2000)
+        self.assertEqual(medicine_prices.price_on(legacy.id, date.today()), 3000)
+        self.assertEqual(legacy.price_history.count(), 2)
+
+        # Nhập file đổi giá một thuốc cũ chưa có lịch sử
+        imported = create_medicine('G3', 10)
+        imported.price_history.all().delete()
+        import_stock_file(
+            b'code,quantity,expiry_date,name,unit,price\nG3,5,2030-01-01,Thu\xe1\xbb\x91c G3,vi\xc3\xaan,2500\n',
+            file_name='legacy.csv'
+        )
+        self.assertEqual(medicine_prices.price_on(imported.id, month_ago), 2000)
+        self.assertEqual(medicine_prices.price_on(imported.id, date.today()), 2500)
+
+    def test_price_on_date_is_cached_for_past_days(self):
+        self.assertEqual(medicine_prices.price_on(self.medicine.id, self.past), 1500)
+        with self.assertNumQueries(0):
+            self.assertEqual(medicine_prices.price_on(self.medicine.id, self.past), 1500)
+        self.assertEqual(medicine_prices.price_on(self.medicine.id, date.today() - timedelta(days=5)), 1800)
+        # Trước khi có lịch sử thì dùng giá hiện tại
+        self.assertEqual(medicine_prices.price_on(self.medicine.id, date.today() - timedelta(days=90)), 2000)
+        self.assertEqual(medicine_prices.prices_on([self.medicine.id], self.past), {self.medicine.id: 1500})
+
+    def test_bulk_resolvers(self):
+        examination = create_examination('08')
+        other = create_medicine('G1', 100)
+        serializer = PrescriptionCreateSerializer(data={
+            'examination': examination.id,
+            'items': [
+                {'medicine': medicine.id, 'quantity': 1, 'dosage': '1 viên', 'instructions': 'Sau ăn'}
+                for medicine in (self.medicine, other)
+            ],
+        })
+        serializer.is_valid(raise_exception=True)
+        prescription = serializer.save()
+        Prescription.objects.filter(pk=prescription.pk).update(prescription_date=self.past)
+
+        with self.assertNumQueries(1):
+            prices = dict(price_prescription_items([prescription.id]).values_list('medicine__code', 'catalog_price'))
+        self.assertEqual(prices, {'G0': 1500, 'G1': 2000})
+
+        service = DentalService.objects.create(name='Trám răng', price=300000)
+        ExaminationService.objects.create(examination=examination, service=service)
+        Examination.objects.filter(pk=examination.pk).update(examination_date=self.past)
+        service.price_history.update(effective_from=self.past)
+        service.price = 350000
+        service.save()
+        self.assertEqual(service.price_history.count(), 2)
+        # Giá tại ngày khám là giá có hiệu lực lúc đó, không phải giá hiện tại
+        with self.assertNumQueries(1):
+            line = price_examination_services([examination.id]).get()
+        self.assertEqual((line.price, line.catalog_price), (300000, 300000))
+
+
+class StockMovementSeriesTestCase(TestCase):
+    """Stock movements bucketed per day/week/month in one query; the ledger list is cursor-paginated."""
+
+    def setUp(self):
+        self.medicine = create_medicine('T0', 0)
+        self.other = create_medicine('T1', 0)
+        StockType = MedicineStock.StockType
+        # 05/01/2026 là thứ Hai
+        for day, medicine, quantity, stock_type in (
+            (date(2026, 1, 5), self.medicine, 100, StockType.IMPORT),
+            (date(2026, 1, 5), self.medicine, -30, StockType.EXPORT),
+            (date(2026, 1, 5), self.other, 7, StockType.IMPORT),
+            (date(2026, 1, 7), self.medicine, 5, StockType.ADJUST),
+            (date(2026, 1, 14), self.medicine, -10, StockType.EXPORT),
+            (date(2026, 2, 2), self.medicine, 20, StockType.IMPORT),
+            (date(2026, 3, 1), self.medicine, 50, StockType.IMPORT),
+        ):
+            row = MedicineStock.objects.create(medicine=medicine, quantity=quantity, stock_type=stock_type)
+            MedicineStock.objects.filter(pk=row.pk).update(
+                created_at=timezone.make_aware(datetime.combine(day, time(12)))
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user(
+            phone_number='0910009996', full_name='Staff Timeline', password='password123',
+            user_type=User.UserType.STAFF
+        ))
+
+    def summary(self, series):
+        return [
+            (point['period'], point['imported'], point['exported'], point['adjusted'], point['net'])
+            for point in series['series']
+        ]
+
+    def test_series_buckets(self):
+        with self.assertNumQueries(1):
+            daily = stock_movement_series(date(2026, 1, 1), date(2026, 2, 28), medicine_id=self.medicine.id)
+        self.assertEqual(self.summary(daily), [
+            (date(2026, 1, 5), 100, 30, 0, 70),
+            (date(2026, 1, 7), 0, 0, 5, 5),
+            (date(2026, 1, 14), 0, 10, 0, -10),
+            (date(2026, 2, 2), 20, 0, 0, 20),
+        ])
+        self.assertEqual(daily['series'][0]['movement_count'], 2)
+
+        weekly = stock_movement_series(date(2026, 1, 1), date(2026, 2, 28), 'week', self.medicine.id)
+        self.assertEqual(self.summary(weekly), [
+            (date(2026, 1, 5), 100, 30, 5, 75),
+            (date(2026, 1, 12), 0, 10, 0, -10),
+            (date(2026, 2, 2), 20, 0, 0, 20),
+        ])
+        # Cả hai ngày đầu/cuối đều được tính; không lọc thuốc thì gộp mọi thuốc
+        monthly = stock_movement_series(date(2026, 1, 5), date(2026, 3, 1), 'month')
+        self.assertEqual(self.summary(monthly), [
+            (date(2026, 1, 1), 107, 40, 5, 72),
+            (date(2026, 2, 1), 20, 0, 0, 20),
+            (date(2026, 3, 1), 50, 0, 0, 50),
+        ])
+
+    def test_series_endpoint(self):
+        url = reverse('medicine-stock-series')
+        response = self.client.get(url, {
+            'date_from': '2026-01-01', 'date_to': '2026-01-31', 'interval': 'month', 'medicine_id': self.other.id
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.summary(response.data), [(date(2026, 1, 1), 7, 0, 0, 7)])
+
+        for params in (
+            {'date_from': '2026-01-01'},
+            {'date_from': '2026-02-01', 'date_to': '2026-01-01'},
+            {'date_from': '2026-01-01', 'date_to': '2026-01-31', 'interval': 'year'},
+            {'date_from': '2026-01-01', 'date_to': '2026-01-31', 'medicine_id': 'T0'},
+        ):
+            self.assertEqual(self.client.get(url, params).status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_ledger_list_is_cursor_paginated(self):
+        url = reverse('medicine-stock-list')
+        seen = []
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'page_size': 3})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('medicine_detail', response.data['results'][0])
+            seen += [(row['medicine_code'], row['quantity']) for row in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(seen), 7)
+        # Mới nhất trước
+        self.assertEqual(seen[0], ('T0', 50))
+        self.assertEqual(sorted(quantity for _, quantity in seen), [-30, -10, 5, 7, 20, 50, 100])
+
+    def test_cursor_pages_split_rows_with_same_created_at(self):
+        # Các dòng ghi bằng bulk_create có thể trùng created_at; ranh giới trang rơi vào giữa nhóm
+        MedicineStock.objects.bulk_create([
+            MedicineStock(medicine=self.other, quantity=i + 1, stock_type=MedicineStock.StockType.IMPORT)
+            for i in range(5)
+        ])
+        MedicineStock.objects.filter(medicine=self.other).update(
+            created_at=timezone.make_aware(datetime(2026, 1, 20, 12))
+        )
+        expected = list(MedicineStock.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(len(expected), 12)
+
+        url = reverse('medicine-stock-list')
+        pages = []
+        response = self.client.get(url, {'page_size': 4})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append([row['id'] for row in response.data['results']])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(sum(pages, []), expected)
+
+        # Đi ngược lại bằng liên kết previous cũng không lặp hay bỏ sót dòng nào
+        seen = []
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            seen = [row['id'] for row in response.data['results']] + seen
+        self.assertEqual(seen, sum(pages[:-1], []))
@@ -2,16 +2,32 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from django.db.models import Count, DecimalField, F, Prefetch, Sum
+from datetime import datetime
 
 from .models import Medicine, Prescription, PrescriptionItem, MedicineStock
 from .serializers import (
     MedicineSerializer, 
     PrescriptionSerializer, 
     PrescriptionCreateSerializer,
+    PrescriptionListSerializer,
     MedicineStockSerializer,
-    MedicineImportSerializer
+    MedicineStockListSerializer,
+    MedicineImportSerializer,
+    StockReservationSerializer
 )
 from accounts.permissions import IsDentistOrAdmin, IsStaffOrAdmin
+from core.pagination import StandardResultsSetPagination, TimelineCursorPagination
+from core.serializers import is_field_requested
+from core.conditional import ConditionalRetrieveMixin, related_version
+from medical_records.models import ExaminationService
+from .snapshots import stock_report_as_of
+from .search import AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_MAX_LIMIT, fold_text, medicine_autocomplete
+from .imports import StockImportError, import_stock_file
+from .expiry import expiry_dashboard
+from .movements import INTERVALS, MAX_SERIES_DAYS, stock_movement_series
+from .reservations import release_stock
+from .reorder import DEFAULT_COVER_DAYS, DEFAULT_LEAD_TIME_DAYS, DEFAULT_WINDOW_DAYS, reorder_suggestions
 
 
 class MedicineViewSet(viewsets.ModelViewSet):
@@ -30,7 +46,7 @@ class MedicineViewSet(viewsets.ModelViewSet):
         is_active = self.request.query_params.get('is_active')
         
         if name:
-            queryset = queryset.filter(name__icontains=name)
+            queryset = queryset.filter(name_normalized__contains=fold_text(name))
         
         if is_active is not None:
             queryset = queryset.filter(is_active=is_active == 'true')
@@ -46,13 +62,57 @@ class MedicineViewSet(viewsets.ModelViewSet):
         low_stock_medicines = Medicine.objects.filter(quantity_in_stock__lt=threshold)
         serializer = self.get_serializer(low_stock_medicines, many=True)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['GET'], url_path='autocomplete',
+            permission_classes=[IsAuthenticated, IsDentistOrAdmin | IsStaffOrAdmin])
+    def autocomplete(self, request):
+        """
+        Ranked medicine suggestions for the prescription form (?q=, optional ?limit=).
+        Matching ignores case and Vietnamese diacritics.
+        """
+        limit = request.query_params.get('limit', str(AUTOCOMPLETE_LIMIT))
+        if not limit.isdigit() or not 0 < int(limit) <= AUTOCOMPLETE_MAX_LIMIT:
+            return Response(
+                {"error": f"Invalid limit, expected 1-{AUTOCOMPLETE_MAX_LIMIT}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(medicine_autocomplete(request.query_params.get('q', ''), int(limit)))
+    
+    @action(detail=False, methods=['GET'], url_path='expiry-dashboard')
+    def expiry_dashboard(self, request):
+        """
+        Stock grouped by expiry window (expired, under 30 days, under 90 days)
+        for medicines and lots, with the medicines expiring first.
+        """
+        return Response(expiry_dashboard())
+    
+    @action(detail=False, methods=['GET'], url_path='reorder-suggestions')
+    def reorder_suggestions(self, request):
+        """
+        Medicines whose stock covers fewer days than the lead time, based on each
+        medicine's consumption rate (?lead_time=, ?window=, ?cover= in days).
+        """
+        params = {}
+        for name, default in (('lead_time', DEFAULT_LEAD_TIME_DAYS), ('window', DEFAULT_WINDOW_DAYS),
+                              ('cover', DEFAULT_COVER_DAYS)):
+            value = request.query_params.get(name, str(default))
+            if not value.isdigit() or int(value) == 0:
+                return Response(
+                    {"error": f"Invalid {name}, expected a positive number of days"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            params[name] = int(value)
+        return Response(reorder_suggestions(
+            lead_time_days=params['lead_time'], window_days=params['window'], cover_days=params['cover']
+        ))
 
 
-class PrescriptionViewSet(viewsets.ModelViewSet):
+class PrescriptionViewSet(ConditionalRetrieveMixin, viewsets.ModelViewSet):
     """ViewSet for managing prescriptions."""
     
     queryset = Prescription.objects.all()
     permission_classes = [IsAuthenticated, IsDentistOrAdmin]
+    pagination_class = StandardResultsSetPagination
     
     def get_serializer_class(self):
         """
@@ -60,19 +120,83 @@ class PrescriptionViewSet(viewsets.ModelViewSet):
         """
         if self.action == 'create':
             return PrescriptionCreateSerializer
+        if self.action == 'list':
+            return PrescriptionListSerializer
         return PrescriptionSerializer
     
     def get_queryset(self):
         """
-        Optionally filter prescriptions based on query parameters.
+        Optionally filter prescriptions based on query parameters, and apply the
+        select_related/prefetch_related plan the action's serializer needs so list
+        and detail responses cost a fixed number of queries.
         """
-        queryset = Prescription.objects.all()
+        queryset = Prescription.objects.order_by('-prescription_date', '-id')
         patient_id = self.request.query_params.get('patient_id')
         
         if patient_id:
             queryset = queryset.filter(examination__medical_record__patient_id=patient_id)
         
+        # Bỏ qua dữ liệu của các trường client không yêu cầu (?fields=/?expand=)
+        requested = lambda name: is_field_requested(self.request, name)
+        if self.action == 'list':
+            # PrescriptionListSerializer: tên nha sĩ/bệnh nhân và tổng hợp các dòng thuốc
+            if requested('examination_date'):
+                queryset = queryset.select_related('examination')
+            if requested('dentist_name'):
+                queryset = queryset.select_related('examination__dentist')
+            if requested('patient_name'):
+                queryset = queryset.select_related('examination__medical_record__patient')
+            if requested('item_count'):
+                queryset = queryset.annotate(item_count=Count('items'))
+            if requested('total_amount'):
+                queryset = queryset.annotate(total_amount=Sum(
+                    F('items__price') * F('items__quantity'), output_field=DecimalField(max_digits=12, decimal_places=0)
+                ))
+            return queryset
+        
+        # PrescriptionSerializer: các dòng thuốc (kèm thuốc) và lần khám (nha sĩ + dịch vụ)
+        if requested('items'):
+            queryset = queryset.prefetch_related(
+                Prefetch('items', queryset=PrescriptionItem.objects.select_related('medicine'))
+            )
+        if requested('examination_detail'):
+            queryset = queryset.select_related('examination__dentist').prefetch_related(
+                Prefetch('examination__services', queryset=ExaminationService.objects.select_related('service'))
+            )
         return queryset
+    
+    @action(detail=False, methods=['POST'], url_path='reservations')
+    def reserve(self, request):
+        """
+        Hold stock for a draft prescription for a limited time. Send the returned token
+        again to replace the holds, and with the prescription to consume them.
+        """
+        serializer = StockReservationSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['DELETE'], url_path=r'reservations/(?P<token>[0-9a-f]{32})')
+    def release(self, request, token=None):
+        """Release the stock holds of an abandoned draft prescription."""
+        release_stock(token)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    def get_version_annotations(self):
+        """Phiên bản của đơn thuốc: lần khám, nha sĩ, dịch vụ, các dòng thuốc và thông tin thuốc."""
+        return {
+            'examination_updated_at': F('examination__updated_at'),
+            'dentist_updated_at': F('examination__dentist__updated_at'),
+            **related_version('services', ExaminationService.objects.all(), 'examination', outer_ref='examination'),
+            **related_version(
+                'service_catalog', ExaminationService.objects.all(), 'examination', outer_ref='examination',
+                timestamp_field='service__updated_at'
+            ),
+            **related_version('items', PrescriptionItem.objects.all(), 'prescription'),
+            **related_version(
+                'medicines', PrescriptionItem.objects.all(), 'prescription', timestamp_field='medicine__updated_at'
+            ),
+        }
 
 
 class MedicineStockViewSet(viewsets.ModelViewSet):
@@ -81,12 +205,26 @@ class MedicineStockViewSet(viewsets.ModelViewSet):
     queryset = MedicineStock.objects.all()
     serializer_class = MedicineStockSerializer
     permission_classes = [IsAuthenticated, IsStaffOrAdmin]
+    pagination_class = TimelineCursorPagination
+    
+    def get_serializer_class(self):
+        """
+        Use a light serializer (medicine code and name only) for the ledger list.
+        """
+        if self.action == 'list':
+            return MedicineStockListSerializer
+        return MedicineStockSerializer
     
     def get_queryset(self):
         """
         Optionally filter stock records based on query parameters.
         """
         queryset = MedicineStock.objects.all()
+        if self.action == 'list':
+            if is_field_requested(self.request, 'medicine_code') or is_field_requested(self.request, 'medicine_name'):
+                queryset = queryset.select_related('medicine')
+        elif is_field_requested(self.request, 'medicine_detail'):
+            queryset = queryset.select_related('medicine')
         medicine_id = self.request.query_params.get('medicine_id')
         stock_type = self.request.query_params.get('stock_type')
         
@@ -98,6 +236,66 @@ class MedicineStockViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    @action(detail=False, methods=['GET'], url_path='as-of')
+    def as_of(self, request):
+        """
+        Stock of each medicine at the end of the given date (?date=YYYY-MM-DD, optional ?medicine_id=).
+        Reads the nearest snapshot and only sums the ledger rows recorded after it.
+        """
+        try:
+            day = datetime.strptime(request.query_params.get('date', ''), '%Y-%m-%d').date()
+        except ValueError:
+            return Response(
+                {"error": "Invalid date, expected YYYY-MM-DD"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        medicine_id = request.query_params.get('medicine_id')
+        if medicine_id is not None and not medicine_id.isdigit():
+            return Response(
+                {"error": "Invalid medicine_id"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        medicine_ids = [int(medicine_id)] if medicine_id else None
+        return Response(stock_report_as_of(day, medicine_ids))
+    
+    @action(detail=False, methods=['GET'], url_path='series')
+    def series(self, request):
+        """
+        Imported, exported and adjusted quantities per day, week or month
+        (?date_from=, ?date_to= as YYYY-MM-DD, optional ?interval=day|week|month, ?medicine_id=).
+        """
+        try:
+            date_from = datetime.strptime(request.query_params.get('date_from', ''), '%Y-%m-%d').date()
+            date_to = datetime.strptime(request.query_params.get('date_to', ''), '%Y-%m-%d').date()
+        except ValueError:
+            return Response(
+                {"error": "Invalid date_from/date_to, expected YYYY-MM-DD"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not 0 <= (date_to - date_from).days <= MAX_SERIES_DAYS:
+            return Response(
+                {"error": f"date_to must be on or after date_from and at most {MAX_SERIES_DAYS} days later"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        interval = request.query_params.get('interval', 'day')
+        if interval not in INTERVALS:
+            return Response(
+                {"error": f"Invalid interval, expected one of {', '.join(INTERVALS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        medicine_id = request.query_params.get('medicine_id')
+        if medicine_id is not None and not medicine_id.isdigit():
+            return Response(
+                {"error": "Invalid medicine_id"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(stock_movement_series(
+            date_from, date_to, interval, int(medicine_id) if medicine_id else None
+        ))
+    
     @action(detail=False, methods=['POST'], url_path='import')
     def import_medicine(self, request):
         """
@@ -110,4 +308,30 @@ class MedicineStockViewSet(viewsets.ModelViewSet):
                 MedicineStockSerializer(stock_record).data, 
                 status=status.HTTP_201_CREATED
             )
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=False, methods=['POST'], url_path='bulk-import')
+    def bulk_import(self, request):
+        """
+        Import a supplier CSV (code, quantity, expiry_date, optional lot_number, name,
+        unit, price, indication): upserts catalog rows and adds stock in bulk.
+        The same file can only be imported once.
+        """
+        upload = request.FILES.get('file')
+        if not upload:
+            return Response(
+                {"error": "Import file is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        dry_run = str(request.data.get('dry_run', '')).lower() in ['1', 'true', 'yes']
+        try:
+            result = import_stock_file(
+                upload.read(), imported_by=request.user, file_name=upload.name, dry_run=dry_run
+            )
+        except StockImportError as e:
+            return Response(
+                {"error": str(e), "lines": e.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(result, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)